@@ -0,0 +1,108 @@
+"""
+Benchmarks one worker run over the tests to compute of DATALAKE_DB_URL and
+PUMPKIN_DB_URL, for each way of computing them:
+- sequential: one test after the other
+- thread: WORKER_CONCURRENCY tests at once in a pool of threads
+- asyncio: WORKER_CONCURRENCY tests in progress at once, the loading, KPIs queries,
+statistical tests and results writes of the tests overlapping
+A local database answers without any network round trip: a latency in milliseconds
+can be added to each query to get closer to remote databases. The results of the
+tests are written: only run it against a local datalake.
+
+    WORKER_CONCURRENCY=4 python -m benchmarks.asyncio_worker 5
+"""
+
+import sys
+from time import perf_counter, sleep
+from typing import Callable, Dict, List
+
+from sqlalchemy import event
+
+from src.backend.config import Config
+from src.backend.database_service import (
+    get_datalake_connection,
+    get_pumpkin_connection,
+)
+from src.backend.db_models import ABTest
+from src.backend.utils.db_utils import get_tests_to_compute
+from src.backend.worker import (
+    _run_test_safely,
+    _run_tests_asynchronously,
+    _run_tests_in_threads,
+    get_transactions_snapshot,
+    TestRunReport,
+)
+
+
+def _run_tests_sequentially(tests: List[ABTest]) -> List[TestRunReport]:
+
+    datalake_connection = get_datalake_connection()
+    pumpkin_connection = get_pumpkin_connection()
+    transactions_snapshot = get_transactions_snapshot(
+        pumpkin_connection=pumpkin_connection,
+        datalake_connection=datalake_connection,
+        max_memory_bytes=Config().snapshot_max_memory_mb * 1024 * 1024,
+    )
+
+    return [
+        _run_test_safely(
+            datalake_connection=datalake_connection,
+            pumpkin_connection=pumpkin_connection,
+            test=test,
+            transactions_snapshot=transactions_snapshot,
+        )
+        for test in tests
+    ]
+
+
+RUNNERS = {
+    "sequential": _run_tests_sequentially,
+    "thread": _run_tests_in_threads,
+    "asyncio": _run_tests_asynchronously,
+}  # type: Dict[str, Callable[[List[ABTest]], List[TestRunReport]]]
+
+
+def _add_latency(latency_seconds: float) -> None:
+
+    # pylint: disable=W0613
+    def wait(connection, cursor, statement, parameters, context, executemany):
+        sleep(latency_seconds)
+
+    for connection in [get_datalake_connection(), get_pumpkin_connection()]:
+        event.listen(connection.engine, "before_cursor_execute", wait)
+
+
+def _benchmark(latency_ms: int) -> None:
+
+    _add_latency(latency_ms / 1000)
+    tests = get_tests_to_compute(get_datalake_connection())
+
+    durations = {}
+    for runner_name, run_tests in RUNNERS.items():
+        start = perf_counter()
+        tests_reports = run_tests(tests)
+        durations[runner_name] = perf_counter() - start
+        failed_tests_number = sum(
+            1 for test_report in tests_reports if test_report.error is not None
+        )
+        if failed_tests_number:
+            print("{}: {} failed tests".format(runner_name, failed_tests_number))
+
+    print(
+        "{} tests, {} ms per query, {} tests at once: {}".format(
+            len(tests),
+            latency_ms,
+            Config().worker_concurrency,
+            ", ".join(
+                "{} {:.2f} s ({:.1f}x)".format(
+                    runner_name, duration, durations["sequential"] / duration
+                )
+                for runner_name, duration in durations.items()
+            ),
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
@@ -0,0 +1,94 @@
+"""
+Runs distributed worker replicas (processes) at once against the datalake and
+Pumpkin of DATALAKE_DB_URL and PUMPKIN_DB_URL, and checks that each test to compute
+is computed by a single replica.
+The tests leases are deleted before each run: only run it against a local
+datalake.
+
+    python -m benchmarks.distributed_worker 1 2 4
+"""
+
+import multiprocessing
+import sys
+from collections import Counter
+from time import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from src.backend.database_service import (
+    get_datalake_connection,
+    get_pumpkin_connection,
+)
+from src.backend.db_models import PATT_SCHEMA_NAME, TestLease
+from src.backend.utils.db_utils import get_tests_to_compute
+from src.backend.worker import run_tests_distributed
+
+
+class _ReplicaRun(NamedTuple):
+
+    # The id and the error of each test computed by the replica
+    tests_reports: List[Tuple[int, Optional[str]]]
+    # Replicas processes being started one after the other, only their runs are
+    # timed
+    started_at: float
+    ended_at: float
+
+
+def _run_replica(replica_index: int) -> _ReplicaRun:
+
+    datalake_connection = get_datalake_connection()
+    started_at = time()
+    tests_reports = run_tests_distributed(
+        datalake_connection=datalake_connection,
+        pumpkin_connection=get_pumpkin_connection(),
+        tests=get_tests_to_compute(datalake_connection),
+    )
+
+    return _ReplicaRun(
+        tests_reports=[
+            (test_report.test_id, test_report.error) for test_report in tests_reports
+        ],
+        started_at=started_at,
+        ended_at=time(),
+    )
+
+
+def _benchmark(replicas_number: int) -> None:
+
+    get_datalake_connection().engine.execute(
+        "DELETE FROM {}.{}".format(PATT_SCHEMA_NAME, TestLease.__tablename__)
+    )
+
+    with multiprocessing.get_context("spawn").Pool(replicas_number) as pool:
+        replicas_runs = pool.map(_run_replica, range(replicas_number))
+    duration = max(replica_run.ended_at for replica_run in replicas_runs) - min(
+        replica_run.started_at for replica_run in replicas_runs
+    )
+    replicas_reports = [replica_run.tests_reports for replica_run in replicas_runs]
+
+    computations = Counter(
+        test_id
+        for replica_reports in replicas_reports
+        for test_id, _ in replica_reports
+    )
+    print(
+        "{} replica(s): {} tests computed in {:.2f} s, tests per replica {}, "
+        "{} tests computed more than once, {} failed computations".format(
+            replicas_number,
+            len(computations),
+            duration,
+            [len(replica_reports) for replica_reports in replicas_reports],
+            sum(1 for count in computations.values() if count > 1),
+            sum(
+                1
+                for replica_reports in replicas_reports
+                for _, error in replica_reports
+                if error is not None
+            ),
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    for benchmarked_replicas_number in [int(arg) for arg in sys.argv[1:]] or [1, 2, 4]:
+        _benchmark(benchmarked_replicas_number)
@@ -0,0 +1,81 @@
+"""
+Benchmarks the populations ingestion of a new test, against the datalake database
+given by DATALAKE_DB_URL (its PATT_DB_SCHEMA_NAME schema is created if needed).
+
+    python -m benchmarks.populations_ingestion 10000 100000 1000000
+"""
+
+import sys
+from datetime import datetime, timedelta
+from io import BytesIO
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from src.backend.database_service import get_datalake_connection
+from src.backend.db_models import ABTest, TestStatuses, initialize_db
+from src.backend.utils.db_utils import insert_new_test, delete_test_by_id
+from src.backend.utils.populations_file import read_populations_file
+
+
+def _get_populations_file(rows_number: int) -> BytesIO:
+
+    populations_file = BytesIO()
+    pd.DataFrame(
+        data={
+            "user_id": np.arange(rows_number),
+            "population_name": np.where(
+                np.arange(rows_number) % 2, "control", "variant"
+            ),
+        }
+    ).to_csv(populations_file, index=False)
+    populations_file.seek(0)
+
+    return populations_file
+
+
+def benchmark_ingestion(rows_number: int) -> float:
+    """
+    :return: Read and inserted rows per second, from a csv file
+    """
+
+    datalake_connection = get_datalake_connection()
+    populations_file = _get_populations_file(rows_number)
+    ab_test = ABTest(
+        name="benchmark_ingestion_{}".format(rows_number),
+        description="Populations ingestion benchmark",
+        start_date=datetime.utcnow(),
+        end_date=datetime.utcnow() + timedelta(days=7),
+        status=TestStatuses.new,
+    )
+
+    start = perf_counter()
+    test_id = insert_new_test(
+        datalake_connection=datalake_connection,
+        ab_test=ab_test,
+        populations_chunks=read_populations_file(
+            stream=populations_file, filename="populations.csv"
+        ),
+        kpis=["Transactions number"],
+    )
+    duration = perf_counter() - start
+
+    delete_test_by_id(datalake_connection=datalake_connection, test_id=test_id)
+
+    return rows_number / duration
+
+
+if __name__ == "__main__":
+
+    initialize_db(get_datalake_connection().engine)
+    for benchmarked_rows_number in [int(arg) for arg in sys.argv[1:]] or [
+        10000,
+        100000,
+        1000000,
+    ]:
+        print(
+            "{} rows: {:.0f} rows/second".format(
+                benchmarked_rows_number, benchmark_ingestion(benchmarked_rows_number)
+            )
+        )
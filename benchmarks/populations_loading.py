@@ -0,0 +1,116 @@
+"""
+Benchmarks the loading of a test's populations by the worker (get_test_populations)
+against the former ORM based loading, against the datalake database given by
+DATALAKE_DB_URL.
+
+    python -m benchmarks.populations_loading 100000 1000000
+"""
+
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from io import BytesIO
+from time import perf_counter
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.backend.database_service import DatabaseConnection, get_datalake_connection
+from src.backend.db_models import ABTest, TestedUser, TestStatuses, initialize_db
+from src.backend.utils.db_utils import (
+    insert_new_test,
+    delete_test_by_id,
+    get_test_populations,
+)
+from src.backend.utils.populations_file import read_populations_file
+
+
+def _get_test_populations_with_orm(
+    datalake_connection: DatabaseConnection, test_id: int
+):
+    """
+    The loading of populations as it was done before get_test_populations was
+    columnar
+    """
+
+    session = datalake_connection.session_maker()
+    populations = session.query(TestedUser).filter_by(test_id=test_id).all()
+    populations_data = [
+        {"name": population.population_name, "user_id": population.user_id}
+        for population in populations
+    ]
+    all_populations_df = pd.DataFrame(data=populations_data)
+    session.close()
+
+    return {
+        population_name: population_members["user_id"]
+        for population_name, population_members in all_populations_df.groupby("name")
+    }
+
+
+def _insert_test(datalake_connection: DatabaseConnection, rows_number: int) -> int:
+
+    populations_file = BytesIO()
+    pd.DataFrame(
+        data={
+            "user_id": np.arange(rows_number),
+            "population_name": np.where(
+                np.arange(rows_number) % 2, "control", "variant"
+            ),
+        }
+    ).to_csv(populations_file, index=False)
+    populations_file.seek(0)
+
+    return insert_new_test(
+        datalake_connection=datalake_connection,
+        ab_test=ABTest(
+            name="benchmark_loading_{}".format(rows_number),
+            description="Populations loading benchmark",
+            start_date=datetime.utcnow(),
+            end_date=datetime.utcnow() + timedelta(days=7),
+            status=TestStatuses.new,
+        ),
+        populations_chunks=read_populations_file(
+            stream=populations_file, filename="populations.csv"
+        ),
+        kpis=["Transactions number"],
+    )
+
+
+def _measure(load_populations: Callable, *args) -> Tuple[float, float]:
+    """
+    :return: The duration in seconds and the peak of allocated memory in MB
+    """
+
+    tracemalloc.start()
+    start = perf_counter()
+    load_populations(*args)
+    duration = perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, peak_memory / 1024 / 1024
+
+
+if __name__ == "__main__":
+
+    connection = get_datalake_connection()
+    initialize_db(connection.engine)
+    for benchmarked_rows_number in [int(arg) for arg in sys.argv[1:]] or [
+        100000,
+        1000000,
+    ]:
+        benchmarked_test_id = _insert_test(connection, benchmarked_rows_number)
+        for loading_name, loading_function in [
+            ("orm", _get_test_populations_with_orm),
+            ("columnar", get_test_populations),
+        ]:
+            print(
+                "{} rows, {}: {:.2f} s, {:.0f} MB peak".format(
+                    benchmarked_rows_number,
+                    loading_name,
+                    *_measure(loading_function, connection, benchmarked_test_id)
+                )
+            )
+        delete_test_by_id(connection, benchmarked_test_id)
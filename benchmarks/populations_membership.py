@@ -0,0 +1,143 @@
+"""
+Benchmarks the matching of the members of the populations of a test with the
+transactions numbers of the users of a window, no database needed:
+- merge: a left merge of the members ids of each population with the transactions
+numbers, once per population and KPI (the former pandas aggregation mode)
+- index: the window is encoded once per run, the membership index of the
+populations is built once per test, and all populations are matched at once for
+each KPI
+
+    python -m benchmarks.populations_membership 1000000 5000000
+"""
+
+import sys
+import uuid
+from time import perf_counter
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.backend.utils.tests_utils import (
+    ABTestPopulations,
+    encode_values_per_user,
+    UsersDictionary,
+)
+
+POPULATIONS_NUMBER = 2
+COUNT_COLUMNS = ["transactions_number", "owned_transactions_number"]
+
+
+def _get_users_ids(random_state: np.random.RandomState, users_number: int):
+
+    return np.array(
+        [
+            str(uuid.UUID(int=int(user_int)))
+            for user_int in random_state.randint(0, 2 ** 62, users_number)
+        ],
+        dtype=object,
+    )
+
+
+def _merge(
+    populations: ABTestPopulations, transactions_per_user_df: pd.DataFrame
+) -> float:
+
+    start = perf_counter()
+    for count_column in COUNT_COLUMNS:
+        valid_transactions_df = transactions_per_user_df[
+            transactions_per_user_df[count_column] > 0
+        ][["user_id", count_column]]
+        for users_ids in populations.values():
+            population_df = pd.merge(
+                left=pd.DataFrame(data=users_ids, columns=["user_id"]),
+                right=valid_transactions_df,
+                on=["user_id"],
+                how="left",
+            )
+            population_df.fillna(0, inplace=True)
+
+    return perf_counter() - start
+
+
+def _index(
+    populations: ABTestPopulations, transactions_per_user_df: pd.DataFrame
+) -> Tuple[float, float]:
+    """
+    :return: The durations of the encoding of the window, shared by all the tests of
+    a run, and of the matching of the populations of the test
+    """
+
+    start = perf_counter()
+    users_dictionary = UsersDictionary()
+    encoded_transactions_df = encode_values_per_user(
+        transactions_per_user_df, users_dictionary
+    )
+    encoding_duration = perf_counter() - start
+
+    start = perf_counter()
+    populations_index = populations.get_index(users_dictionary)
+    for count_column in COUNT_COLUMNS:
+        populations_index.get_populations_values(encoded_transactions_df, count_column)
+
+    return encoding_duration, perf_counter() - start
+
+
+def _benchmark(members_number: int, active_users_number: int) -> None:
+
+    random_state = np.random.RandomState(0)
+    active_users_ids = _get_users_ids(random_state, active_users_number)
+    transactions_numbers = random_state.poisson(3.0, active_users_number) + 1
+    transactions_per_user_df = pd.DataFrame(
+        data={
+            "user_id": active_users_ids,
+            "transactions_number": transactions_numbers,
+            "owned_transactions_number": random_state.binomial(
+                transactions_numbers, 0.5
+            ),
+        }
+    )
+
+    # Half of the members are active users
+    members_ids = np.concatenate(
+        [
+            active_users_ids[: members_number // 2],
+            _get_users_ids(random_state, members_number - members_number // 2),
+        ]
+    )
+    random_state.shuffle(members_ids)
+    populations = ABTestPopulations(
+        {
+            "population_{}".format(population_index): population_ids
+            for population_index, population_ids in enumerate(
+                np.array_split(members_ids, POPULATIONS_NUMBER)
+            )
+        }
+    )
+
+    merge_duration = _merge(populations, transactions_per_user_df)
+    encoding_duration, index_duration = _index(populations, transactions_per_user_df)
+    print(
+        "{} members, {} active users, {} populations, {} KPIs: merge {:.2f} s, "
+        "index {:.2f} s ({:.1f}x) after the window encoding {:.2f} s ({:.1f}x "
+        "including it)".format(
+            members_number,
+            active_users_number,
+            POPULATIONS_NUMBER,
+            len(COUNT_COLUMNS),
+            merge_duration,
+            index_duration,
+            merge_duration / index_duration,
+            encoding_duration,
+            merge_duration / (encoding_duration + index_duration),
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    benchmarked_sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for benchmarked_members_number, benchmarked_active_users_number in zip(
+        benchmarked_sizes[::2], benchmarked_sizes[1::2]
+    ):
+        _benchmark(benchmarked_members_number, benchmarked_active_users_number)
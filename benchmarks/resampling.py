@@ -0,0 +1,84 @@
+"""
+Benchmarks the resampling engine (permutation pvalues and bootstrap confidence
+intervals) on two populations of skewed transactions numbers, no database needed.
+
+    python -m benchmarks.resampling 100000 1000000
+"""
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from src.backend.config import Config
+from src.backend.resampling_engine import get_values_histogram, resample
+
+ITERATIONS = 10000
+
+
+def _get_transactions_numbers(
+    random_state: np.random.RandomState, users_number: int, mean: float
+) -> np.ndarray:
+    """
+    Skewed transactions numbers: most users have none, a few have many
+    """
+
+    return random_state.negative_binomial(0.3, 0.3 / (0.3 + mean), users_number)
+
+
+def _benchmark(users_number: int, processes: int) -> None:
+
+    random_state = np.random.RandomState(0)
+    config = Config()
+
+    start = perf_counter()
+    first_histogram = get_values_histogram(
+        _get_transactions_numbers(random_state, users_number, 2.0),
+        config.resampling_max_distinct_values,
+    )
+    second_histogram = get_values_histogram(
+        _get_transactions_numbers(random_state, users_number, 2.05),
+        config.resampling_max_distinct_values,
+    )
+    histograms_duration = perf_counter() - start
+
+    executor = ProcessPoolExecutor(processes) if processes > 1 else None
+    start = perf_counter()
+    result = resample(
+        first_histogram=first_histogram,
+        second_histogram=second_histogram,
+        iterations=ITERATIONS,
+        max_chunk_values=config.resampling_max_chunk_values,
+        seed=[config.resampling_seed],
+        confidence_level=config.resampling_confidence_level,
+        executor=executor,
+    )
+    resampling_duration = perf_counter() - start
+    if executor is not None:
+        executor.shutdown()
+
+    print(
+        "{} users per population, {} distinct values, {} process(es): "
+        "histograms {:.2f} s, {} iterations {:.2f} s ({:.0f} iterations/s), "
+        "pvalue {:.4f}, interval [{:.4f}, {:.4f}]".format(
+            users_number,
+            first_histogram.values.shape[0] + second_histogram.values.shape[0],
+            processes,
+            histograms_duration,
+            ITERATIONS,
+            resampling_duration,
+            ITERATIONS / resampling_duration,
+            *result
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    for benchmarked_users_number in [int(arg) for arg in sys.argv[1:]] or [
+        100000,
+        1000000,
+    ]:
+        for benchmarked_processes in [1, 4]:
+            _benchmark(benchmarked_users_number, benchmarked_processes)
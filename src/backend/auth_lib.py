@@ -1,12 +1,15 @@
 from datetime import datetime
-from typing import NamedTuple
+from threading import Lock
+from time import monotonic
+from typing import Dict, NamedTuple, Optional, Tuple
 
 from flask_bcrypt import Bcrypt
 from sqlalchemy.engine import Engine
 
+from src.backend.config import Config
 from src.backend.database_service import DatabaseConnection, get_datalake_connection
 from src.backend.db_models import PattUser, Roles
-from src.frontend.flask_app import build_app
+from src.frontend.flask_app import build_app, get_request_session
 
 # pylint: disable=R0903
 class UserStatus:
@@ -21,14 +24,73 @@ class UserAuthMessage(NamedTuple):
     user: object
 
 
+class UsersCache:
+    """
+    Keeps the loaded users for ttl_seconds, so that page loads do not query the
+    datalake each time. The cache belongs to one process: invalidating a user only
+    forgets it there, the other processes of the web app keep the stale user until
+    ttl_seconds are elapsed.
+    """
+
+    def __init__(self, ttl_seconds: int, max_size: int):
+
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._users = {}  # type: Dict[int, Tuple[float, PattUser]]
+        self._lock = Lock()
+
+    def get(self, user_id: int) -> Optional[PattUser]:
+
+        with self._lock:
+            cached_user = self._users.get(user_id)
+            if cached_user is None:
+                return None
+            if monotonic() - cached_user[0] > self.ttl_seconds:
+                del self._users[user_id]
+                return None
+            return cached_user[1]
+
+    def set(self, user_id: int, user: PattUser) -> None:
+
+        with self._lock:
+            if len(self._users) >= self.max_size:
+                # The oldest user is evicted
+                del self._users[min(self._users, key=lambda key: self._users[key][0])]
+            self._users[user_id] = (monotonic(), user)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """
+        Forgets users in the current process only, see ttl_seconds
+        :param user_id: The user to forget, all users are forgotten if None
+        """
+
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+USERS_CACHE = UsersCache(
+    ttl_seconds=Config().users_cache_ttl_seconds,
+    max_size=Config().users_cache_max_size,
+)
+
 login_manager = build_app().login_manager
 
 
 @login_manager.user_loader
 def load_user(user_id):
 
-    session = get_datalake_connection().session_maker()
-    user = session.query(PattUser).filter_by(id=int(user_id)).first()
+    user_id = int(user_id)
+    user = USERS_CACHE.get(user_id)
+    if user is None:
+        session = get_request_session(get_datalake_connection())
+        user = session.query(PattUser).filter_by(id=user_id).first()
+        if user is not None:
+            # The cached user must outlive the request session
+            session.expunge(user)
+            USERS_CACHE.set(user_id, user)
     return user
 
 
@@ -71,6 +133,7 @@ def confirm_user(db_engine: Engine, email: str):
         status=UserStatus.confirmed,
         updated_at=datetime.utcnow(),
     )
+    USERS_CACHE.invalidate()
 
 
 def login_user(datalake_connection: DatabaseConnection, email: str, password: str):
@@ -104,3 +167,4 @@ def update_user_password(
     user = session.query(PattUser).filter_by(email=email).first()
     user.password = new_password
     session.commit()
+    USERS_CACHE.invalidate(user.id)
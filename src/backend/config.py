@@ -17,3 +17,95 @@ class Config(NamedTuple):
     worker_frequency: int = int(
         environ.get("WORKER_FREQUENCY", "1")
     )  # Worker frequency in seconds
+
+    snapshot_max_memory_mb: int = int(
+        environ.get("SNAPSHOT_MAX_MEMORY_MB", "512")
+    )  # Memory bound of the transactions kept in a worker run snapshot
+
+    kpi_aggregation_mode: str = environ.get(
+        "KPI_AGGREGATION_MODE", "pandas"
+    )  # "pandas" or "sql": where transactions are counted per user
+
+    cuped_pre_period_days: int = int(
+        environ.get("CUPED_PRE_PERIOD_DAYS", "0")
+    )  # Transactions numbers before a test start reducing its KPIs variance, 0: off
+
+    pumpkin_chunk_size: int = int(
+        environ.get("PUMPKIN_CHUNK_SIZE", "100000")
+    )  # Rows read at once from Pumpkin server side cursors, bounds the worker memory
+
+    transactions_cache: bool = environ.get("TRANSACTIONS_CACHE", "0") == "1"
+    transactions_cache_revalidation_days: int = int(
+        environ.get("TRANSACTIONS_CACHE_REVALIDATION_DAYS", "3")
+    )  # Cached days younger than this are checked for late transactions
+
+    tests_scheduling: bool = environ.get("TESTS_SCHEDULING", "0") == "1"
+    tests_reconciliation_hours: int = int(
+        environ.get("TESTS_RECONCILIATION_HOURS", "24")
+    )  # Skipped tests are computed again after this, all their transactions counted
+
+    incremental_kpis: bool = environ.get("INCREMENTAL_KPIS", "0") == "1"
+    incremental_lag_seconds: int = int(
+        environ.get("INCREMENTAL_LAG_SECONDS", "60")
+    )  # Transactions younger than this lag are left to the next worker run
+    incremental_reconciliation_hours: int = int(
+        environ.get("INCREMENTAL_RECONCILIATION_HOURS", "24")
+    )  # Running transactions numbers are counted from scratch again after this
+
+    worker_pool: str = environ.get(
+        "WORKER_POOL", "thread"
+    )  # "thread", "process" or "asyncio"
+    distributed_worker: bool = environ.get("DISTRIBUTED_WORKER", "0") == "1"
+    worker_lease_seconds: int = int(
+        environ.get("WORKER_LEASE_SECONDS", "300")
+    )  # Distributed workers: a test of a dead worker is computed again after this
+    worker_concurrency: int = int(
+        environ.get("WORKER_CONCURRENCY", "1")
+    )  # Tests computed at once, 1 computes them one after the other
+    kpi_concurrency: int = int(
+        environ.get("KPI_CONCURRENCY", "1")
+    )  # KPIs of a test computed at once
+    pumpkin_max_concurrency: int = int(
+        environ.get("PUMPKIN_MAX_CONCURRENCY", "4")
+    )  # Pumpkin connections used at once by parallel tests
+
+    db_pool_size: int = int(environ.get("DB_POOL_SIZE", "5"))
+    db_max_overflow: int = int(environ.get("DB_MAX_OVERFLOW", "10"))
+    db_pool_timeout: int = int(environ.get("DB_POOL_TIMEOUT", "30"))  # In seconds
+    db_pool_recycle: int = int(
+        environ.get("DB_POOL_RECYCLE", "1800")
+    )  # Connections older than this number of seconds are replaced
+    db_pool_pre_ping: bool = environ.get("DB_POOL_PRE_PING", "1") == "1"
+
+    users_cache_ttl_seconds: int = int(
+        environ.get("USERS_CACHE_TTL_SECONDS", "30")
+    )  # Web app: how long a logged in user is kept in memory, and may be stale
+    users_cache_max_size: int = int(environ.get("USERS_CACHE_MAX_SIZE", "1000"))
+
+    populations_file_chunk_size: int = int(
+        environ.get("POPULATIONS_FILE_CHUNK_SIZE", "100000")
+    )  # Rows of an uploaded populations file read at once
+
+    sequential_testing: bool = environ.get("SEQUENTIAL_TESTING", "0") == "1"
+    sequential_alpha: float = float(
+        environ.get("SEQUENTIAL_ALPHA", "0.05")
+    )  # Sequential tests are stopped once their pvalues cross this risk
+    sequential_mixture_std: float = float(
+        environ.get("SEQUENTIAL_MIXTURE_STD", "0.1")
+    )  # The expected effects size, in pooled stds of the KPI
+
+    statistical_test: str = environ.get(
+        "STATISTICAL_TEST", "khi2"
+    )  # "khi2" or "resampling": how the populations of a test are compared
+    resampling_iterations: int = int(environ.get("RESAMPLING_ITERATIONS", "10000"))
+    resampling_max_chunk_values: int = int(
+        environ.get("RESAMPLING_MAX_CHUNK_VALUES", "10000000")
+    )  # Iterations times distinct values resampled at once, bounds the memory
+    resampling_max_distinct_values: int = int(
+        environ.get("RESAMPLING_MAX_DISTINCT_VALUES", "1000")
+    )  # Beyond, the values of a population are grouped in quantile bins
+    resampling_processes: int = int(environ.get("RESAMPLING_PROCESSES", "1"))
+    resampling_seed: int = int(environ.get("RESAMPLING_SEED", "0"))
+    resampling_confidence_level: float = float(
+        environ.get("RESAMPLING_CONFIDENCE_LEVEL", "0.95")
+    )
@@ -1,6 +1,8 @@
-from typing import NamedTuple
+import os
+from threading import BoundedSemaphore, Lock
+from typing import Dict, NamedTuple, Optional, Tuple
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
@@ -10,6 +12,18 @@ from src.backend.logger import getLogger
 logger = getLogger()
 
 
+class PoolCounters:
+    """
+    Counts the events of a connections pool since its creation
+    """
+
+    def __init__(self):
+
+        self.connections_opened = 0
+        self.connections_invalidated = 0
+        self.checkouts = 0
+
+
 class DatabaseConnection(NamedTuple):
     """
     This class models a database connection
@@ -17,21 +31,127 @@ class DatabaseConnection(NamedTuple):
 
     engine: Engine
     session_maker: sessionmaker
+    pool_counters: Optional[PoolCounters] = None
 
 
-def get_datalake_connection() -> DatabaseConnection:
+class PoolStatus(NamedTuple):
+
+    database: str
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    connections_opened: int
+    connections_invalidated: int
+    checkouts: int
+
+
+# The long-lived connections of the current process, by process id and database
+_CONNECTIONS = {}  # type: Dict[Tuple[int, str], DatabaseConnection]
+_CONNECTIONS_LOCK = Lock()
+
+
+def _count_pool_events(engine: Engine, pool_counters: PoolCounters) -> None:
+
+    # pylint: disable=W0612,W0613
+    @event.listens_for(engine, "connect")
+    def count_connection(dbapi_connection, connection_record):
+        pool_counters.connections_opened += 1
+
+    # pylint: disable=W0612,W0613
+    @event.listens_for(engine, "invalidate")
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        pool_counters.connections_invalidated += 1
+
+    # pylint: disable=W0612,W0613
+    @event.listens_for(engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_counters.checkouts += 1
+
+
+def _create_connection(url: str) -> DatabaseConnection:
+
+    config = Config()
+    engine = create_engine(
+        url,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle,
+        pool_pre_ping=config.db_pool_pre_ping,
+    )
+    pool_counters = PoolCounters()
+    _count_pool_events(engine, pool_counters)
 
-    engine = create_engine(Config().datalake_url)
-    session_maker = sessionmaker(bind=engine)
-    logger.info("Database connection to datalake is established !")
+    return DatabaseConnection(
+        engine=engine,
+        session_maker=sessionmaker(bind=engine),
+        pool_counters=pool_counters,
+    )
 
-    return DatabaseConnection(engine=engine, session_maker=session_maker)
+
+def _get_connection(database: str, url: str) -> DatabaseConnection:
+    """
+    Connections are built once per process: their pools are reused by all the
+    following calls. A forked process builds its own ones.
+    """
+
+    key = (os.getpid(), database)
+    with _CONNECTIONS_LOCK:
+        if key not in _CONNECTIONS:
+            connection = _create_connection(url)
+            if database == "pumpkin":
+                limit_concurrency(
+                    connection.engine,
+                    BoundedSemaphore(Config().pumpkin_max_concurrency),
+                )
+            _CONNECTIONS[key] = connection
+            logger.info("Database connection to {} is established !".format(database))
+
+    return _CONNECTIONS[key]
+
+
+def get_datalake_connection() -> DatabaseConnection:
+
+    return _get_connection("datalake", Config().datalake_url)
 
 
 def get_pumpkin_connection() -> DatabaseConnection:
 
-    engine = create_engine(Config().pumpkin_url)
-    session_maker = sessionmaker(bind=engine)
-    logger.info("Database connection to pumpkin prod is established !")
+    return _get_connection("pumpkin", Config().pumpkin_url)
+
+
+def get_pool_status(database: str, connection: DatabaseConnection) -> PoolStatus:
+
+    pool = connection.engine.pool
+    pool_counters = connection.pool_counters or PoolCounters()
+
+    return PoolStatus(
+        database=database,
+        size=pool.size(),
+        checked_in=pool.checkedin(),
+        checked_out=pool.checkedout(),
+        overflow=pool.overflow(),
+        connections_opened=pool_counters.connections_opened,
+        connections_invalidated=pool_counters.connections_invalidated,
+        checkouts=pool_counters.checkouts,
+    )
+
+
+def limit_concurrency(engine: Engine, semaphore) -> None:
+    """
+    Bounds the number of connections of engine used at once: a connection checkout
+    waits for the semaphore, that is released when the connection is given back.
+    :param semaphore: A threading or multiprocessing semaphore, shared by all the
+    engines that have to be bounded together
+    """
+
+    # pylint: disable=W0612,W0613
+    @event.listens_for(engine, "checkout")
+    def acquire(dbapi_connection, connection_record, connection_proxy):
+        semaphore.acquire()
 
-    return DatabaseConnection(engine=engine, session_maker=session_maker)
+    # pylint: disable=W0612,W0613
+    @event.listens_for(engine, "checkin")
+    def release(dbapi_connection, connection_record):
+        semaphore.release()
@@ -1,6 +1,9 @@
 from datetime import datetime
+from io import StringIO
 from os import environ
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
 
 from flask_bcrypt import Bcrypt
 from flask_login import UserMixin
@@ -14,7 +17,12 @@ from sqlalchemy import (
     Index,
     Float,
     ForeignKey,
+    case,
+    func,
+    inspect,
+    text,
 )
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -68,6 +76,21 @@ class ABTest(Base):
     results = relationship("ABTestResult", backref="test", lazy=True)
     kpis = relationship("KPI", backref="test", lazy=True)
 
+    @classmethod
+    def update_status(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        status: str,
+        updated_at: datetime,
+    ):
+
+        db_connection.execute(
+            cls.__table__.update()
+            .where(cls.__table__.c.id == test_id)
+            .values(status=status, updated_at=updated_at)
+        )
+
 
 class ABTestResult(Base):
 
@@ -95,50 +118,52 @@ class ABTestResult(Base):
     first_population_avg = Column(Float, nullable=False)
     second_population_avg = Column(Float, nullable=False)
     pvalue = Column(Float, nullable=False)
+    # Confidence interval of the second population avg minus the first one
+    difference_lower_bound = Column(Float)
+    difference_upper_bound = Column(Float)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
     @classmethod
     def upsert_test_results(
-        cls,
-        db_engine: engine,
-        test_id: int,
-        test_type: str,
-        kpi_name: str,
-        first_population_name: str,
-        second_population_name: str,
-        first_population_avg: float,
-        second_population_avg: float,
-        pvalue: float,
-        updated_at: datetime,
+        cls, db_connection: engine.Connection, test_results: List[dict]
     ):
-        query = """
-                INSERT INTO {0}.{1} 
-                    (test_id, test_type, kpi_name, first_population_name, second_population_name, first_population_avg, second_population_avg, pvalue, updated_at) 
-                    VALUES ({2}, '{3}', '{4}', '{5}', '{6}', {7}, {8}, {9}, '{10}') ON CONFLICT (test_id, kpi_name, first_population_name, second_population_name) DO UPDATE SET 
-                        test_id = excluded.test_id,
-                        test_type = excluded.test_type,
-                        kpi_name = excluded.kpi_name,
-                        first_population_name = excluded.first_population_name,
-                        second_population_name = excluded.second_population_name,
-                        first_population_avg = excluded.first_population_avg,
-                        second_population_avg = excluded.second_population_avg,
-                        pvalue = excluded.pvalue,
-                        updated_at = excluded.updated_at
-            """.format(
-            PATT_SCHEMA_NAME,
-            cls.__tablename__,
-            test_id,
-            test_type,
-            kpi_name,
-            first_population_name,
-            second_population_name,
-            first_population_avg,
-            second_population_avg,
-            pvalue,
-            updated_at,
+        """
+        Upserts the results of tests with one multi-row statement
+        :param test_results: test_id, test_type, kpi_name, first_population_name,
+        second_population_name, first_population_avg, second_population_avg, pvalue
+        and updated_at of each result, and optionally the difference_lower_bound and
+        difference_upper_bound of its confidence interval
+        """
+        if not test_results:
+            return
+
+        # All the rows of a multi-row insert must have the same columns
+        optional_values = dict(difference_lower_bound=None, difference_upper_bound=None)
+        query = postgresql.insert(cls.__table__).values(
+            [{**optional_values, **test_result} for test_result in test_results]
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[
+                "test_id",
+                "kpi_name",
+                "first_population_name",
+                "second_population_name",
+            ],
+            set_={
+                column: query.excluded[column]
+                for column in [
+                    "test_type",
+                    "first_population_avg",
+                    "second_population_avg",
+                    "pvalue",
+                    "difference_lower_bound",
+                    "difference_upper_bound",
+                    "updated_at",
+                ]
+            },
         )
 
-        db_engine.execute(query)
+        db_connection.execute(query)
 
 
 class KPI(Base):
@@ -156,49 +181,6 @@ class KPI(Base):
     name = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    @classmethod
-    def upsert_test_results(
-        cls,
-        db_engine: engine,
-        test_id: int,
-        test_type: str,
-        kpi_name: str,
-        first_population_name: str,
-        second_population_name: str,
-        first_population_avg: float,
-        second_population_avg: float,
-        pvalue: float,
-        updated_at: datetime,
-    ):
-        query = """
-                INSERT INTO {0}.{1} 
-                    (test_id, test_type, kpi_name, first_population_name, second_population_name, first_population_avg, second_population_avg, pvalue, updated_at) 
-                    VALUES ({2}, '{3}', '{4}', '{5}', '{6}', {7}, {8}, {9}, '{10}') ON CONFLICT (test_id, kpi_name, first_population_name, second_population_name) DO UPDATE SET 
-                        test_id = excluded.test_id,
-                        test_type = excluded.test_type,
-                        kpi_name = excluded.kpi_name,
-                        first_population_name = excluded.first_population_name,
-                        second_population_name = excluded.second_population_name,
-                        first_population_avg = excluded.first_population_avg,
-                        second_population_avg = excluded.second_population_avg,
-                        pvalue = excluded.pvalue,
-                        updated_at = excluded.updated_at
-            """.format(
-            PATT_SCHEMA_NAME,
-            cls.__tablename__,
-            test_id,
-            test_type,
-            kpi_name,
-            first_population_name,
-            second_population_name,
-            first_population_avg,
-            second_population_avg,
-            pvalue,
-            updated_at,
-        )
-
-        db_engine.execute(query)
-
 
 class TestedUser(Base):
     """
@@ -235,6 +217,892 @@ class TestedUser(Base):
         )
         return db_engine.execute(query)
 
+    @classmethod
+    def insert_populations(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        populations_df: pd.DataFrame,
+        chunk_size: int = 100000,
+    ) -> None:
+        """
+        Inserts the populations members in bulk: with COPY when the driver is
+        psycopg2, with multi-rows inserts otherwise
+        :param populations_df: user_id and population_name of every member
+        """
+        created_at = str(datetime.utcnow())
+        columns = ["user_id", "test_id", "population_name", "created_at"]
+        cursor = db_connection.connection.cursor()
+
+        try:
+            for chunk_start in range(0, populations_df.shape[0], chunk_size):
+                chunk_df = populations_df.iloc[chunk_start : chunk_start + chunk_size]
+                chunk_df = pd.DataFrame(
+                    data={
+                        "user_id": chunk_df["user_id"].values,
+                        "test_id": test_id,
+                        "population_name": chunk_df["population_name"].values,
+                        "created_at": created_at,
+                    },
+                    columns=columns,
+                )
+
+                if hasattr(cursor, "copy_expert"):
+                    chunk_csv = StringIO()
+                    chunk_df.to_csv(chunk_csv, index=False, header=False)
+                    chunk_csv.seek(0)
+                    cursor.copy_expert(
+                        "COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                            PATT_SCHEMA_NAME, cls.__tablename__, ", ".join(columns)
+                        ),
+                        chunk_csv,
+                    )
+                else:
+                    db_connection.execute(
+                        cls.__table__.insert(), chunk_df.to_dict(orient="records")
+                    )
+        finally:
+            cursor.close()
+
+
+class KPIUserCount(Base):
+    """
+    This models the running transactions number of one user for one KPI of a test,
+    as counted by the incremental KPIs computation
+    """
+
+    __tablename__ = "kpi_user_count"
+    __table_args__ = (
+        Index("ix_kpi_user_count", "test_id", "kpi_name", "user_id", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    kpi_name = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    transactions_number = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def add_transactions_numbers(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        kpi_name: str,
+        transactions_numbers: List[dict],
+        updated_at: datetime,
+    ):
+        """
+        Adds new transactions numbers to the users' running ones
+        :param transactions_numbers: user_id and transactions_number of every user
+        having new transactions
+        """
+        if not transactions_numbers:
+            return
+
+        query = """
+                INSERT INTO {0}.{1}
+                    (test_id, kpi_name, user_id, transactions_number, updated_at)
+                    VALUES (:test_id, :kpi_name, :user_id, :transactions_number, :updated_at)
+                ON CONFLICT (test_id, kpi_name, user_id) DO UPDATE SET
+                    transactions_number = {1}.transactions_number + excluded.transactions_number,
+                    updated_at = excluded.updated_at
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(
+            text(query),
+            [
+                dict(
+                    test_id=test_id,
+                    kpi_name=kpi_name,
+                    updated_at=updated_at,
+                    **transactions_number
+                )
+                for transactions_number in transactions_numbers
+            ],
+        )
+
+
+class KPIWatermark(Base):
+    """
+    This models up to when the transactions of one KPI of a test have been counted
+    in kpi_user_count
+    """
+
+    __tablename__ = "kpi_watermark"
+    __table_args__ = (
+        Index("ix_kpi_watermark", "test_id", "kpi_name", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    kpi_name = Column(String, nullable=False)
+    # The test start date the counts have been computed from
+    start_date = Column(DateTime, nullable=False)
+    # Transactions created up to this date (included) are counted
+    created_at = Column(DateTime, nullable=False)
+    # When the counts have been counted from scratch
+    recounted_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def advance_watermark(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        kpi_name: str,
+        start_date: datetime,
+        previous_created_at: Optional[datetime],
+        created_at: datetime,
+        updated_at: datetime,
+    ) -> bool:
+        """
+        Moves the watermark only if it is still the one the new transactions were
+        counted from: the row stays locked until the end of the transaction, so that
+        the counts of a concurrent run can not be added twice
+        :param previous_created_at: The watermark read before counting, None if the
+        KPI was counted from scratch
+        :return: Whether the watermark has been moved
+        """
+
+        if previous_created_at is None:
+            query = """
+                INSERT INTO {0}.{1}
+                    (test_id, kpi_name, start_date, created_at, recounted_at,
+                    updated_at)
+                    VALUES (:test_id, :kpi_name, :start_date, :created_at,
+                    :updated_at, :updated_at)
+                ON CONFLICT (test_id, kpi_name) DO NOTHING
+                RETURNING id
+            """
+        else:
+            query = """
+                UPDATE {0}.{1} SET
+                    created_at = :created_at,
+                    updated_at = :updated_at
+                WHERE test_id = :test_id AND kpi_name = :kpi_name
+                AND start_date = :start_date
+                AND created_at = :previous_created_at
+                RETURNING id
+            """
+
+        return (
+            db_connection.execute(
+                text(query.format(PATT_SCHEMA_NAME, cls.__tablename__)),
+                test_id=test_id,
+                kpi_name=kpi_name,
+                start_date=start_date,
+                previous_created_at=previous_created_at,
+                created_at=created_at,
+                updated_at=updated_at,
+            ).first()
+            is not None
+        )
+
+
+class KPIStatistics(Base):
+    """
+    This models the sufficient statistics of the values of one KPI for the members
+    of one population, over the cumulative window of the test (from its start date).
+    A member's values of two windows do not add up in its statistics (its squares
+    do not), so each KPI and population only has the statistics of its last window.
+    """
+
+    __tablename__ = "kpi_statistics"
+    __table_args__ = (
+        Index(
+            "ix_kpi_statistics",
+            "test_id",
+            "kpi_name",
+            "population_name",
+            "window_start",
+            unique=True,
+        ),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    kpi_name = Column(String, nullable=False)
+    population_name = Column(String, nullable=False)
+    window_start = Column(DateTime, nullable=False)
+    window_end = Column(DateTime, nullable=False)
+    users_number = Column(Integer, nullable=False)
+    values_sum = Column(Float, nullable=False)
+    values_sum_of_squares = Column(Float, nullable=False)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def replace_statistics(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        window_start: datetime,
+        window_end: datetime,
+        statistics: List[dict],
+        updated_at: datetime,
+    ):
+        """
+        Stores the statistics of a window, in place of all the ones of the test KPIs
+        :param statistics: kpi_name, population_name, users_number, values_sum,
+        values_sum_of_squares, min_value and max_value of each KPI and population
+        """
+        if not statistics:
+            return
+
+        delete_query = """
+                DELETE FROM {0}.{1}
+                WHERE test_id = :test_id AND kpi_name = ANY(:kpis_names)
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+        insert_query = """
+                INSERT INTO {0}.{1}
+                    (test_id, kpi_name, population_name, window_start, window_end,
+                    users_number, values_sum, values_sum_of_squares, min_value,
+                    max_value, updated_at)
+                    VALUES (:test_id, :kpi_name, :population_name, :window_start,
+                    :window_end, :users_number, :values_sum, :values_sum_of_squares,
+                    :min_value, :max_value, :updated_at)
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(
+            text(delete_query),
+            test_id=test_id,
+            kpis_names=sorted({statistic["kpi_name"] for statistic in statistics}),
+        )
+        db_connection.execute(
+            text(insert_query),
+            [
+                dict(
+                    test_id=test_id,
+                    window_start=window_start,
+                    window_end=window_end,
+                    updated_at=updated_at,
+                    **statistic
+                )
+                for statistic in statistics
+            ],
+        )
+
+    @classmethod
+    def get_statistics(
+        cls, db_connection: engine.Connection, test_id: int
+    ) -> pd.DataFrame:
+        """
+        :return: The statistics of each KPI and population of the test, over their
+        last window (older windows may have been stored by former versions)
+        """
+
+        query = """
+                SELECT DISTINCT ON (kpi_name, population_name)
+                    kpi_name,
+                    population_name,
+                    window_start,
+                    window_end,
+                    users_number,
+                    values_sum,
+                    values_sum_of_squares,
+                    min_value,
+                    max_value
+                FROM {0}.{1}
+                WHERE test_id = :test_id
+                ORDER BY kpi_name, population_name, window_end DESC
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return pd.read_sql_query(
+            text(query), db_connection, params={"test_id": test_id}
+        )
+
+
+class SequentialTestResult(Base):
+    """
+    This models the always valid pvalue of the sequential test of one KPI for one
+    pair of populations: the running minimum of the mSPRT pvalues computed since
+    the test start date, all with the same mixture
+    """
+
+    __tablename__ = "sequential_test_result"
+    __table_args__ = (
+        Index(
+            "ix_sequential_test_result",
+            "test_id",
+            "kpi_name",
+            "first_population_name",
+            "second_population_name",
+            unique=True,
+        ),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    kpi_name = Column(String, nullable=False)
+    first_population_name = Column(String, nullable=False)
+    second_population_name = Column(String, nullable=False)
+    # The test start date the pvalues have been computed from
+    start_date = Column(DateTime, nullable=False)
+    pvalue = Column(Float, nullable=False)
+    # Variance of the mSPRT mixture, fixed at the first computation having one
+    mixture_variance = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def get_mixture_variances(
+        cls, db_connection: engine.Connection, test_id: int, start_date: datetime
+    ) -> Dict[Tuple[str, str, str], float]:
+        """
+        :return: The mixture variances fixed since start_date, by kpi_name,
+        first_population_name and second_population_name
+        """
+
+        query = """
+                SELECT
+                    kpi_name,
+                    first_population_name,
+                    second_population_name,
+                    mixture_variance
+                FROM {0}.{1}
+                WHERE test_id = :test_id AND start_date = :start_date
+                AND mixture_variance IS NOT NULL
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return {
+            (
+                row["kpi_name"],
+                row["first_population_name"],
+                row["second_population_name"],
+            ): row["mixture_variance"]
+            for row in db_connection.execute(
+                text(query), test_id=test_id, start_date=start_date
+            )
+        }
+
+    @classmethod
+    def upsert_sequential_results(
+        cls, db_connection: engine.Connection, sequential_results: List[dict]
+    ) -> List[dict]:
+        """
+        Keeps the minimum of the stored and new pvalues, and the stored mixture
+        variance, unless the test start date has changed
+        :param sequential_results: test_id, kpi_name, first_population_name,
+        second_population_name, start_date, pvalue, mixture_variance and updated_at
+        of each result
+        :return: The kpi_name, first_population_name, second_population_name and
+        always valid pvalue of each result
+        """
+        if not sequential_results:
+            return []
+
+        table = cls.__table__
+        query = postgresql.insert(table).values(sequential_results)
+        is_same_start_date = table.c.start_date == query.excluded.start_date
+        query = query.on_conflict_do_update(
+            index_elements=[
+                "test_id",
+                "kpi_name",
+                "first_population_name",
+                "second_population_name",
+            ],
+            set_={
+                "pvalue": case(
+                    [
+                        (
+                            is_same_start_date,
+                            func.least(table.c.pvalue, query.excluded.pvalue),
+                        )
+                    ],
+                    else_=query.excluded.pvalue,
+                ),
+                "mixture_variance": case(
+                    [
+                        (
+                            is_same_start_date,
+                            func.coalesce(
+                                table.c.mixture_variance,
+                                query.excluded.mixture_variance,
+                            ),
+                        )
+                    ],
+                    else_=query.excluded.mixture_variance,
+                ),
+                "start_date": query.excluded.start_date,
+                "updated_at": query.excluded.updated_at,
+            },
+        ).returning(
+            table.c.kpi_name,
+            table.c.first_population_name,
+            table.c.second_population_name,
+            table.c.pvalue,
+        )
+
+        return [dict(row) for row in db_connection.execute(query)]
+
+
+class TransactionsPartition(Base):
+    """
+    This models one day of valid transactions materialized in
+    daily_transactions_count, with the number of valid transactions Pumpkin held for
+    this day at materialization: late transactions change this number.
+    """
+
+    __tablename__ = "transactions_partition"
+    __table_args__ = (
+        Index("ix_transactions_partition", "day", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(DateTime, nullable=False)
+    transactions_number = Column(Integer, nullable=False)
+    materialized_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def get_partitions(
+        cls, db_connection: engine.Connection, first_day: datetime, end_day: datetime
+    ) -> Dict[datetime, int]:
+        """
+        :return: The valid transactions number of each materialized day from
+        first_day (included) to end_day (excluded)
+        """
+
+        query = """
+                SELECT day, transactions_number FROM {0}.{1}
+                WHERE day >= :first_day AND day < :end_day
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return {
+            row["day"]: row["transactions_number"]
+            for row in db_connection.execute(
+                text(query), first_day=first_day, end_day=end_day
+            )
+        }
+
+    @classmethod
+    def upsert_partitions(
+        cls,
+        db_connection: engine.Connection,
+        partitions: List[dict],
+        materialized_at: datetime,
+    ):
+        """
+        :param partitions: day and transactions_number of each materialized day
+        """
+        if not partitions:
+            return
+
+        query = """
+                INSERT INTO {0}.{1} (day, transactions_number, materialized_at)
+                    VALUES (:day, :transactions_number, :materialized_at)
+                ON CONFLICT (day) DO UPDATE SET
+                    transactions_number = excluded.transactions_number,
+                    materialized_at = excluded.materialized_at
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(
+            text(query),
+            [
+                dict(materialized_at=materialized_at, **partition)
+                for partition in partitions
+            ],
+        )
+
+
+class DailyTransactionsCount(Base):
+    """
+    This models the valid transactions numbers of one user during one day, as read
+    from Pumpkin. Past days do not change, except for late transactions (see
+    transactions_partition).
+    """
+
+    __tablename__ = "daily_transactions_count"
+    __table_args__ = (
+        Index("ix_daily_transactions_count", "day", "user_id", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(DateTime, nullable=False)
+    user_id = Column(String, nullable=False)
+    transactions_number = Column(Integer, nullable=False)
+    owned_transactions_number = Column(Integer, nullable=False)
+
+    @classmethod
+    def delete_days(cls, db_connection: engine.Connection, days: List[datetime]):
+
+        query = """
+                DELETE FROM {0}.{1} WHERE day = ANY(:days)
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(text(query), days=days)
+
+    @classmethod
+    def insert_counts(cls, db_connection: engine.Connection, counts_df: pd.DataFrame):
+        """
+        Inserts the counts in bulk: with COPY when the driver is psycopg2, with a
+        multi-rows insert otherwise
+        :param counts_df: day, user_id, transactions_number and
+        owned_transactions_number of users
+        """
+        if counts_df.empty:
+            return
+
+        columns = ["day", "user_id", "transactions_number", "owned_transactions_number"]
+        counts_df = counts_df[columns]
+        cursor = db_connection.connection.cursor()
+
+        try:
+            if hasattr(cursor, "copy_expert"):
+                counts_csv = StringIO()
+                counts_df.to_csv(counts_csv, index=False, header=False)
+                counts_csv.seek(0)
+                cursor.copy_expert(
+                    "COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                        PATT_SCHEMA_NAME, cls.__tablename__, ", ".join(columns)
+                    ),
+                    counts_csv,
+                )
+            else:
+                db_connection.execute(
+                    cls.__table__.insert(), counts_df.to_dict(orient="records")
+                )
+        finally:
+            cursor.close()
+
+    @classmethod
+    def get_counts_per_user(
+        cls, db_connection: engine.Connection, first_day: datetime, end_day: datetime
+    ) -> pd.DataFrame:
+        """
+        :return: user_id, transactions_number and owned_transactions_number of every
+        user having transactions from first_day (included) to end_day (excluded)
+        """
+
+        query = """
+                SELECT
+                    user_id,
+                    SUM(transactions_number) AS transactions_number,
+                    SUM(owned_transactions_number) AS owned_transactions_number
+                FROM {0}.{1}
+                WHERE day >= :first_day AND day < :end_day
+                GROUP BY user_id
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return pd.read_sql_query(
+            text(query),
+            db_connection,
+            params={"first_day": first_day, "end_day": end_day},
+        )
+
+
+class TestRun(Base):
+    """
+    This models the last computation of a test by the worker: the signature of its
+    inputs, how long it took and how many transactions it read, so that unchanged
+    tests are skipped and heavy ones are spread across worker runs
+    """
+
+    __tablename__ = "test_run"
+    __table_args__ = (
+        Index("ix_test_run", "test_id", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    inputs_signature = Column(String)
+    duration_seconds = Column(Float)
+    transactions_number = Column(Integer)
+    # The last valid transaction of the test window at its computation
+    last_transaction_at = Column(DateTime)
+    # Number of worker runs the test has been deferred to since its computation
+    deferred_runs = Column(Integer, nullable=False, default=0)
+    computed_at = Column(DateTime)
+
+    @classmethod
+    def get_runs(cls, db_connection: engine.Connection) -> Dict[int, dict]:
+        """
+        :return: The last run of each test, by test id
+        """
+
+        query = """
+                SELECT
+                    test_id,
+                    inputs_signature,
+                    duration_seconds,
+                    transactions_number,
+                    last_transaction_at,
+                    deferred_runs,
+                    computed_at
+                FROM {0}.{1}
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return {row["test_id"]: dict(row) for row in db_connection.execute(query)}
+
+    @classmethod
+    def upsert_runs(cls, db_connection: engine.Connection, runs: List[dict]):
+        """
+        :param runs: test_id, inputs_signature, duration_seconds, transactions_number,
+        last_transaction_at and computed_at of each computed test
+        """
+        if not runs:
+            return
+
+        query = """
+                INSERT INTO {0}.{1}
+                    (test_id, inputs_signature, duration_seconds, transactions_number,
+                    last_transaction_at, deferred_runs, computed_at)
+                    VALUES (:test_id, :inputs_signature, :duration_seconds,
+                    :transactions_number, :last_transaction_at, 0, :computed_at)
+                ON CONFLICT (test_id) DO UPDATE SET
+                    inputs_signature = excluded.inputs_signature,
+                    duration_seconds = excluded.duration_seconds,
+                    transactions_number = excluded.transactions_number,
+                    last_transaction_at = excluded.last_transaction_at,
+                    deferred_runs = 0,
+                    computed_at = excluded.computed_at
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(text(query), runs)
+
+    @classmethod
+    def defer_runs(cls, db_connection: engine.Connection, tests_ids: List[int]):
+        """
+        Counts one more deferred worker run for each of these tests
+        """
+        if not tests_ids:
+            return
+
+        query = """
+                INSERT INTO {0}.{1} (test_id, deferred_runs)
+                    VALUES (:test_id, 1)
+                ON CONFLICT (test_id) DO UPDATE SET
+                    deferred_runs = {1}.deferred_runs + 1
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(
+            text(query), [dict(test_id=test_id) for test_id in tests_ids]
+        )
+
+
+class TestLease(Base):
+    """
+    This models the lease of a test by one of the distributed workers: the test is
+    computed by this worker only, until its lease expires (the worker died) or is
+    released. Lease times are the datalake ones, never the workers' clocks.
+    """
+
+    __tablename__ = "test_lease"
+    __table_args__ = (
+        Index("ix_test_lease", "test_id", unique=True),
+        {"schema": PATT_SCHEMA_NAME},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    test_id = Column(
+        Integer, ForeignKey("{}.ab_test.id".format(PATT_SCHEMA_NAME)), nullable=False
+    )
+    worker_id = Column(String)
+    leased_until = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    computed_at = Column(DateTime)  # End of the last computation of the test
+
+    @classmethod
+    def add_leases(cls, db_connection: engine.Connection, tests_ids: List[int]):
+        """
+        Adds the missing leases of these tests, unleased
+        """
+        if not tests_ids:
+            return
+
+        query = """
+                INSERT INTO {0}.{1} (test_id)
+                    SELECT test_id FROM UNNEST(CAST(:tests_ids AS INTEGER[])) AS test_id
+                ON CONFLICT (test_id) DO NOTHING
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(text(query), tests_ids=tests_ids)
+
+    @classmethod
+    def claim(
+        cls,
+        db_connection: engine.Connection,
+        tests_ids: List[int],
+        worker_id: str,
+        lease_seconds: int,
+        computation_interval_seconds: int,
+    ) -> Optional[int]:
+        """
+        Leases the first of these tests that is neither leased nor computed in the
+        last computation_interval_seconds. Leases being locked with SKIP LOCKED,
+        concurrent workers claim distinct tests without waiting for each other.
+        :return: The id of the leased test, None if no test can be leased
+        """
+        if not tests_ids:
+            return None
+
+        query = """
+                UPDATE {0}.{1} SET
+                    worker_id = :worker_id,
+                    leased_until = (NOW() AT TIME ZONE 'UTC')
+                        + :lease_seconds * INTERVAL '1 second',
+                    heartbeat_at = NOW() AT TIME ZONE 'UTC'
+                WHERE id = (
+                    SELECT id FROM {0}.{1}
+                    WHERE test_id = ANY(CAST(:tests_ids AS INTEGER[]))
+                    AND (
+                        leased_until IS NULL
+                        OR leased_until < NOW() AT TIME ZONE 'UTC'
+                    )
+                    AND (
+                        computed_at IS NULL
+                        OR computed_at < (NOW() AT TIME ZONE 'UTC')
+                            - :computation_interval_seconds * INTERVAL '1 second'
+                    )
+                    ORDER BY ARRAY_POSITION(CAST(:tests_ids AS INTEGER[]), test_id)
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING test_id
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return db_connection.execute(
+            text(query),
+            tests_ids=tests_ids,
+            worker_id=worker_id,
+            lease_seconds=lease_seconds,
+            computation_interval_seconds=computation_interval_seconds,
+        ).scalar()
+
+    @classmethod
+    def extend(
+        cls,
+        db_connection: engine.Connection,
+        tests_ids: List[int],
+        worker_id: str,
+        lease_seconds: int,
+    ) -> List[int]:
+        """
+        Heartbeat: extends the leases the worker still holds on these tests
+        :return: The ids of the tests still leased by the worker
+        """
+        if not tests_ids:
+            return []
+
+        query = """
+                UPDATE {0}.{1} SET
+                    leased_until = (NOW() AT TIME ZONE 'UTC')
+                        + :lease_seconds * INTERVAL '1 second',
+                    heartbeat_at = NOW() AT TIME ZONE 'UTC'
+                WHERE test_id = ANY(CAST(:tests_ids AS INTEGER[]))
+                AND worker_id = :worker_id
+                AND leased_until >= NOW() AT TIME ZONE 'UTC'
+                RETURNING test_id
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        return [
+            row["test_id"]
+            for row in db_connection.execute(
+                text(query),
+                tests_ids=tests_ids,
+                worker_id=worker_id,
+                lease_seconds=lease_seconds,
+            )
+        ]
+
+    @classmethod
+    def is_held(
+        cls, db_connection: engine.Connection, test_id: int, worker_id: str
+    ) -> bool:
+        """
+        Locks the lease of the test until the end of the transaction, so that it
+        can not be claimed before the transaction writes are committed
+        :return: Whether the worker still holds the lease of the test
+        """
+
+        query = """
+                SELECT worker_id, leased_until >= NOW() AT TIME ZONE 'UTC' AS is_valid
+                FROM {0}.{1}
+                WHERE test_id = :test_id
+                FOR UPDATE
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        row = db_connection.execute(text(query), test_id=test_id).fetchone()
+        return row is not None and row["worker_id"] == worker_id and row["is_valid"]
+
+    @classmethod
+    def release(
+        cls,
+        db_connection: engine.Connection,
+        test_id: int,
+        worker_id: str,
+        is_computed: bool,
+    ) -> None:
+        """
+        :param is_computed: Whether the test has been computed, a failed test can be
+        claimed again at once
+        """
+
+        query = """
+                UPDATE {0}.{1} SET
+                    leased_until = NULL,
+                    computed_at = CASE
+                        WHEN :is_computed THEN NOW() AT TIME ZONE 'UTC'
+                        ELSE computed_at
+                    END
+                WHERE test_id = :test_id AND worker_id = :worker_id
+            """.format(
+            PATT_SCHEMA_NAME, cls.__tablename__
+        )
+
+        db_connection.execute(
+            text(query), test_id=test_id, worker_id=worker_id, is_computed=is_computed
+        )
+
 
 class PattUser(Base, UserMixin):
 
@@ -319,6 +1187,31 @@ def _create_table_if_not_exists(
         table_model_instance.__table__.create(bind=db_engine)
 
 
+def _add_missing_columns(db_engine: engine.Engine, table_model_instance: Table) -> None:
+    """
+    Adds the columns of an existing table that are missing in the database, they
+    must be nullable
+    """
+    table_name = table_model_instance.__tablename__
+    existing_columns = {
+        column["name"]
+        for column in inspect(db_engine).get_columns(
+            table_name, schema=PATT_SCHEMA_NAME
+        )
+    }
+
+    for column in table_model_instance.__table__.columns:
+        if column.name not in existing_columns:
+            db_engine.execute(
+                "ALTER TABLE {}.{} ADD COLUMN {} {}".format(
+                    PATT_SCHEMA_NAME,
+                    table_name,
+                    column.name,
+                    column.type.compile(dialect=db_engine.dialect),
+                )
+            )
+
+
 def _create_schema(db_engine: engine.Engine):
     db_engine.execute("CREATE SCHEMA IF NOT EXISTS {};".format(PATT_SCHEMA_NAME))
 
@@ -336,10 +1229,19 @@ def _create_missing_tables(db_engine: engine.Engine) -> None:
         ABTestResult(),
         KPI(),
         PattUser(),
+        KPIUserCount(),
+        KPIWatermark(),
+        KPIStatistics(),
+        SequentialTestResult(),
+        TransactionsPartition(),
+        DailyTransactionsCount(),
+        TestRun(),
+        TestLease(),
     ]
 
     for table_instance in tables_instances:
         _create_table_if_not_exists(db_engine, table_instance)
+        _add_missing_columns(db_engine, table_instance)
 
     # We finally insert the admin
 
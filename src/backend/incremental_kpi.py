@@ -0,0 +1,282 @@
+"""
+Incremental computation of the transactions KPIs: the running transactions number
+of every (test, KPI, user) is kept in kpi_user_count with a created_at watermark in
+kpi_watermark, so that each worker run only counts the transactions created since
+the previous one.
+Transactions created before the watermark but written afterwards, or becoming valid
+afterwards (e.g. succeeding late), are missed: the counts are counted from scratch
+again every INCREMENTAL_RECONCILIATION_HOURS.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.backend.config import Config
+from src.backend.database_service import DatabaseConnection
+from src.backend.db_models import (
+    ABTest,
+    KPIUserCount,
+    KPIWatermark,
+    PATT_SCHEMA_NAME,
+    TestedUser,
+)
+from src.backend.kpi import TransactionsKPI
+from src.backend.logger import getLogger
+from src.backend.statistics_engine import ProportionCounts
+from src.backend.utils.tests_utils import (
+    encode_values_per_user,
+    get_population_transactions_per_user,
+    PopulationsIndex,
+    UsersDictionary,
+)
+
+logger = getLogger().bind(context="incremental KPI")
+
+
+class WatermarkMovedError(Exception):
+    """
+    The transactions of a KPI have been counted by a concurrent run meanwhile
+    """
+
+
+def delete_kpi_counts(
+    datalake_connection: DatabaseConnection, test_id: int, kpi_name: str
+) -> None:
+
+    session = datalake_connection.session_maker()
+    session.query(KPIUserCount).filter_by(test_id=test_id, kpi_name=kpi_name).delete()
+    session.query(KPIWatermark).filter_by(test_id=test_id, kpi_name=kpi_name).delete()
+    session.commit()
+    session.close()
+
+
+def _get_kpis_watermarks(
+    datalake_connection: DatabaseConnection, test: ABTest, kpis: List[TransactionsKPI]
+) -> Dict[str, datetime]:
+    """
+    :return: For each KPI, the date up to when its transactions are already counted.
+    KPIs that are counted from scratch (new KPI, test dates updated, counts to
+    reconcile) are missing
+    """
+
+    session = datalake_connection.session_maker()
+    watermarks = {
+        watermark.kpi_name: watermark
+        for watermark in session.query(KPIWatermark).filter_by(test_id=test.id).all()
+    }
+    session.close()
+
+    reconciliation_date = datetime.utcnow() - timedelta(
+        hours=Config().incremental_reconciliation_hours
+    )
+    kpis_watermarks = {}
+    for kpi in kpis:
+        watermark = watermarks.get(kpi.name)
+        if watermark is None:
+            continue
+        if (
+            watermark.recounted_at is None
+            or watermark.recounted_at < reconciliation_date
+        ):
+            logger.info(
+                "KPI is counted again to reconcile late transactions",
+                test_name=test.name,
+                kpi_name=kpi.name,
+            )
+            delete_kpi_counts(datalake_connection, test.id, kpi.name)
+            continue
+        if (
+            watermark.start_date != test.start_date
+            or watermark.created_at > test.end_date
+        ):
+            logger.info(
+                "Test dates have changed, KPI is counted again",
+                test_name=test.name,
+                kpi_name=kpi.name,
+            )
+            delete_kpi_counts(datalake_connection, test.id, kpi.name)
+            continue
+        kpis_watermarks[kpi.name] = watermark.created_at
+
+    return kpis_watermarks
+
+
+def update_kpis_counts(
+    pumpkin_connection: DatabaseConnection,
+    datalake_connection: DatabaseConnection,
+    test: ABTest,
+    kpis: List[TransactionsKPI],
+    populations: Dict[str, np.ndarray],
+) -> None:
+    """
+    Counts the transactions created since each KPI's watermark and adds them to the
+    running transactions numbers. KPIs sharing a watermark share the Pumpkin query.
+    Raises WatermarkMovedError, the new counts not being added, if a concurrent run
+    (e.g. a replica that claimed the test after this one's lease expired) has
+    already counted them.
+    """
+
+    if not kpis or not populations:
+        return
+
+    created_at_limit = min(
+        datetime.utcnow() - timedelta(seconds=Config().incremental_lag_seconds),
+        test.end_date,
+    )
+    kpis_watermarks = _get_kpis_watermarks(datalake_connection, test, kpis)
+    users_ids = np.unique(np.concatenate(list(populations.values())))
+
+    kpis_per_watermark = {}  # type: Dict[Optional[datetime], List[TransactionsKPI]]
+    for kpi in kpis:
+        kpis_per_watermark.setdefault(kpis_watermarks.get(kpi.name), []).append(kpi)
+
+    for watermark, watermark_kpis in kpis_per_watermark.items():
+        start_date = test.start_date if watermark is None else watermark
+        if start_date >= created_at_limit:
+            continue
+
+        logger.info(
+            "Counting new transactions",
+            test_name=test.name,
+            start_date=start_date,
+            end_date=created_at_limit,
+        )
+        transactions_per_user_df = get_population_transactions_per_user(
+            pumpkin_engine=pumpkin_connection.engine,
+            users_ids=users_ids,
+            start_date=start_date,
+            end_date=created_at_limit,
+            start_date_is_included=watermark is None,
+        )
+
+        updated_at = datetime.utcnow()
+        with datalake_connection.engine.begin() as db_connection:
+            for kpi in watermark_kpis:
+                if not KPIWatermark.advance_watermark(
+                    db_connection=db_connection,
+                    test_id=test.id,
+                    kpi_name=kpi.name,
+                    start_date=test.start_date,
+                    previous_created_at=watermark,
+                    created_at=created_at_limit,
+                    updated_at=updated_at,
+                ):
+                    raise WatermarkMovedError(
+                        "Transactions of KPI {} of test {} are already counted".format(
+                            kpi.name, test.name
+                        )
+                    )
+                count_column = (
+                    "owned_transactions_number"
+                    if kpi.ownership_is_must
+                    else "transactions_number"
+                )
+                new_transactions_df = transactions_per_user_df[
+                    transactions_per_user_df[count_column] > 0
+                ]
+                KPIUserCount.add_transactions_numbers(
+                    db_connection=db_connection,
+                    test_id=test.id,
+                    kpi_name=kpi.name,
+                    transactions_numbers=[
+                        {"user_id": user_id, "transactions_number": int(number)}
+                        for user_id, number in zip(
+                            new_transactions_df["user_id"],
+                            new_transactions_df[count_column],
+                        )
+                    ],
+                    updated_at=updated_at,
+                )
+
+
+def get_kpi_values_for_populations(
+    datalake_connection: DatabaseConnection,
+    test: ABTest,
+    kpi: TransactionsKPI,
+    populations: Dict[str, np.ndarray],
+) -> Dict[str, pd.DataFrame]:
+    """
+    :return: kpi values for all population, computed from the running transactions
+    numbers
+    """
+
+    query = """
+        SELECT user_id, transactions_number FROM {}.{}
+        WHERE test_id = :test_id AND kpi_name = :kpi_name
+    """.format(
+        PATT_SCHEMA_NAME, KPIUserCount.__tablename__
+    )
+    transactions_per_user_df = pd.read_sql_query(
+        text(query),
+        datalake_connection.engine,
+        params={"test_id": test.id, "kpi_name": kpi.name},
+    )
+
+    # Running numbers are encoded once, all members are then matched by their codes
+    users_dictionary = UsersDictionary()
+    populations_transactions_numbers = PopulationsIndex(
+        populations, users_dictionary
+    ).get_populations_values(
+        encode_values_per_user(transactions_per_user_df, users_dictionary),
+        "transactions_number",
+    )
+
+    populations_results = {}
+    for population_name, users_ids in populations.items():
+        population_transactions_df = pd.DataFrame(
+            data={
+                "user_id": users_ids,
+                "transactions_number": populations_transactions_numbers[
+                    population_name
+                ],
+            }
+        )
+        populations_results[population_name] = kpi.get_values(
+            population_transactions_df
+        )
+
+    return populations_results
+
+
+def get_kpi_counts_for_populations(
+    datalake_connection: DatabaseConnection, test: ABTest, kpi: TransactionsKPI
+) -> Dict[str, ProportionCounts]:
+    """
+    :return: For a binary KPI, the number of members having transactions and of
+    members of each population, counted by the datalake from the running
+    transactions numbers
+    """
+
+    query = """
+        SELECT
+            tested_user.population_name,
+            COUNT(DISTINCT tested_user.user_id) FILTER (
+                WHERE kpi_user_count.id IS NOT NULL
+            ) AS successes,
+            COUNT(DISTINCT tested_user.user_id) AS trials
+        FROM {0}.{1} AS tested_user
+        LEFT JOIN {0}.{2} AS kpi_user_count
+            ON kpi_user_count.test_id = tested_user.test_id
+            AND kpi_user_count.user_id = tested_user.user_id
+            AND kpi_user_count.kpi_name = :kpi_name
+            AND kpi_user_count.transactions_number > 0
+        WHERE tested_user.test_id = :test_id
+        GROUP BY tested_user.population_name
+    """.format(
+        PATT_SCHEMA_NAME, TestedUser.__tablename__, KPIUserCount.__tablename__
+    )
+    counts_df = pd.read_sql_query(
+        text(query),
+        datalake_connection.engine,
+        params={"test_id": test.id, "kpi_name": kpi.name},
+    )
+
+    return {
+        population_name: ProportionCounts(successes=int(successes), trials=int(trials))
+        for population_name, successes, trials in zip(
+            counts_df["population_name"], counts_df["successes"], counts_df["trials"]
+        )
+    }
@@ -1,86 +1,81 @@
-import math
 from datetime import datetime
-from typing import Dict
+from typing import List, Optional
 
 import numpy as np
-import pandas as pd
-from scipy import stats
-from sqlalchemy.engine import Engine
 
-from src.backend.db_models import ABTestResult, ABTest
+from src.backend.db_models import ABTest
 from src.backend.logger import getLogger
+from src.backend.statistics_engine import (
+    compute_pairwise_chi_square_pvalues,
+    compute_pairwise_pvalues,
+    SufficientStatistics,
+)
 
 logger = getLogger().bind(context="Test computing")
 
 
 class KhiTwoTest:
     @classmethod
-    def _get_total_std(cls, serie_1: np.array, serie_2: np.array) -> float:
-        return math.sqrt(
-            (
-                (len(serie_1) - 1) * serie_1.std() ** 2
-                + (len(serie_2) - 1) * serie_2.std() ** 2
-            )
-            / (len(serie_1) + len(serie_2) - 2)
-        )
-
-    @classmethod
-    def _compute_p_value(cls, serie_1: np.array, serie_2: np.array) -> float:
-
-        total_std = cls._get_total_std(serie_1, serie_2)
-
-        stat = (serie_1.mean() - serie_2.mean()) / (
-            total_std * math.sqrt(1 / len(serie_1) + 1 / len(serie_2))
-        )
-
-        pvalue = stats.norm.cdf(stat)
-        if np.isnan(pvalue):
-            return 1.0
-        return pvalue
-
-    @classmethod
-    def compute_test(
+    def compute_tests(
         cls,
-        datalake_engine: Engine,
         test: ABTest,
-        kpi_name: str,
-        kpi_res_per_population: Dict[str, pd.DataFrame],
-    ):
-
-        populations_names = list(kpi_res_per_population.keys())
-
-        # For the moment, we accept only two populations for khi 2 tests
-        assert len(populations_names) == 2
-
-        serie_1 = kpi_res_per_population[populations_names[0]]["value"]
-        serie_2 = kpi_res_per_population[populations_names[1]]["value"]
-
-        pvalue = cls._compute_p_value(serie_1, serie_2)
-        logger.info(
-            "Pvalue computed",
-            test_name=test.name,
-            type="khi2",
-            kpi_name=kpi_name,
-            value=pvalue,
-        )
-
-        ABTestResult.upsert_test_results(
-            db_engine=datalake_engine,
-            test_id=test.id,
-            test_type="khi2",
-            kpi_name=kpi_name,
-            first_population_name=populations_names[0],
-            second_population_name=populations_names[1],
-            first_population_avg=serie_1.mean(),
-            second_population_avg=serie_2.mean(),
-            pvalue=pvalue,
-            updated_at=datetime.utcnow(),
+        statistics: SufficientStatistics,
+        control_population_name: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        Computes the pvalues of every KPI and pair of populations at once. Binary
+        KPIs (activation, see SufficientStatistics.is_binary) are compared by the khi2
+        test of their contingency table, the other ones by the normal approximation
+        of their means difference.
+        :param statistics: The sufficient statistics of each KPI and population
+        :param control_population_name: If given, each population is only compared to
+        this one
+        :return: The test results, as upserted in test_result
+        """
+
+        results = compute_pairwise_pvalues(statistics, control_population_name)
+        chi_square_results = compute_pairwise_chi_square_pvalues(
+            statistics, control_population_name
         )
-
-        logger.info(
-            "Test result inserted",
-            test_name=test.name,
-            type="khi2",
-            kpi_name=kpi_name,
-            value=pvalue,
+        pvalues = np.where(
+            statistics.is_binary[:, np.newaxis],
+            chi_square_results.pvalues,
+            results.pvalues,
         )
+        updated_at = datetime.utcnow()
+        test_results = []
+
+        for kpi_index, kpi_name in enumerate(results.kpis_names):
+            for pair_index, first_population_name in enumerate(
+                results.first_populations_names
+            ):
+                pvalue = float(pvalues[kpi_index, pair_index])
+                logger.info(
+                    "Pvalue computed",
+                    test_name=test.name,
+                    type="khi2",
+                    kpi_name=kpi_name,
+                    value=pvalue,
+                )
+
+                test_results.append(
+                    dict(
+                        test_id=test.id,
+                        test_type="khi2",
+                        kpi_name=kpi_name,
+                        first_population_name=first_population_name,
+                        second_population_name=results.second_populations_names[
+                            pair_index
+                        ],
+                        first_population_avg=float(
+                            results.first_populations_avg[kpi_index, pair_index]
+                        ),
+                        second_population_avg=float(
+                            results.second_populations_avg[kpi_index, pair_index]
+                        ),
+                        pvalue=pvalue,
+                        updated_at=updated_at,
+                    )
+                )
+
+        return test_results
@@ -1,13 +1,33 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 
 import numpy as np
 import pandas as pd
 
+from src.backend.config import Config
 from src.backend.database_service import DatabaseConnection
+from src.backend.kpi_definitions import (
+    AmountsPerUser,
+    get_amounts_per_user,
+    get_kpis_values_per_user,
+    KPIAggregations,
+    KPIDefinition,
+)
 from src.backend.logger import getLogger
-from src.backend.utils.tests_utils import get_population_transactions
+from src.backend.statistics_engine import (
+    adjust_with_covariate,
+    linearize_ratio,
+    ProportionCounts,
+)
+from src.backend.utils.tests_utils import (
+    get_population_activation_counts,
+    get_population_transactions,
+    get_populations_activation_counts,
+    get_populations_transactions,
+    TransactionsSnapshot,
+    AggregationModes,
+)
 
 logger = getLogger().bind(context="KPI")
 
@@ -22,9 +42,10 @@ class AbstractKPI(ABC):
         self,
         pumpkin_connection: DatabaseConnection,
         datalake_connection: DatabaseConnection,
-        users_ids: np.array,
+        users_ids: np.ndarray,
         start_date: datetime,
         end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
     ) -> pd.DataFrame:
         """
         :param pumpkin_connection:
@@ -32,6 +53,7 @@ class AbstractKPI(ABC):
         :param users_ids:
         :param start_date:
         :param end_date:
+        :param transactions_snapshot: Transactions shared by the current worker run
         :return: kpis value for population members
         """
 
@@ -42,6 +64,7 @@ class AbstractKPI(ABC):
         populations: Dict[str, pd.DataFrame],
         start_date: datetime,
         end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
     ) -> Dict[str, pd.DataFrame]:
         """
         :param pumpkin_connection:
@@ -49,111 +72,419 @@ class AbstractKPI(ABC):
         :param populations:
         :param start_date:
         :param end_date:
+        :param transactions_snapshot: Transactions shared by the current worker run
         :return: kpi values for all population
         """
         populations_results = {}
         for population_name, users_ids in populations.items():
             populations_results[population_name] = self.compute_values_for_population(
-                pumpkin_connection, datalake_connection, users_ids, start_date, end_date
+                pumpkin_connection,
+                datalake_connection,
+                users_ids,
+                start_date,
+                end_date,
+                transactions_snapshot,
             )
         return populations_results
 
 
-class TransactionsNumberKPI(AbstractKPI):
-    def __init__(self, name: str, ownership_is_must: bool):
+class TransactionsKPI(AbstractKPI):
+    """
+    A KPI whose values only depend on the number of valid transactions of each user
+    """
 
-        super().__init__(name=name)
-        self.ownership_is_must = ownership_is_must
+    def __init__(
+        self, definition: KPIDefinition, aggregation_mode: Optional[str] = None
+    ):
+        """
+        :param aggregation_mode: Whether transactions are counted per user by pandas or
+        by Pumpkin (see AggregationModes), defaults to KPI_AGGREGATION_MODE
+        """
+        super().__init__(name=definition.name)
+        self.definition = definition
+        self.ownership_is_must = definition.ownership_is_must
+        self.aggregation_mode = aggregation_mode or Config().kpi_aggregation_mode
+        self.cuped_pre_period_days = Config().cuped_pre_period_days
+
+    @property
+    def counts_all_transactions_types(self) -> bool:
+        return self.definition.discrs is None
+
+    @property
+    def uses_cuped(self) -> bool:
+        """
+        Whether values are adjusted with the transactions numbers of the members
+        before the test start (CUPED)
+        """
+        return self.cuped_pre_period_days > 0 and self.counts_all_transactions_types
+
+    @property
+    def is_compiled(self) -> bool:
+        """
+        Whether the KPI is computed with the other compiled KPIs of its test, by a
+        single Pumpkin query (KPIs filtering transactions types are always compiled)
+        """
+        return not self.uses_cuped and (
+            self.aggregation_mode == AggregationModes.sql
+            or not self.counts_all_transactions_types
+        )
+
+    @property
+    def can_be_incremental(self) -> bool:
+        """
+        The datalake only keeps the valid transactions numbers of the members since
+        the test start
+        """
+        return not self.uses_cuped and self.counts_all_transactions_types
+
+    @abstractmethod
+    def get_values(self, population_transactions_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param population_transactions_df: user_id and transactions_number of every
+        population member
+        :return: kpis value for population members
+        """
 
     def compute_values_for_population(
         self,
         pumpkin_connection: DatabaseConnection,
         datalake_connection: DatabaseConnection,
-        users_ids: np.array,
+        users_ids: np.ndarray,
         start_date: datetime,
         end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
     ) -> pd.DataFrame:
+        """
+        :return: kpis value for population members, and their covariate (the
+        transactions number before start_date) if the KPI uses CUPED
+        """
 
-        transactions_per_user_df = get_population_transactions(
+        pre_start_date = None
+        if self.uses_cuped:
+            pre_start_date = start_date - timedelta(days=self.cuped_pre_period_days)
+        population_transactions_df = get_population_transactions(
             pumpkin_engine=pumpkin_connection.engine,
             users_ids=users_ids,
             ownership_is_must=self.ownership_is_must,
             start_date=start_date,
             end_date=end_date,
+            transactions_snapshot=transactions_snapshot,
+            aggregation_mode=self.aggregation_mode,
+            pre_start_date=pre_start_date,
+        )
+
+        values_df = self.get_values(population_transactions_df)
+        if pre_start_date is None:
+            return values_df
+        return values_df[["user_id", "value"]].assign(
+            covariate=population_transactions_df["pre_transactions_number"].values
         )
 
-        transactions_per_user_df.rename(
-            {"transactions_number": "value"}, axis=1, inplace=True
+    def compute_values_for_populations(
+        self,
+        pumpkin_connection: DatabaseConnection,
+        datalake_connection: DatabaseConnection,
+        populations: Dict[str, pd.DataFrame],
+        start_date: datetime,
+        end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    ) -> Dict[str, pd.DataFrame]:
+
+        if self.aggregation_mode == AggregationModes.pandas and not self.uses_cuped:
+            # All populations are assigned their transactions numbers at once
+            populations_transactions = get_populations_transactions(
+                pumpkin_engine=pumpkin_connection.engine,
+                populations=populations,
+                ownership_is_must=self.ownership_is_must,
+                start_date=start_date,
+                end_date=end_date,
+                transactions_snapshot=transactions_snapshot,
+            )
+            return {
+                population_name: self.get_values(population_transactions_df)
+                for population_name, population_transactions_df in (
+                    populations_transactions.items()
+                )
+            }
+
+        populations_results = super().compute_values_for_populations(
+            pumpkin_connection,
+            datalake_connection,
+            populations,
+            start_date,
+            end_date,
+            transactions_snapshot,
+        )
+        if not self.uses_cuped:
+            return populations_results
+
+        logger.info(
+            "Adjusting values with pre test transactions numbers",
+            kpi=self.name,
+            pre_period_days=self.cuped_pre_period_days,
+        )
+        return adjust_with_covariate(populations_results)
+
+
+class TransactionsNumberKPI(TransactionsKPI):
+    def get_values(self, population_transactions_df: pd.DataFrame) -> pd.DataFrame:
+
+        return population_transactions_df.rename(
+            {"transactions_number": "value"}, axis=1
+        )
+
+
+class ActivationKPI(TransactionsKPI):
+    """
+    A user is activated as soon as he has one transaction (owned one if
+    ownership_is_must)
+    """
+
+    @property
+    def uses_cuped(self) -> bool:
+        # Activation is tested on its counts, never on adjusted values
+        return False
+
+    def get_values(self, population_transactions_df: pd.DataFrame) -> pd.DataFrame:
+
+        population_transactions_df = population_transactions_df.assign(
+            value=population_transactions_df["transactions_number"] > 0
         )
-        return transactions_per_user_df
 
+        return population_transactions_df[["user_id", "value"]]
 
-class TransactionsNumberWithOwnership(TransactionsNumberKPI):
-    def __init__(self):
+    def compute_counts_for_populations(
+        self,
+        pumpkin_connection: DatabaseConnection,
+        populations: Dict[str, np.ndarray],
+        start_date: datetime,
+        end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    ) -> Dict[str, ProportionCounts]:
+        """
+        Activation being binary, the active members of each population are counted
+        without computing the value of each member
+        :return: The number of active members and of members of each population
+        """
 
-        super().__init__(name="Owned transactions number", ownership_is_must=True)
+        if self.aggregation_mode == AggregationModes.pandas:
+            return {
+                population_name: ProportionCounts(successes=successes, trials=trials)
+                for population_name, (successes, trials) in (
+                    get_populations_activation_counts(
+                        pumpkin_engine=pumpkin_connection.engine,
+                        populations=populations,
+                        ownership_is_must=self.ownership_is_must,
+                        start_date=start_date,
+                        end_date=end_date,
+                        transactions_snapshot=transactions_snapshot,
+                    ).items()
+                )
+            }
+
+        populations_counts = {}
+        for population_name, users_ids in populations.items():
+            successes, trials = get_population_activation_counts(
+                pumpkin_engine=pumpkin_connection.engine,
+                users_ids=users_ids,
+                ownership_is_must=self.ownership_is_must,
+                start_date=start_date,
+                end_date=end_date,
+                transactions_snapshot=transactions_snapshot,
+                aggregation_mode=self.aggregation_mode,
+            )
+            populations_counts[population_name] = ProportionCounts(
+                successes=successes, trials=trials
+            )
+        return populations_counts
+
+    @staticmethod
+    def get_counts(population_values_df: pd.DataFrame) -> ProportionCounts:
+        """
+        :param population_values_df: The activation of each population member
+        """
+
+        return ProportionCounts(
+            successes=int(population_values_df["value"].sum()),
+            trials=population_values_df.shape[0],
+        )
 
 
-class AllTransactionsNumber(TransactionsNumberKPI):
-    def __init__(self):
-        super().__init__(name="Transactions number", ownership_is_must=False)
+class AmountKPI(AbstractKPI):
+    """
+    A KPI aggregating the amounts of the valid transactions of each user. The
+    transactions are streamed from Pumpkin by chunks, so that the worker memory does
+    not depend on their number.
+    """
 
+    def __init__(self, definition: KPIDefinition):
 
-class ActivationKPI(AbstractKPI):
-    def __init__(self, name: str, ownership_is_must: bool):
+        super().__init__(name=definition.name)
+        self.definition = definition
+
+    @property
+    def is_ratio(self) -> bool:
         """
-        :param ownership_is_must: The transaction has to be owned to be considered as activation
+        Whether the KPI is the ratio of the amounts of a population to its
+        transactions number, members are then given linearized values
         """
-        super().__init__(name=name)
-        self.ownership_is_must = ownership_is_must
+        return self.definition.aggregation == KPIAggregations.amount_per_transaction
 
     def compute_values_for_population(
         self,
         pumpkin_connection: DatabaseConnection,
         datalake_connection: DatabaseConnection,
-        users_ids: np.array,
+        users_ids: np.ndarray,
         start_date: datetime,
         end_date: datetime,
+        transactions_snapshot: Optional[TransactionsSnapshot] = None,
     ) -> pd.DataFrame:
-        population_transactions_df = get_population_transactions(
+
+        return compute_amount_kpis_for_populations(
+            pumpkin_connection=pumpkin_connection,
+            kpis=[self],
+            populations={"population": users_ids},
+            start_date=start_date,
+            end_date=end_date,
+        )[self.name]["population"]
+
+    def get_values(self, amounts_per_user: AmountsPerUser) -> pd.DataFrame:
+
+        if self.is_ratio:
+            values = linearize_ratio(
+                amounts_per_user.amounts, amounts_per_user.transactions_numbers
+            )
+        else:
+            values = amounts_per_user.amounts
+
+        return pd.DataFrame(
+            data={"user_id": amounts_per_user.users_ids, "value": values}
+        )
+
+
+def compute_amount_kpis_for_populations(
+    pumpkin_connection: DatabaseConnection,
+    kpis: List[AmountKPI],
+    populations: Dict[str, np.ndarray],
+    start_date: datetime,
+    end_date: datetime,
+) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """
+    Computes all amount KPIs with one read of the transactions of each population
+    :return: For each KPI, the values of each population members
+    """
+
+    definitions = [kpi.definition for kpi in kpis]
+    kpis_results = {
+        kpi.name: {} for kpi in kpis
+    }  # type: Dict[str, Dict[str, pd.DataFrame]]
+    for population_name, users_ids in populations.items():
+        amounts_per_kpi = get_amounts_per_user(
             pumpkin_engine=pumpkin_connection.engine,
+            definitions=definitions,
             users_ids=users_ids,
-            ownership_is_must=self.ownership_is_must,
             start_date=start_date,
             end_date=end_date,
+            chunk_size=Config().pumpkin_chunk_size,
         )
-        population_transactions_df["value"] = (
-            population_transactions_df["transactions_number"] > 0
+        for kpi in kpis:
+            kpis_results[kpi.name][population_name] = kpi.get_values(
+                amounts_per_kpi[kpi.name]
+            )
+
+    return kpis_results
+
+
+def compute_kpis_for_populations(
+    pumpkin_connection: DatabaseConnection,
+    kpis: List[TransactionsKPI],
+    populations: Dict[str, np.ndarray],
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """
+    Computes all KPIs with one Pumpkin query per population (see kpi_definitions)
+    :return: For each KPI, the values of each population members
+    """
+
+    definitions = [kpi.definition for kpi in kpis]
+    kpis_results = {
+        kpi.name: {} for kpi in kpis
+    }  # type: Dict[str, Dict[str, pd.DataFrame]]
+    for population_name, users_ids in populations.items():
+        values_df = get_kpis_values_per_user(
+            pumpkin_engine=pumpkin_connection.engine,
+            definitions=definitions,
+            users_ids=users_ids,
+            start_date=start_date,
+            end_date=end_date,
+            transactions_snapshot=transactions_snapshot,
         )
+        for kpi in kpis:
+            kpis_results[kpi.name][population_name] = pd.DataFrame(
+                data={"user_id": values_df["user_id"], "value": values_df[kpi.name]}
+            )
+
+    return kpis_results
+
+
+KPIS_DEFINITIONS = [
+    KPIDefinition(
+        name="Owned transactions number",
+        aggregation=KPIAggregations.count,
+        ownership_is_must=True,
+    ),
+    KPIDefinition(name="Transactions number", aggregation=KPIAggregations.count),
+    KPIDefinition(
+        name="Owned activation",
+        aggregation=KPIAggregations.any,
+        ownership_is_must=True,
+    ),
+    KPIDefinition(name="Simple activation", aggregation=KPIAggregations.any),
+    KPIDefinition(
+        name="Transfers number",
+        aggregation=KPIAggregations.count,
+        discrs=("transfer", "guest_transfer", "qr_code_transfer"),
+    ),
+    KPIDefinition(name="Transactions amount", aggregation=KPIAggregations.amount),
+    KPIDefinition(
+        name="Amount per transaction",
+        aggregation=KPIAggregations.amount_per_transaction,
+    ),
+]
+
+_KPIS_DEFINITIONS_PER_NAME = {
+    definition.name: definition for definition in KPIS_DEFINITIONS
+}
+
+_KPIS_CLASSES_PER_AGGREGATION = {
+    KPIAggregations.count: TransactionsNumberKPI,
+    KPIAggregations.any: ActivationKPI,
+    KPIAggregations.amount: AmountKPI,
+    KPIAggregations.amount_per_transaction: AmountKPI,
+}
 
-        return population_transactions_df[["user_id", "value"]]
 
+def build_kpi(definition: KPIDefinition) -> AbstractKPI:
 
-class ActivationWithOwnership(ActivationKPI):
-    def __init__(self):
+    return _KPIS_CLASSES_PER_AGGREGATION[definition.aggregation](definition)
 
-        super().__init__(name="Owned activation", ownership_is_must=True)
 
+def get_kpis_names() -> List[str]:
 
-class SimpleActivation(ActivationKPI):
-    def __init__(self):
-        super().__init__(name="Simple activation", ownership_is_must=False)
+    return [definition.name for definition in KPIS_DEFINITIONS]
 
 
 def get_kpis() -> List[AbstractKPI]:
 
-    return [
-        TransactionsNumberWithOwnership(),
-        AllTransactionsNumber(),
-        ActivationWithOwnership(),
-        SimpleActivation(),
-    ]
+    return [build_kpi(definition) for definition in KPIS_DEFINITIONS]
 
 
 def get_kpi_by_name(name: str) -> Optional[AbstractKPI]:
 
-    for kpi in get_kpis():
-        if kpi.name == name:
-            return kpi
+    definition = _KPIS_DEFINITIONS_PER_NAME.get(name)
+    if definition is None:
+        return None
 
-    return None
+    return build_kpi(definition)
@@ -0,0 +1,215 @@
+"""
+Declarative KPIs: a KPI is a filter of the valid transactions of a member (their
+types, their ownership) and an aggregation of them.
+All the KPIs of a test are compiled into a single Pumpkin query returning one row
+per population member and one column per KPI, so that adding a KPI to a test does
+not cost another scan of the transactions.
+Amounts KPIs are aggregated by the worker instead, from the transactions of the
+members streamed by chunks: all of them share a single read.
+"""
+
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from src.backend.logger import getLogger
+from src.backend.utils.tests_utils import (
+    get_population_aggregates_per_user,
+    PerUserAccumulator,
+    stream_population_transactions,
+    TransactionsSnapshot,
+)
+
+logger = getLogger().bind(context="KPI definitions")
+
+
+class KPIAggregations:
+
+    count = "count"  # Number of transactions of the member
+    any = "any"  # Whether the member has at least one transaction
+    # Aggregations of amounts, streamed from Pumpkin instead of being compiled
+    amount = "amount"  # Sum of the amounts of the member transactions
+    # Ratio of the amounts of the population members to their transactions numbers
+    amount_per_transaction = "amount_per_transaction"
+
+
+class KPIDefinition(NamedTuple):
+
+    name: str
+    aggregation: str
+    ownership_is_must: bool = False  # Only owned transactions are aggregated
+    # Types (discr) of the aggregated transactions, all valid types if None
+    discrs: Optional[Tuple[str, ...]] = None
+
+
+class AmountsPerUser(NamedTuple):
+
+    users_ids: np.ndarray
+    amounts: np.ndarray  # Sum of the amounts of the transactions of each member
+    transactions_numbers: np.ndarray
+
+
+def _compile_kpi(definition: KPIDefinition, alias: str) -> Tuple[str, dict]:
+    """
+    :return: The aggregate of the flattened transactions of a member and its query
+    parameters
+    """
+
+    conditions = ["TRUE"]
+    params = {}
+    if definition.ownership_is_must:
+        conditions.append(
+            "flattened_transaction.user_id = flattened_transaction.owner_id"
+        )
+    if definition.discrs is not None:
+        conditions.append(
+            "flattened_transaction.discr = ANY(CAST(:{}_discrs AS TEXT[]))".format(
+                alias
+            )
+        )
+        params["{}_discrs".format(alias)] = list(definition.discrs)
+
+    aggregate = "COUNT(flattened_transaction.user_id) FILTER (WHERE {})".format(
+        " AND ".join(conditions)
+    )
+    if definition.aggregation == KPIAggregations.any:
+        aggregate = "{} > 0".format(aggregate)
+    elif definition.aggregation != KPIAggregations.count:
+        raise ValueError(
+            "Aggregation {} of KPI {} can not be compiled".format(
+                definition.aggregation, definition.name
+            )
+        )
+
+    return "{} AS {}".format(aggregate, alias), params
+
+
+def compile_kpis(definitions: List[KPIDefinition]) -> Tuple[List[str], dict]:
+    """
+    KPIs are aliased by their index, their names being free texts
+    :return: The aggregates of the KPIs and their query parameters
+    """
+
+    aggregates = []
+    params = {}
+    for kpi_index, definition in enumerate(definitions):
+        aggregate, kpi_params = _compile_kpi(definition, "kpi_{}".format(kpi_index))
+        aggregates.append(aggregate)
+        params.update(kpi_params)
+
+    return aggregates, params
+
+
+def get_kpis_values_per_user(
+    pumpkin_engine: Engine,
+    definitions: List[KPIDefinition],
+    users_ids,
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+) -> pd.DataFrame:
+    """
+    :return: user_id and one column per KPI (named after it) of every population
+    member
+    """
+
+    aggregates, params = compile_kpis(definitions)
+    logger.info(
+        "Computing KPIs in Pumpkin",
+        kpis=[definition.name for definition in definitions],
+        start_date=start_date,
+        end_date=end_date,
+    )
+    if transactions_snapshot is not None:
+        values_df = transactions_snapshot.get_population_aggregates_per_user(
+            users_ids=users_ids,
+            start_date=start_date,
+            end_date=end_date,
+            aggregates=aggregates,
+            params=params,
+        )
+    else:
+        values_df = get_population_aggregates_per_user(
+            pumpkin_engine=pumpkin_engine,
+            users_ids=users_ids,
+            start_date=start_date,
+            end_date=end_date,
+            aggregates=aggregates,
+            params=params,
+        )
+
+    return values_df.rename(
+        {
+            "kpi_{}".format(kpi_index): definition.name
+            for kpi_index, definition in enumerate(definitions)
+        },
+        axis=1,
+    )
+
+
+def _get_transactions_mask(
+    definition: KPIDefinition, chunk_df: pd.DataFrame
+) -> np.ndarray:
+    """
+    :param chunk_df: user_id, owned, discr and amount of transactions
+    :return: Whether the KPI aggregates each transaction
+    """
+
+    mask = np.ones(chunk_df.shape[0], dtype=bool)
+    if definition.ownership_is_must:
+        mask &= chunk_df["owned"].values.astype(bool)
+    if definition.discrs is not None:
+        mask &= chunk_df["discr"].isin(definition.discrs).values
+
+    return mask
+
+
+def get_amounts_per_user(
+    pumpkin_engine: Engine,
+    definitions: List[KPIDefinition],
+    users_ids,
+    start_date: datetime,
+    end_date: datetime,
+    chunk_size: int,
+) -> Dict[str, AmountsPerUser]:
+    """
+    Streams the transactions of the population members once for all KPIs: the
+    memory used only depends on chunk_size and on the population size
+    :return: For each KPI, the amounts and the transactions numbers of every
+    population member
+    """
+
+    accumulator = PerUserAccumulator(users_ids)
+    for chunk_df in stream_population_transactions(
+        pumpkin_engine=pumpkin_engine,
+        users_ids=users_ids,
+        start_date=start_date,
+        end_date=end_date,
+        chunk_size=chunk_size,
+    ):
+        positions = accumulator.get_positions(chunk_df["user_id"])
+        amounts = chunk_df["amount"].fillna(0).values.astype(np.float64)
+        for kpi_index, definition in enumerate(definitions):
+            mask = _get_transactions_mask(definition, chunk_df)
+            accumulator.add(
+                "amount_{}".format(kpi_index), positions[mask], amounts[mask]
+            )
+            accumulator.add(
+                "transactions_{}".format(kpi_index),
+                positions[mask],
+                np.ones(int(mask.sum())),
+            )
+
+    return {
+        definition.name: AmountsPerUser(
+            users_ids=accumulator.users_ids,
+            amounts=accumulator.get_sums("amount_{}".format(kpi_index)),
+            transactions_numbers=accumulator.get_sums(
+                "transactions_{}".format(kpi_index)
+            ),
+        )
+        for kpi_index, definition in enumerate(definitions)
+    }
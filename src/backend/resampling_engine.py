@@ -0,0 +1,228 @@
+"""
+Vectorized resampling of the values of two populations: bootstrap confidence
+intervals and permutation pvalues of their means difference.
+Populations are resampled as histograms of their distinct values, so that the cost
+of an iteration depends on the number of distinct values, not of members:
+- A bootstrap resample of a population is a multinomial draw of its histogram
+- A permutation is a multivariate hypergeometric draw of the pooled histogram,
+drawn value after value
+Iterations are drawn by chunks, each one from its own seed, so the results do not
+depend on how chunks are spread over processes.
+"""
+
+from concurrent.futures import Executor
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+class ValuesHistogram(NamedTuple):
+
+    values: np.ndarray
+    counts: np.ndarray
+
+    @property
+    def size(self) -> int:
+        return int(self.counts.sum())
+
+    @property
+    def mean(self) -> float:
+        return float(np.dot(self.values, self.counts) / self.size)
+
+
+class ResamplingResult(NamedTuple):
+
+    pvalue: float
+    # Confidence interval of the second population mean minus the first one
+    difference_lower_bound: float
+    difference_upper_bound: float
+
+
+class _ChunkTask(NamedTuple):
+
+    first_histogram: ValuesHistogram
+    second_histogram: ValuesHistogram
+    iterations: int
+    seed: Sequence[int]
+
+
+class _ChunkResult(NamedTuple):
+
+    # Permuted first population mean minus second one
+    permuted_differences: np.ndarray
+    # Bootstrapped second population mean minus first one
+    bootstrapped_differences: np.ndarray
+
+
+def get_values_histogram(
+    values: np.ndarray, max_distinct_values: int
+) -> ValuesHistogram:
+    """
+    :param max_distinct_values: Beyond this number of distinct values, values are
+    grouped in as many quantile bins, each one replaced by the mean of its values
+    """
+
+    values = values.astype(np.float64)
+    distinct_values, counts = np.unique(values, return_counts=True)
+    if distinct_values.shape[0] <= max_distinct_values:
+        return ValuesHistogram(values=distinct_values, counts=counts)
+
+    sorted_values = np.sort(values)
+    bins = np.array_split(sorted_values, max_distinct_values)
+    return ValuesHistogram(
+        values=np.array([values_bin.mean() for values_bin in bins]),
+        counts=np.array([values_bin.shape[0] for values_bin in bins]),
+    )
+
+
+def _bootstrap_means(
+    histogram: ValuesHistogram, iterations: int, random_state: np.random.RandomState
+) -> np.ndarray:
+
+    pvals = histogram.counts / histogram.size
+    draws = random_state.multinomial(histogram.size, pvals, size=iterations)
+    return draws.dot(histogram.values) / histogram.size
+
+
+def _permute_sums(
+    pooled_histogram: ValuesHistogram,
+    sample_size: int,
+    iterations: int,
+    random_state: np.random.RandomState,
+) -> np.ndarray:
+    """
+    :return: The sums of the values of sample_size members drawn without replacement
+    """
+
+    sums = np.zeros(iterations)
+    remaining_samples = np.full(iterations, sample_size, dtype=np.int64)
+    remaining_total = pooled_histogram.size
+
+    for value, count in zip(pooled_histogram.values, pooled_histogram.counts):
+        remaining_total -= count
+        drawn = np.zeros(iterations, dtype=np.int64)
+        if remaining_total == 0:
+            drawn = remaining_samples.copy()
+        else:
+            is_sampling = remaining_samples > 0
+            if is_sampling.any():
+                drawn[is_sampling] = random_state.hypergeometric(
+                    count, remaining_total, remaining_samples[is_sampling]
+                )
+        sums += drawn * value
+        remaining_samples -= drawn
+
+    return sums
+
+
+def _resample_chunk(task: _ChunkTask) -> _ChunkResult:
+
+    random_state = np.random.RandomState(list(task.seed))
+    first_histogram, second_histogram = task.first_histogram, task.second_histogram
+
+    pooled_values, pooled_inverse = np.unique(
+        np.concatenate([first_histogram.values, second_histogram.values]),
+        return_inverse=True,
+    )
+    pooled_counts = np.bincount(
+        pooled_inverse,
+        weights=np.concatenate([first_histogram.counts, second_histogram.counts]),
+    ).astype(np.int64)
+    pooled_histogram = ValuesHistogram(values=pooled_values, counts=pooled_counts)
+
+    total_sum = float(np.dot(pooled_values, pooled_counts))
+    first_sums = _permute_sums(
+        pooled_histogram, first_histogram.size, task.iterations, random_state
+    )
+    second_sums = total_sum - first_sums
+    permuted_differences = (
+        first_sums / first_histogram.size - second_sums / second_histogram.size
+    )
+
+    bootstrapped_differences = _bootstrap_means(
+        second_histogram, task.iterations, random_state
+    ) - _bootstrap_means(first_histogram, task.iterations, random_state)
+
+    return _ChunkResult(
+        permuted_differences=permuted_differences,
+        bootstrapped_differences=bootstrapped_differences,
+    )
+
+
+def _get_chunks_iterations(
+    iterations: int, distinct_values_number: int, max_chunk_values: int
+) -> List[int]:
+
+    chunk_iterations = max(1, max_chunk_values // max(1, distinct_values_number))
+    chunks_number, last_chunk_iterations = divmod(iterations, chunk_iterations)
+
+    return [chunk_iterations] * chunks_number + (
+        [last_chunk_iterations] if last_chunk_iterations else []
+    )
+
+
+def resample(
+    first_histogram: ValuesHistogram,
+    second_histogram: ValuesHistogram,
+    iterations: int,
+    max_chunk_values: int,
+    seed: Sequence[int],
+    confidence_level: float,
+    executor: Optional[Executor] = None,
+) -> ResamplingResult:
+    """
+    Compares the means of two populations. Like the khi2 test, the pvalue is small
+    when the second mean is greater than the first one.
+    :param max_chunk_values: Bounds the memory of a chunk: its iterations times the
+    number of distinct values
+    :param seed: The iterations are drawn from this seed, whatever the executor
+    :param executor: If given, chunks are resampled by this executor
+    """
+    if first_histogram.size == 0 or second_histogram.size == 0:
+        return ResamplingResult(
+            pvalue=1.0, difference_lower_bound=np.nan, difference_upper_bound=np.nan
+        )
+
+    distinct_values_number = (
+        first_histogram.values.shape[0] + second_histogram.values.shape[0]
+    )
+    tasks = [
+        _ChunkTask(
+            first_histogram=first_histogram,
+            second_histogram=second_histogram,
+            iterations=chunk_iterations,
+            seed=list(seed) + [chunk_index],
+        )
+        for chunk_index, chunk_iterations in enumerate(
+            _get_chunks_iterations(iterations, distinct_values_number, max_chunk_values)
+        )
+    ]
+    if executor is None:
+        chunks_results = [_resample_chunk(task) for task in tasks]
+    else:
+        chunks_results = list(executor.map(_resample_chunk, tasks))
+
+    permuted_differences = np.concatenate(
+        [chunk_result.permuted_differences for chunk_result in chunks_results]
+    )
+    bootstrapped_differences = np.concatenate(
+        [chunk_result.bootstrapped_differences for chunk_result in chunks_results]
+    )
+
+    observed_difference = first_histogram.mean - second_histogram.mean
+    # Small tolerance: permuted differences equal to the observed one are counted
+    tolerance = 1e-9 * max(1.0, abs(observed_difference))
+    pvalue = (
+        1 + np.count_nonzero(permuted_differences <= observed_difference + tolerance)
+    ) / (1 + iterations)
+
+    lower_bound, upper_bound = np.percentile(
+        bootstrapped_differences,
+        [100 * (1 - confidence_level) / 2, 100 * (1 + confidence_level) / 2],
+    )
+
+    return ResamplingResult(
+        pvalue=float(min(1.0, pvalue)),
+        difference_lower_bound=float(lower_bound),
+        difference_upper_bound=float(upper_bound),
+    )
@@ -0,0 +1,138 @@
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from zlib import crc32
+
+import pandas as pd
+
+from src.backend.config import Config
+from src.backend.db_models import ABTest
+from src.backend.logger import getLogger
+from src.backend.resampling_engine import (
+    get_values_histogram,
+    resample,
+    ValuesHistogram,
+)
+from src.backend.statistics_engine import get_populations_pairs
+
+logger = getLogger().bind(context="Test computing")
+
+
+class ResamplingTest:
+    """
+    Permutation pvalues and bootstrap confidence intervals of the means difference,
+    for KPIs whose values are far from normal (e.g. skewed transactions numbers)
+    """
+
+    @classmethod
+    def _get_seed(
+        cls, kpi_name: str, first_population_name: str, second_population_name: str
+    ) -> List[int]:
+        """
+        Each KPI and pair of populations is resampled from its own seed, which does
+        not depend on the other KPIs and populations of the test
+        """
+
+        return [
+            Config().resampling_seed,
+            crc32(
+                "{}/{}/{}".format(
+                    kpi_name, first_population_name, second_population_name
+                ).encode("utf-8")
+            ),
+        ]
+
+    @classmethod
+    def _compute_tests(
+        cls,
+        test: ABTest,
+        kpis_results: Dict[str, Dict[str, pd.DataFrame]],
+        control_population_name: Optional[str],
+        executor: Optional[Executor],
+    ) -> List[dict]:
+
+        config = Config()
+        updated_at = datetime.utcnow()
+        test_results = []
+
+        for kpi_name, kpi_results in kpis_results.items():
+            populations_names = sorted(kpi_results.keys())
+            histograms = {
+                population_name: get_values_histogram(
+                    kpi_results[population_name]["value"].values,
+                    config.resampling_max_distinct_values,
+                )
+                for population_name in populations_names
+            }  # type: Dict[str, ValuesHistogram]
+
+            for first_index, second_index in get_populations_pairs(
+                populations_names, control_population_name
+            ):
+                first_name = populations_names[first_index]
+                second_name = populations_names[second_index]
+                result = resample(
+                    first_histogram=histograms[first_name],
+                    second_histogram=histograms[second_name],
+                    iterations=config.resampling_iterations,
+                    max_chunk_values=config.resampling_max_chunk_values,
+                    seed=cls._get_seed(kpi_name, first_name, second_name),
+                    confidence_level=config.resampling_confidence_level,
+                    executor=executor,
+                )
+                logger.info(
+                    "Pvalue computed",
+                    test_name=test.name,
+                    type="resampling",
+                    kpi_name=kpi_name,
+                    value=result.pvalue,
+                )
+
+                test_results.append(
+                    dict(
+                        test_id=test.id,
+                        test_type="resampling",
+                        kpi_name=kpi_name,
+                        first_population_name=first_name,
+                        second_population_name=second_name,
+                        first_population_avg=float(
+                            kpi_results[first_name]["value"].mean()
+                        ),
+                        second_population_avg=float(
+                            kpi_results[second_name]["value"].mean()
+                        ),
+                        pvalue=result.pvalue,
+                        difference_lower_bound=result.difference_lower_bound,
+                        difference_upper_bound=result.difference_upper_bound,
+                        updated_at=updated_at,
+                    )
+                )
+
+        return test_results
+
+    @classmethod
+    def compute_tests(
+        cls,
+        test: ABTest,
+        kpis_results: Dict[str, Dict[str, pd.DataFrame]],
+        control_population_name: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        :param kpis_results: For each KPI, the values of each population members
+        :param control_population_name: If given, each population is only compared to
+        this one
+        :return: The test results, as upserted in test_result
+        """
+
+        processes = Config().resampling_processes
+        if processes <= 1:
+            return cls._compute_tests(
+                test, kpis_results, control_population_name, executor=None
+            )
+
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            return cls._compute_tests(
+                test, kpis_results, control_population_name, executor=executor
+            )
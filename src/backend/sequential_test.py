@@ -0,0 +1,104 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.backend.config import Config
+from src.backend.db_models import ABTest
+from src.backend.logger import getLogger
+from src.backend.statistics_engine import (
+    compute_pairwise_msprt_pvalues,
+    get_msprt_mixture_variances,
+    SufficientStatistics,
+)
+
+logger = getLogger().bind(context="Test computing")
+
+
+def _get_fixed_variance(variance: float) -> Optional[float]:
+    """
+    The mixture of a KPI without variance yet is computed again at the next run
+    """
+
+    return float(variance) if np.isfinite(variance) and variance > 0 else None
+
+
+class SequentialTest:
+    """
+    Mixture sequential probability ratio test: its always valid pvalues can be
+    looked at after each worker run, and the test stopped as soon as one of them
+    crosses the boundary
+    """
+
+    @classmethod
+    def compute_tests(
+        cls,
+        test: ABTest,
+        statistics: SufficientStatistics,
+        fixed_mixture_variances: Dict[Tuple[str, str, str], float],
+        control_population_name: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        :param statistics: The sufficient statistics of each KPI and population
+        :param fixed_mixture_variances: The mixture variances fixed since the test
+        start, see SequentialTestResult.get_mixture_variances
+        :return: The pvalues of this run and their mixture variances, as upserted in
+        sequential_test_result
+        """
+
+        mixture_variance = get_msprt_mixture_variances(
+            statistics,
+            Config().sequential_mixture_std,
+            fixed_mixture_variances,
+            control_population_name,
+        )
+        results = compute_pairwise_msprt_pvalues(
+            statistics, mixture_variance, control_population_name
+        )
+        updated_at = datetime.utcnow()
+
+        return [
+            dict(
+                test_id=test.id,
+                kpi_name=kpi_name,
+                first_population_name=first_population_name,
+                second_population_name=results.second_populations_names[pair_index],
+                start_date=test.start_date,
+                pvalue=float(results.pvalues[kpi_index, pair_index]),
+                mixture_variance=_get_fixed_variance(
+                    mixture_variance[kpi_index, pair_index]
+                ),
+                updated_at=updated_at,
+            )
+            for kpi_index, kpi_name in enumerate(results.kpis_names)
+            for pair_index, first_population_name in enumerate(
+                results.first_populations_names
+            )
+        ]
+
+    @classmethod
+    def is_stopped(cls, test: ABTest, sequential_results: List[dict]) -> bool:
+        """
+        The test is stopped once an always valid pvalue crosses the boundary. The
+        boundary is the alpha risk shared by all the KPIs and pairs of populations
+        (Bonferroni correction).
+        :param sequential_results: The always valid pvalues of the test
+        """
+        if not sequential_results:
+            return False
+
+        boundary = Config().sequential_alpha / len(sequential_results)
+        crossing_results = [
+            result for result in sequential_results if result["pvalue"] <= boundary
+        ]
+        for result in crossing_results:
+            logger.info(
+                "Sequential test boundary is crossed",
+                test_name=test.name,
+                kpi_name=result["kpi_name"],
+                first_population_name=result["first_population_name"],
+                second_population_name=result["second_population_name"],
+                value=result["pvalue"],
+            )
+
+        return len(crossing_results) > 0
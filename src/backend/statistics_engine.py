@@ -0,0 +1,490 @@
+"""
+Vectorized statistics of a test: the sufficient statistics (members number, sum and
+sum of squares) of every KPI x population are computed once, then every pair of
+populations is compared for every KPI in a single pass.
+The sufficient statistics are persisted, so that the results of a test can be
+computed again without the values of each population member.
+"""
+
+from itertools import combinations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+class SufficientStatistics(NamedTuple):
+    """
+    Matrices of shape (KPIs number, populations number)
+    """
+
+    kpis_names: List[str]
+    populations_names: List[str]
+    users_number: np.ndarray
+    sum: np.ndarray
+    sum_of_squares: np.ndarray
+    minimum: np.ndarray
+    maximum: np.ndarray
+    # For each KPI, whether it is binary (activation): only its counts are compared
+    is_binary: np.ndarray
+
+    @property
+    def mean(self) -> np.ndarray:
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sum / self.users_number
+
+    @property
+    def variance(self) -> np.ndarray:
+        """
+        The unbiased variance, as computed by pandas' std
+        """
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.sum_of_squares - self.sum**2 / self.users_number) / (
+                self.users_number - 1
+            )
+
+    @property
+    def std(self) -> np.ndarray:
+
+        return np.sqrt(self.variance)
+
+    def select_kpis(self, kpis_names: List[str]) -> "SufficientStatistics":
+
+        kpis_indexes = [self.kpis_names.index(kpi_name) for kpi_name in kpis_names]
+        return SufficientStatistics(
+            kpis_names=list(kpis_names),
+            populations_names=self.populations_names,
+            users_number=self.users_number[kpis_indexes],
+            sum=self.sum[kpis_indexes],
+            sum_of_squares=self.sum_of_squares[kpis_indexes],
+            minimum=self.minimum[kpis_indexes],
+            maximum=self.maximum[kpis_indexes],
+            is_binary=self.is_binary[kpis_indexes],
+        )
+
+    def to_records(self) -> List[dict]:
+        """
+        :return: The statistics of each KPI and population, as stored in
+        kpi_statistics
+        """
+
+        return [
+            dict(
+                kpi_name=kpi_name,
+                population_name=population_name,
+                users_number=int(self.users_number[kpi_index, population_index]),
+                values_sum=float(self.sum[kpi_index, population_index]),
+                values_sum_of_squares=float(
+                    self.sum_of_squares[kpi_index, population_index]
+                ),
+                min_value=_to_nullable(self.minimum[kpi_index, population_index]),
+                max_value=_to_nullable(self.maximum[kpi_index, population_index]),
+            )
+            for kpi_index, kpi_name in enumerate(self.kpis_names)
+            for population_index, population_name in enumerate(self.populations_names)
+        ]
+
+    @classmethod
+    def from_records(
+        cls, records_df: pd.DataFrame, binary_kpis_names: Iterable[str]
+    ) -> "SufficientStatistics":
+        """
+        :param records_df: The statistics of each KPI and population, with the
+        columns of kpi_statistics
+        :param binary_kpis_names: The binary KPIs (activation) of the test
+        """
+
+        kpis_names = list(records_df["kpi_name"].unique())
+        populations_names = sorted(records_df["population_name"].unique())
+
+        def _get_matrix(column: str) -> np.ndarray:
+            return (
+                records_df.pivot(
+                    index="kpi_name", columns="population_name", values=column
+                )
+                .reindex(index=kpis_names, columns=populations_names)
+                .values.astype(np.float64)
+            )
+
+        return cls(
+            kpis_names=kpis_names,
+            populations_names=populations_names,
+            users_number=np.nan_to_num(_get_matrix("users_number")),
+            sum=np.nan_to_num(_get_matrix("values_sum")),
+            sum_of_squares=np.nan_to_num(_get_matrix("values_sum_of_squares")),
+            minimum=_get_matrix("min_value"),
+            maximum=_get_matrix("max_value"),
+            is_binary=_get_is_binary(kpis_names, binary_kpis_names),
+        )
+
+
+def _get_is_binary(
+    kpis_names: List[str], binary_kpis_names: Iterable[str]
+) -> np.ndarray:
+
+    binary_kpis_names = set(binary_kpis_names)
+    return np.array(
+        [kpi_name in binary_kpis_names for kpi_name in kpis_names], dtype=bool
+    )
+
+
+class ProportionCounts(NamedTuple):
+    """
+    The values of a binary KPI for the members of a population
+    """
+
+    successes: int
+    trials: int
+
+
+class PairwiseResults(NamedTuple):
+    """
+    The comparison of pairs of populations: matrices are of shape
+    (KPIs number, pairs number)
+    """
+
+    kpis_names: List[str]
+    first_populations_names: List[str]
+    second_populations_names: List[str]
+    first_populations_avg: np.ndarray
+    second_populations_avg: np.ndarray
+    pvalues: np.ndarray
+
+
+def _to_nullable(value: float) -> Optional[float]:
+
+    return None if np.isnan(value) else float(value)
+
+
+def adjust_with_covariate(
+    populations_values: Dict[str, pd.DataFrame],
+) -> Dict[str, pd.DataFrame]:
+    """
+    CUPED: removes from the values of the members the part explained by a covariate
+    measured before the test (value - theta * (covariate - covariate mean)).
+    theta and the covariate mean are computed on all populations together, so that
+    the populations means differences are kept while their variances are reduced.
+    :param populations_values: user_id, value and covariate of each population
+    members
+    :return: user_id and adjusted value of each population members
+    """
+
+    populations_df = [
+        population_df
+        for population_df in populations_values.values()
+        if not population_df.empty
+    ]
+    if not populations_df:
+        return {
+            population_name: population_df[["user_id", "value"]]
+            for population_name, population_df in populations_values.items()
+        }
+
+    values = np.concatenate(
+        [population_df["value"].values for population_df in populations_df]
+    ).astype(np.float64)
+    covariates = np.concatenate(
+        [population_df["covariate"].values for population_df in populations_df]
+    ).astype(np.float64)
+    covariate_mean = covariates.mean()
+    covariate_variance = covariates.var()
+    theta = 0.0
+    if covariate_variance > 0:
+        theta = np.mean((covariates - covariate_mean) * (values - values.mean()))
+        theta /= covariate_variance
+
+    adjusted_values = {}
+    for population_name, population_df in populations_values.items():
+        population_covariates = population_df["covariate"].values.astype(np.float64)
+        adjusted_values[population_name] = pd.DataFrame(
+            data={
+                "user_id": population_df["user_id"].values,
+                "value": population_df["value"].values.astype(np.float64)
+                - theta * (population_covariates - covariate_mean),
+            }
+        )
+    return adjusted_values
+
+
+def linearize_ratio(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    """
+    A ratio metric of a population (sum of numerators / sum of denominators, like an
+    amount per transaction) is not a mean of independent values. Its members are
+    given linearized values (delta method):
+    ratio + (numerator - ratio * denominator) / denominators mean
+    whose mean is the ratio and whose variance, divided by the population size, is
+    the delta method variance of the ratio. They can then be compared like the
+    values of any other KPI.
+    """
+
+    numerators = numerators.astype(np.float64)
+    denominators = denominators.astype(np.float64)
+    if denominators.shape[0] == 0 or denominators.sum() == 0:
+        return np.zeros(numerators.shape[0])
+
+    ratio = numerators.sum() / denominators.sum()
+    return ratio + (numerators - ratio * denominators) / denominators.mean()
+
+
+def get_sufficient_statistics(
+    kpis_results: Dict[str, Dict[str, pd.DataFrame]],
+    kpis_counts: Optional[Dict[str, Dict[str, ProportionCounts]]] = None,
+) -> SufficientStatistics:
+    """
+    :param kpis_results: For each KPI, the values of each population members
+    :param kpis_counts: For each binary KPI, the counts of each population
+    """
+
+    kpis_counts = kpis_counts or {}
+    kpis_names = list(kpis_results.keys()) + list(kpis_counts.keys())
+    populations_names = sorted(
+        {
+            population_name
+            for kpi_results in list(kpis_results.values()) + list(kpis_counts.values())
+            for population_name in kpi_results
+        }
+    )
+    shape = (len(kpis_names), len(populations_names))
+    count, total, sum_of_squares = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    minimum, maximum = np.full(shape, np.nan), np.full(shape, np.nan)
+
+    for kpi_index, kpi_name in enumerate(kpis_names):
+        if kpi_name in kpis_counts:
+            for population_index, population_name in enumerate(populations_names):
+                counts = kpis_counts[kpi_name].get(population_name)
+                if counts is None or counts.trials == 0:
+                    continue
+                count[kpi_index, population_index] = counts.trials
+                total[kpi_index, population_index] = counts.successes
+                sum_of_squares[kpi_index, population_index] = counts.successes
+                minimum[kpi_index, population_index] = float(
+                    counts.successes == counts.trials
+                )
+                maximum[kpi_index, population_index] = float(counts.successes > 0)
+            continue
+
+        for population_index, population_name in enumerate(populations_names):
+            population_df = kpis_results[kpi_name].get(population_name)
+            if population_df is None or population_df.empty:
+                continue
+            values = population_df["value"].values.astype(np.float64)
+            count[kpi_index, population_index] = values.shape[0]
+            total[kpi_index, population_index] = values.sum()
+            sum_of_squares[kpi_index, population_index] = np.dot(values, values)
+            minimum[kpi_index, population_index] = values.min()
+            maximum[kpi_index, population_index] = values.max()
+
+    return SufficientStatistics(
+        kpis_names=kpis_names,
+        populations_names=populations_names,
+        users_number=count,
+        sum=total,
+        sum_of_squares=sum_of_squares,
+        minimum=minimum,
+        maximum=maximum,
+        is_binary=_get_is_binary(kpis_names, kpis_counts.keys()),
+    )
+
+
+def get_populations_pairs(
+    populations_names: List[str], control_population_name: Optional[str] = None
+) -> List[Tuple[int, int]]:
+    """
+    :return: The indexes of the compared populations: each population against the
+    control one if given, every pair of populations otherwise
+    """
+
+    if control_population_name is None:
+        return list(combinations(range(len(populations_names)), 2))
+
+    control_index = populations_names.index(control_population_name)
+    return [
+        (control_index, population_index)
+        for population_index in range(len(populations_names))
+        if population_index != control_index
+    ]
+
+
+def _get_pairs_indexes(
+    statistics: SufficientStatistics, control_population_name: Optional[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+
+    pairs = get_populations_pairs(statistics.populations_names, control_population_name)
+    first_indexes = np.array([pair[0] for pair in pairs], dtype=int)
+    second_indexes = np.array([pair[1] for pair in pairs], dtype=int)
+
+    return first_indexes, second_indexes
+
+
+def _get_pooled_std(
+    statistics: SufficientStatistics,
+    first_indexes: np.ndarray,
+    second_indexes: np.ndarray,
+) -> np.ndarray:
+
+    count, variance = statistics.users_number, statistics.variance
+    count_1, count_2 = count[:, first_indexes], count[:, second_indexes]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(
+            (
+                (count_1 - 1) * variance[:, first_indexes]
+                + (count_2 - 1) * variance[:, second_indexes]
+            )
+            / (count_1 + count_2 - 2)
+        )
+
+
+def _get_pairwise_results(
+    statistics: SufficientStatistics,
+    first_indexes: np.ndarray,
+    second_indexes: np.ndarray,
+    pvalues: np.ndarray,
+) -> PairwiseResults:
+
+    mean = statistics.mean
+    pvalues[np.isnan(pvalues)] = 1.0
+
+    return PairwiseResults(
+        kpis_names=statistics.kpis_names,
+        first_populations_names=[
+            statistics.populations_names[index] for index in first_indexes
+        ],
+        second_populations_names=[
+            statistics.populations_names[index] for index in second_indexes
+        ],
+        first_populations_avg=mean[:, first_indexes],
+        second_populations_avg=mean[:, second_indexes],
+        pvalues=pvalues,
+    )
+
+
+def compute_pairwise_pvalues(
+    statistics: SufficientStatistics, control_population_name: Optional[str] = None
+) -> PairwiseResults:
+    """
+    For each KPI and pair of populations, the pvalue is the normal cdf of the pooled
+    variance two-sample statistic. It is 1 when it can not be computed.
+    """
+
+    first_indexes, second_indexes = _get_pairs_indexes(
+        statistics, control_population_name
+    )
+    count, mean = statistics.users_number, statistics.mean
+    count_1, count_2 = count[:, first_indexes], count[:, second_indexes]
+    pooled_std = _get_pooled_std(statistics, first_indexes, second_indexes)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stat = (mean[:, first_indexes] - mean[:, second_indexes]) / (
+            pooled_std * np.sqrt(1 / count_1 + 1 / count_2)
+        )
+
+    return _get_pairwise_results(
+        statistics, first_indexes, second_indexes, stats.norm.cdf(stat)
+    )
+
+
+def compute_pairwise_chi_square_pvalues(
+    statistics: SufficientStatistics, control_population_name: Optional[str] = None
+) -> PairwiseResults:
+    """
+    For each binary KPI and pair of populations, the pvalue of the khi2 test of the
+    2 x 2 contingency table of their successes and failures. Only the counts of
+    members and of successes (sums) are needed.
+    """
+
+    first_indexes, second_indexes = _get_pairs_indexes(
+        statistics, control_population_name
+    )
+    count, successes = statistics.users_number, statistics.sum
+    count_1, count_2 = count[:, first_indexes], count[:, second_indexes]
+    successes_1, successes_2 = successes[:, first_indexes], successes[:, second_indexes]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled_proportion = (successes_1 + successes_2) / (count_1 + count_2)
+        stat = (successes_1 / count_1 - successes_2 / count_2) ** 2 / (
+            pooled_proportion * (1 - pooled_proportion) * (1 / count_1 + 1 / count_2)
+        )
+
+    return _get_pairwise_results(
+        statistics, first_indexes, second_indexes, stats.chi2.sf(stat, df=1)
+    )
+
+
+def get_msprt_mixture_variances(
+    statistics: SufficientStatistics,
+    mixture_std: float,
+    fixed_mixture_variances: Dict[Tuple[str, str, str], float],
+    control_population_name: Optional[str] = None,
+) -> np.ndarray:
+    """
+    The variance of the mSPRT mixture of each KPI and pair of populations. It must
+    not change during a test for the pvalues to stay always valid: it is only
+    computed, as mixture_std pooled stds of the KPI, when it is not fixed yet.
+    :param fixed_mixture_variances: The variances fixed since the test start, by
+    KPI name, first population name and second population name
+    :return: A matrix of shape (KPIs number, pairs number)
+    """
+
+    first_indexes, second_indexes = _get_pairs_indexes(
+        statistics, control_population_name
+    )
+    mixture_variance = (
+        mixture_std * _get_pooled_std(statistics, first_indexes, second_indexes)
+    ) ** 2
+    for kpi_index, kpi_name in enumerate(statistics.kpis_names):
+        for pair_index, (first_index, second_index) in enumerate(
+            zip(first_indexes, second_indexes)
+        ):
+            fixed_mixture_variance = fixed_mixture_variances.get(
+                (
+                    kpi_name,
+                    statistics.populations_names[first_index],
+                    statistics.populations_names[second_index],
+                )
+            )
+            if fixed_mixture_variance is not None:
+                mixture_variance[kpi_index, pair_index] = fixed_mixture_variance
+
+    return mixture_variance
+
+
+def compute_pairwise_msprt_pvalues(
+    statistics: SufficientStatistics,
+    mixture_variance: np.ndarray,
+    control_population_name: Optional[str] = None,
+) -> PairwiseResults:
+    """
+    For each KPI and pair of populations, the pvalue of the mixture sequential
+    probability ratio test (mSPRT) of equal means, with a normal mixture of the
+    means difference centered on 0.
+    The running minimum of these pvalues over the computations of a test is an
+    always valid pvalue: it can be looked at after each computation.
+    :param mixture_variance: The variance of the mixture of each KPI and pair of
+    populations, see get_msprt_mixture_variances
+    """
+
+    first_indexes, second_indexes = _get_pairs_indexes(
+        statistics, control_population_name
+    )
+    count, variance = statistics.users_number, statistics.variance
+    mean = statistics.mean
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # The variance of the means difference
+        difference_variance = (
+            variance[:, first_indexes] / count[:, first_indexes]
+            + variance[:, second_indexes] / count[:, second_indexes]
+        )
+        difference = mean[:, second_indexes] - mean[:, first_indexes]
+        log_likelihood_ratio = 0.5 * np.log(
+            difference_variance / (difference_variance + mixture_variance)
+        ) + difference**2 * mixture_variance / (
+            2 * difference_variance * (difference_variance + mixture_variance)
+        )
+        pvalues = np.minimum(1.0, np.exp(-log_likelihood_ratio))
+
+    return _get_pairwise_results(statistics, first_indexes, second_indexes, pvalues)
@@ -0,0 +1,158 @@
+"""
+Distributed workers: several worker replicas share the tests of the datalake, each
+test being leased by one worker at a time (test_lease).
+- A worker claims the tests one by one, with SELECT ... FOR UPDATE SKIP LOCKED, so
+that replicas never wait for each other and never compute the same test.
+- While a test is computed, a heartbeat thread extends its lease. The lease of a
+dead worker expires after WORKER_LEASE_SECONDS, its test is then claimed again.
+- The results of a test are only written if its worker still holds its lease: a
+worker whose lease has expired can not overwrite the results of the next one.
+- A computed test is not claimed again before WORKER_FREQUENCY.
+"""
+
+import os
+import socket
+from threading import Event, Lock, Thread
+from typing import List, Optional
+from uuid import uuid4
+
+from sqlalchemy import engine
+
+from src.backend.config import Config
+from src.backend.database_service import DatabaseConnection
+from src.backend.db_models import TestLease
+from src.backend.logger import getLogger
+
+logger = getLogger().bind(context="leases")
+
+
+class LeaseLostError(Exception):
+    """
+    The lease of a test has expired and may be held by another worker
+    """
+
+
+def get_worker_id() -> str:
+
+    return "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid4().hex[:8])
+
+
+class TestsClaimer:
+    """
+    Claims tests for one worker and keeps their leases alive while they are
+    computed. It is used as a context manager, that runs the heartbeat thread.
+    """
+
+    def __init__(
+        self, datalake_connection: DatabaseConnection, worker_id: Optional[str] = None
+    ):
+
+        config = Config()
+        self.datalake_connection = datalake_connection
+        self.worker_id = worker_id or get_worker_id()
+        self.lease_seconds = config.worker_lease_seconds
+        self.computation_interval_seconds = 60 * config.worker_frequency
+        self._leased_tests_ids = set()  # type: set
+        self._lock = Lock()
+        self._stopped = Event()
+        self._heartbeat_thread = None  # type: Optional[Thread]
+
+    def __enter__(self) -> "TestsClaimer":
+
+        self._stopped.clear()
+        self._heartbeat_thread = Thread(
+            target=self._beat, name="leases-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self._stopped.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+
+    def _beat(self) -> None:
+
+        # Leases are extended well before they expire
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._lock:
+                leased_tests_ids = sorted(self._leased_tests_ids)
+            if not leased_tests_ids:
+                continue
+            # pylint: disable=W0703
+            try:
+                with self.datalake_connection.engine.begin() as db_connection:
+                    extended_tests_ids = TestLease.extend(
+                        db_connection,
+                        tests_ids=leased_tests_ids,
+                        worker_id=self.worker_id,
+                        lease_seconds=self.lease_seconds,
+                    )
+            except Exception as e:
+                logger.error("Leases can not be extended", exc=repr(e))
+                continue
+
+            lost_tests_ids = set(leased_tests_ids) - set(extended_tests_ids)
+            if lost_tests_ids:
+                logger.error(
+                    "Leases are lost",
+                    worker_id=self.worker_id,
+                    tests_ids=sorted(lost_tests_ids),
+                )
+                with self._lock:
+                    self._leased_tests_ids -= lost_tests_ids
+
+    def add_tests(self, tests_ids: List[int]) -> None:
+        """
+        Makes these tests claimable
+        """
+
+        with self.datalake_connection.engine.begin() as db_connection:
+            TestLease.add_leases(db_connection, tests_ids)
+
+    def claim(self, tests_ids: List[int]) -> Optional[int]:
+        """
+        :param tests_ids: The tests to claim, by priority
+        :return: The id of the test leased by the worker, None if all these tests are
+        leased by other workers or already computed
+        """
+
+        with self.datalake_connection.engine.begin() as db_connection:
+            test_id = TestLease.claim(
+                db_connection,
+                tests_ids=tests_ids,
+                worker_id=self.worker_id,
+                lease_seconds=self.lease_seconds,
+                computation_interval_seconds=self.computation_interval_seconds,
+            )
+        if test_id is not None:
+            with self._lock:
+                self._leased_tests_ids.add(test_id)
+
+        return test_id
+
+    def check_lease(self, db_connection: engine.Connection, test_id: int) -> None:
+        """
+        Fences the writes of a test: to be called in their transaction, the lease
+        being locked until it ends
+        """
+
+        if not TestLease.is_held(db_connection, test_id, self.worker_id):
+            raise LeaseLostError(
+                "Test {} is no longer leased by worker {}".format(
+                    test_id, self.worker_id
+                )
+            )
+
+    def release(self, test_id: int, is_computed: bool) -> None:
+
+        with self._lock:
+            self._leased_tests_ids.discard(test_id)
+        with self.datalake_connection.engine.begin() as db_connection:
+            TestLease.release(
+                db_connection,
+                test_id=test_id,
+                worker_id=self.worker_id,
+                is_computed=is_computed,
+            )
@@ -0,0 +1,305 @@
+"""
+Schedules the tests computed by a worker run:
+- A test whose inputs did not change since its last computation is skipped. Its
+inputs signature is its window, its KPIs and the number and last creation date of
+the valid transactions of this window. They are read from Pumpkin for all tests by
+a single query, that only scans the transactions created after the last one of
+each test's previous computation.
+- Transactions created before it but written afterwards (or becoming valid
+afterwards) are not seen by this scan: a test is computed again, all its
+transactions being counted, once its last computation is older than
+TESTS_RECONCILIATION_HOURS.
+- The other tests are computed, the deferred ones first and then the closest to
+their end_date, as long as their estimated durations fit in the run budget
+(WORKER_FREQUENCY times WORKER_CONCURRENCY): the others are deferred to the next
+runs, so that very large tests are spread across runs.
+A test duration is estimated from its last one, scaled by its transactions number.
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from src.backend.config import Config
+from src.backend.database_service import DatabaseConnection
+from src.backend.db_models import ABTest, TestRun
+from src.backend.logger import getLogger
+from src.backend.utils.db_utils import get_kpis_names_by_test
+from src.backend.utils.tests_utils import VALID_TRANSACTION_CONDITIONS
+
+logger = getLogger().bind(context="scheduler")
+
+
+def _get_window_signature(test: ABTest) -> str:
+
+    return "{}|{}|".format(test.start_date, test.end_date)
+
+
+class TestInputs(NamedTuple):
+
+    transactions_number: int
+    last_transaction_at: Optional[datetime]
+    kpis_names: List[str]
+
+    def get_signature(self, test: ABTest) -> str:
+        return "{}{}|{}|{}".format(
+            _get_window_signature(test),
+            ",".join(sorted(self.kpis_names)),
+            self.transactions_number,
+            self.last_transaction_at,
+        )
+
+
+class TestsSchedule(NamedTuple):
+
+    tests: List[ABTest]  # The tests to compute, by priority
+    skipped_tests: List[ABTest]
+    deferred_tests: List[ABTest]
+    # Inputs of the tests to compute, by test id
+    inputs: Dict[int, TestInputs]
+
+
+def get_scan_start(
+    test: ABTest, run: Optional[dict], reconciliation_date: datetime
+) -> Optional[datetime]:
+    """
+    :param run: The last run of the test, if any
+    :return: The date from which the transactions of the test window are scanned:
+    right after the last one of its last computation, None if they must all be
+    counted again
+    """
+
+    if (
+        run is None
+        or run["last_transaction_at"] is None
+        or run["computed_at"] is None
+        or run["computed_at"] < reconciliation_date
+        or not (run["inputs_signature"] or "").startswith(_get_window_signature(test))
+    ):
+        return None
+    return run["last_transaction_at"] + timedelta(microseconds=1)
+
+
+def get_tests_inputs(
+    pumpkin_connection: DatabaseConnection,
+    tests: List[ABTest],
+    runs: Dict[int, dict],
+    kpis_names: Dict[int, List[str]],
+    reconciliation_date: datetime,
+) -> Dict[int, TestInputs]:
+    """
+    :param runs: The last run of each test, by test id
+    :param kpis_names: The KPIs of each test, by test id
+    :return: The number and last creation date of the valid transactions of the
+    window of each test, the ones created after its last computed transaction being
+    added to the ones of its last run
+    """
+    if not tests:
+        return {}
+
+    scan_starts = {
+        test.id: get_scan_start(test, runs.get(test.id), reconciliation_date)
+        for test in tests
+    }
+    query = """
+        SELECT
+            test_window.test_id,
+            window_transactions.transactions_number,
+            window_transactions.last_transaction_at
+        FROM UNNEST(
+            CAST(:tests_ids AS INTEGER[]),
+            CAST(:start_dates AS TIMESTAMP[]),
+            CAST(:end_dates AS TIMESTAMP[])
+        ) AS test_window(test_id, start_date, end_date)
+        CROSS JOIN LATERAL (
+            SELECT
+                COUNT(*) AS transactions_number,
+                MAX(created_at) AS last_transaction_at
+            FROM abstract_transaction
+            WHERE created_at >= test_window.start_date
+            AND created_at <= test_window.end_date
+            AND {}
+        ) AS window_transactions
+    """.format(
+        VALID_TRANSACTION_CONDITIONS
+    )
+
+    tests_inputs = {}
+    for row in pumpkin_connection.engine.execute(
+        text(query),
+        tests_ids=[test.id for test in tests],
+        start_dates=[scan_starts[test.id] or test.start_date for test in tests],
+        end_dates=[test.end_date for test in tests],
+    ):
+        test_id = row["test_id"]
+        transactions_number = row["transactions_number"]
+        last_transaction_at = row["last_transaction_at"]
+        if scan_starts[test_id] is not None:
+            run = runs[test_id]
+            transactions_number += run["transactions_number"] or 0
+            last_transaction_at = last_transaction_at or run["last_transaction_at"]
+        tests_inputs[test_id] = TestInputs(
+            transactions_number=transactions_number,
+            last_transaction_at=last_transaction_at,
+            kpis_names=kpis_names.get(test_id, []),
+        )
+
+    return tests_inputs
+
+
+def estimate_duration(run: Optional[dict], inputs: TestInputs) -> float:
+    """
+    :param run: The last run of the test, if any
+    :return: The estimated duration in seconds of the test computation, 0 if it has
+    never been computed
+    """
+
+    if run is None or run["duration_seconds"] is None:
+        return 0.0
+    return run["duration_seconds"] * (
+        max(1, inputs.transactions_number) / max(1, run["transactions_number"] or 0)
+    )
+
+
+def schedule_tests(
+    tests: List[ABTest],
+    runs: Dict[int, dict],
+    inputs: Dict[int, TestInputs],
+    budget_seconds: float,
+    status_getter: Callable[[ABTest], str],
+    reconciliation_date: datetime,
+) -> TestsSchedule:
+    """
+    :param runs: The last run of each test, by test id
+    :param inputs: The inputs of each test, by test id
+    :param status_getter: Returns the status a test would get from its computation,
+    a test whose status changes is never skipped
+    :param reconciliation_date: A test computed before this date is never skipped
+    """
+
+    changed_tests, skipped_tests = [], []
+    for test in tests:
+        run = runs.get(test.id)
+        if (
+            run is not None
+            and run["computed_at"] is not None
+            and run["computed_at"] >= reconciliation_date
+            and run["inputs_signature"] == inputs[test.id].get_signature(test)
+            and status_getter(test) == test.status
+        ):
+            skipped_tests.append(test)
+        else:
+            changed_tests.append(test)
+
+    scheduled_tests = []  # type: List[ABTest]
+    deferred_tests = []  # type: List[ABTest]
+    scheduled_seconds = 0.0
+    for test in sorted(
+        changed_tests,
+        key=lambda changed_test: (
+            -(runs.get(changed_test.id) or {}).get("deferred_runs", 0),
+            changed_test.end_date,
+        ),
+    ):
+        duration = estimate_duration(runs.get(test.id), inputs[test.id])
+        # The first test is always computed, however long it is
+        if scheduled_tests and scheduled_seconds + duration > budget_seconds:
+            deferred_tests.append(test)
+            continue
+        scheduled_tests.append(test)
+        scheduled_seconds += duration
+
+    return TestsSchedule(
+        tests=scheduled_tests,
+        skipped_tests=skipped_tests,
+        deferred_tests=deferred_tests,
+        inputs={test.id: inputs[test.id] for test in scheduled_tests},
+    )
+
+
+class TestsScheduler:
+    def __init__(
+        self,
+        datalake_connection: DatabaseConnection,
+        pumpkin_connection: DatabaseConnection,
+    ):
+
+        self.datalake_connection = datalake_connection
+        self.pumpkin_connection = pumpkin_connection
+        self._schedule = None  # type: Optional[TestsSchedule]
+
+    def schedule(
+        self, tests: List[ABTest], status_getter: Callable[[ABTest], str]
+    ) -> List[ABTest]:
+        """
+        :return: The tests to compute in this worker run, by priority
+        """
+
+        config = Config()
+        reconciliation_date = datetime.utcnow() - timedelta(
+            hours=config.tests_reconciliation_hours
+        )
+        with self.datalake_connection.engine.connect() as db_connection:
+            runs = TestRun.get_runs(db_connection)
+        schedule = schedule_tests(
+            tests=tests,
+            runs=runs,
+            inputs=get_tests_inputs(
+                pumpkin_connection=self.pumpkin_connection,
+                tests=tests,
+                runs=runs,
+                kpis_names=get_kpis_names_by_test(
+                    self.datalake_connection, [test.id for test in tests]
+                ),
+                reconciliation_date=reconciliation_date,
+            ),
+            budget_seconds=60.0
+            * config.worker_frequency
+            * max(1, config.worker_concurrency),
+            status_getter=status_getter,
+            reconciliation_date=reconciliation_date,
+        )
+        self._schedule = schedule
+        logger.info(
+            "Tests are scheduled",
+            tests=[test.name for test in schedule.tests],
+            skipped_tests=[test.name for test in schedule.skipped_tests],
+            deferred_tests=[test.name for test in schedule.deferred_tests],
+        )
+
+        return schedule.tests
+
+    def record_runs(self, tests_reports: list) -> None:
+        """
+        Keeps the inputs and the duration of the computed tests, failed tests are
+        computed again at the next run
+        :param tests_reports: The TestRunReport of each computed test
+        """
+
+        schedule = self._schedule
+        assert schedule is not None, "The tests must be scheduled first"
+        computed_at = datetime.utcnow()
+        tests_per_id = {test.id: test for test in schedule.tests}
+        runs = []
+        for test_report in tests_reports:
+            if test_report.error is not None:
+                continue
+            test = tests_per_id[test_report.test_id]
+            inputs = schedule.inputs[test.id]
+            runs.append(
+                dict(
+                    test_id=test.id,
+                    inputs_signature=inputs.get_signature(test),
+                    duration_seconds=test_report.duration_seconds,
+                    transactions_number=inputs.transactions_number,
+                    last_transaction_at=inputs.last_transaction_at,
+                    computed_at=computed_at,
+                )
+            )
+
+        with self.datalake_connection.engine.begin() as db_connection:
+            TestRun.upsert_runs(db_connection, runs)
+            TestRun.defer_runs(
+                db_connection, [test.id for test in schedule.deferred_tests]
+            )
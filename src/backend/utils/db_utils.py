@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import List, Dict
+from io import StringIO
+from typing import Dict, Iterable, List, Optional
 
 import pandas as pd
 
@@ -9,9 +10,19 @@ from src.backend.db_models import (
     ABTest,
     ABTestResult,
     TestStatuses,
-    KPI
+    KPI,
+    KPIUserCount,
+    KPIWatermark,
+    KPIStatistics,
+    SequentialTestResult,
+    TestLease,
+    TestRun,
+    PATT_SCHEMA_NAME,
 )
+from src.backend.kpi import get_kpi_by_name, ActivationKPI
 from src.backend.logger import getLogger
+from src.backend.statistics_engine import SufficientStatistics
+from src.backend.utils.tests_utils import ABTestPopulations
 
 logger = getLogger().bind(context="population")
 
@@ -28,49 +39,59 @@ def get_kpis_by_test(datalake_connection: DatabaseConnection, test_id: int) -> L
     return datalake_connection.session_maker().query(KPI).filter_by(test_id=test_id).all()
 
 
+def get_kpis_names_by_test(
+    datalake_connection: DatabaseConnection, tests_ids: List[int]
+) -> Dict[int, List[str]]:
+
+    session = datalake_connection.session_maker()
+    kpis_names = {}  # type: Dict[int, List[str]]
+    for test_id, kpi_name in (
+        session.query(KPI.test_id, KPI.name).filter(KPI.test_id.in_(tests_ids)).all()
+    ):
+        kpis_names.setdefault(test_id, []).append(kpi_name)
+    session.close()
+
+    return kpis_names
+
+
 def insert_new_test(
     datalake_connection: DatabaseConnection,
     ab_test: ABTest,
-    populations: List[TestedUser],
+    populations_chunks: Iterable[pd.DataFrame],
     kpis: List[str],
-):
+) -> int:
+    """
+    Inserts the test, its KPIs and its populations in a single transaction, the
+    populations members being copied in bulk chunk by chunk
+    :param populations_chunks: user_id and population_name of members
+    :return: The id of the inserted test
+    """
 
     session = datalake_connection.session_maker()
-    session.add(ab_test)
-    session.commit()
-
-    #  We will try now to find the user
-    test_in_db = session.query(ABTest).filter_by(name=ab_test.name).first()
-
     try:
-        for population in populations:
-            population.test_id = test_in_db.id
-            session.add(population)
-
+        session.add(ab_test)
         for kpi_name in kpis:
-            kpi_to_add = KPI(name=kpi_name, test_id=test_in_db.id)
-            session.add(kpi_to_add)
+            ab_test.kpis.append(KPI(name=kpi_name))
+        session.flush()
+        test_id = ab_test.id
+
+        for populations_df in populations_chunks:
+            TestedUser.insert_populations(
+                db_connection=session.connection(),
+                test_id=test_id,
+                populations_df=populations_df,
+            )
 
         session.commit()
     except Exception as e:
-        delete_test_by_id(datalake_connection, ab_test.id)
+        session.rollback()
         raise Exception(
             "An error has occurred when inserting the test: {}".format(str(e))
         )
+    finally:
+        session.close()
 
-
-def read_populations_file(test_id, populations_df: pd.DataFrame) -> List[TestedUser]:
-
-    populations = []
-    for _, row_data in populations_df.iterrows():
-        population = TestedUser(
-            user_id=row_data["user_id"],
-            test_id=test_id,
-            population_name=row_data["population_name"],
-        )
-        populations.append(population)
-
-    return populations
+    return test_id
 
 
 def get_all_tests(datalake_connection: DatabaseConnection) -> List[ABTest]:
@@ -99,6 +120,12 @@ def delete_test_by_id(datalake_connection: DatabaseConnection, test_id: int) ->
     session.query(TestedUser).filter_by(test_id=test_id).delete()
     session.query(ABTestResult).filter_by(test_id=test_id).delete()
     session.query(KPI).filter_by(test_id=test_id).delete()
+    session.query(KPIUserCount).filter_by(test_id=test_id).delete()
+    session.query(KPIWatermark).filter_by(test_id=test_id).delete()
+    session.query(KPIStatistics).filter_by(test_id=test_id).delete()
+    session.query(SequentialTestResult).filter_by(test_id=test_id).delete()
+    session.query(TestRun).filter_by(test_id=test_id).delete()
+    session.query(TestLease).filter_by(test_id=test_id).delete()
     session.query(ABTest).filter_by(id=test_id).delete()
 
     session.commit()
@@ -106,21 +133,72 @@ def delete_test_by_id(datalake_connection: DatabaseConnection, test_id: int) ->
 
 def get_test_populations(
     datalake_connection: DatabaseConnection, test_id: int
-) -> Dict[str, pd.DataFrame]:
-
-    session = datalake_connection.session_maker()
+) -> ABTestPopulations:
+    """
+    Loads the populations members column by column: rows are copied from the
+    datalake as csv and parsed by pandas, no object is built per member
+    :return: The users ids of each population, with their membership index
+    """
+
+    query = """
+        SELECT population_name, user_id FROM {}.{} WHERE test_id = {:d}
+    """.format(
+        PATT_SCHEMA_NAME, TestedUser.__tablename__, int(test_id)
+    )
+    dtype = {"population_name": "category", "user_id": str}
 
-    populations = session.query(TestedUser).filter_by(test_id=test_id).all()
-    if not populations:
-        return {}
+    raw_connection = datalake_connection.engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        if hasattr(cursor, "copy_expert"):
+            populations_csv = StringIO()
+            cursor.copy_expert(
+                "COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(query),
+                populations_csv,
+            )
+            populations_csv.seek(0)
+            # Users ids such as "NA" are not missing values
+            populations_df = pd.read_csv(
+                populations_csv, dtype=dtype, keep_default_na=False, na_values=[]
+            )
+        else:
+            populations_df = pd.read_sql_query(query, raw_connection).astype(dtype)
+        cursor.close()
+    finally:
+        raw_connection.close()
+
+    populations_names = populations_df["population_name"].cat
+    populations_codes = populations_names.codes.values
+    users_ids = populations_df["user_id"].values
+    return ABTestPopulations(
+        {
+            population_name: users_ids[populations_codes == population_code]
+            for population_code, population_name in enumerate(
+                populations_names.categories
+            )
+        }
+    )
 
-    populations_data = [
-        {"name": population.population_name, "user_id": population.user_id}
-        for population in populations
-    ]
-    all_populations_df = pd.DataFrame(data=populations_data)
 
-    return {
-        population_name: population_members["user_id"]
-        for population_name, population_members in all_populations_df.groupby(["name"])
-    }
+def get_test_statistics(
+    datalake_connection: DatabaseConnection, test_id: int
+) -> Optional[SufficientStatistics]:
+    """
+    :return: The stored sufficient statistics of each KPI and population of the
+    test, None if the test has not been computed yet
+    """
+
+    with datalake_connection.engine.connect() as db_connection:
+        records_df = KPIStatistics.get_statistics(db_connection, test_id)
+
+    if records_df.empty:
+        return None
+    # Binary KPIs are known by their type, not by their values
+    return SufficientStatistics.from_records(
+        records_df,
+        binary_kpis_names=[
+            kpi_name
+            for kpi_name in records_df["kpi_name"].unique()
+            if isinstance(get_kpi_by_name(kpi_name), ActivationKPI)
+        ],
+    )
@@ -0,0 +1,163 @@
+"""
+Streaming reader of the populations files uploaded at test creation: the file is
+read and validated chunk by chunk so that memory does not depend on its size.
+"""
+
+from typing import IO, Iterator, List, Optional, Set
+
+import pandas as pd
+
+from src.backend.config import Config
+from src.backend.logger import getLogger
+
+logger = getLogger().bind(context="population")
+
+POPULATIONS_FILE_EXTENSIONS = ["csv", "csv.gz", "parquet", "xlsx"]
+POPULATIONS_COLUMNS = ["user_id", "population_name"]
+MIN_POPULATIONS_NUMBER = 2
+
+
+class PopulationsFileError(Exception):
+    """
+    Raised when a populations file is not valid
+    """
+
+
+def _check_columns(columns: List[str]) -> None:
+
+    for expected_column in POPULATIONS_COLUMNS:
+        if expected_column not in columns:
+            raise PopulationsFileError(
+                "Expected column named {}".format(expected_column)
+            )
+
+
+def _iter_csv_chunks(stream: IO, chunk_size: int, compression: Optional[str]):
+
+    chunks = pd.read_csv(
+        stream,
+        chunksize=chunk_size,
+        dtype=str,
+        # Users ids such as "NA" or "null" are not missing values
+        keep_default_na=False,
+        na_values=[],
+        compression=compression,
+        usecols=lambda column: column in POPULATIONS_COLUMNS,
+    )
+    try:
+        for chunk_df in chunks:
+            _check_columns(list(chunk_df.columns))
+            yield chunk_df
+    finally:
+        # Closing the reader detaches it from the stream instead of closing it
+        chunks.close()
+
+
+def _iter_parquet_chunks(stream: IO, chunk_size: int):
+    """
+    Parquet files are read row group by row group
+    """
+
+    # pylint: disable=C0415
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(stream)
+    _check_columns(parquet_file.schema.names)
+    for row_group_index in range(parquet_file.num_row_groups):
+        row_group_df = parquet_file.read_row_group(
+            row_group_index, columns=POPULATIONS_COLUMNS
+        ).to_pandas()
+        for chunk_start in range(0, row_group_df.shape[0], chunk_size):
+            yield row_group_df.iloc[chunk_start : chunk_start + chunk_size]
+
+
+def _iter_xlsx_chunks(stream: IO, chunk_size: int):
+
+    # pylint: disable=C0415
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = [str(column) for column in next(rows, ())]
+        _check_columns(columns)
+        columns_indexes = [columns.index(column) for column in POPULATIONS_COLUMNS]
+
+        chunk_rows = []
+        for row in rows:
+            chunk_rows.append([row[column_index] for column_index in columns_indexes])
+            if len(chunk_rows) == chunk_size:
+                yield pd.DataFrame(data=chunk_rows, columns=POPULATIONS_COLUMNS)
+                chunk_rows = []
+        if chunk_rows:
+            yield pd.DataFrame(data=chunk_rows, columns=POPULATIONS_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def _iter_file_chunks(stream: IO, filename: str, chunk_size: int):
+
+    filename = filename.lower()
+    if filename.endswith(".csv"):
+        return _iter_csv_chunks(stream, chunk_size, compression=None)
+    if filename.endswith(".csv.gz"):
+        return _iter_csv_chunks(stream, chunk_size, compression="gzip")
+    if filename.endswith(".parquet"):
+        return _iter_parquet_chunks(stream, chunk_size)
+    if filename.endswith(".xlsx"):
+        return _iter_xlsx_chunks(stream, chunk_size)
+
+    raise PopulationsFileError(
+        "Populations file extension should be one of: {}".format(
+            ", ".join(POPULATIONS_FILE_EXTENSIONS)
+        )
+    )
+
+
+def check_populations_file_columns(stream: IO, filename: str) -> None:
+    """
+    Checks the populations file columns by reading its first chunk only, the stream
+    is then rewound
+    """
+
+    chunks = _iter_file_chunks(stream, filename, chunk_size=1)
+    try:
+        next(chunks, None)
+    finally:
+        chunks.close()
+        stream.seek(0)
+
+
+def read_populations_file(
+    stream: IO, filename: str, chunk_size: Optional[int] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the populations file chunk by chunk. Once the last chunk is read, the
+    number of populations is checked.
+    :param filename: The uploaded file name, its extension gives the file format
+    (csv, csv.gz, parquet or xlsx)
+    :return: Chunks holding the user_id and population_name of members, as strings
+    """
+
+    chunk_size = chunk_size or Config().populations_file_chunk_size
+    populations_names = set()  # type: Set[str]
+    rows_number = 0
+
+    for chunk_df in _iter_file_chunks(stream, filename, chunk_size):
+        chunk_df = chunk_df[POPULATIONS_COLUMNS]
+        if chunk_df.isnull().values.any() or (chunk_df == "").values.any():
+            raise PopulationsFileError(
+                "Empty user_id or population_name after row {}".format(rows_number)
+            )
+        chunk_df = chunk_df.astype(str)
+        populations_names.update(chunk_df["population_name"].unique())
+        rows_number += chunk_df.shape[0]
+        yield chunk_df
+
+    if len(populations_names) < MIN_POPULATIONS_NUMBER:
+        raise PopulationsFileError(
+            "You have given {} populations, we accept at least {} populations".format(
+                len(populations_names), MIN_POPULATIONS_NUMBER
+            )
+        )
+    logger.info("Populations file is read", rows_number=rows_number)
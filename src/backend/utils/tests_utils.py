@@ -1,13 +1,34 @@
+from collections import OrderedDict
 from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
 
+from src.backend.config import Config
 from src.backend.logger import getLogger
 
 logger = getLogger().bind(context="utils")
 
 
+class AggregationModes:
+
+    pandas = "pandas"
+    sql = "sql"
+
+
+VALID_TRANSACTION_CONDITIONS = """
+        transaction_status = 'SUCCEEDED'
+        AND visibility <> 4
+        AND credited_person_id <>  debited_person_id
+        AND credited_person_id IS NOT NULL AND debited_person_id IS NOT NULL
+        AND discr IN ('transfer', 'guest_transfer', 'qr_code_transfer', 'charge', 'guest_charge')
+"""
+
+
 def _flatten_transactions(transactions_df: pd.DataFrame) -> pd.DataFrame:
     """
     We flatten transactions so that we have one user per row
@@ -27,52 +48,921 @@ def _flatten_transactions(transactions_df: pd.DataFrame) -> pd.DataFrame:
     return pd.concat([credited_transactions_df, debited_transactions_df])
 
 
-def _get_valid_transactions(
-    pumpkin_engine: Engine, start_date: datetime, end_date: datetime
+def read_sql_by_chunks(
+    pumpkin_engine: Engine, query: str, params: dict, chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the rows of a query through a named server side cursor: Pumpkin sends
+    them chunk_size rows at a time, instead of psycopg2 buffering all of them.
+    """
+
+    with pumpkin_engine.engine.connect() as connection:
+        chunks = pd.read_sql_query(
+            text(query),
+            connection.execution_options(stream_results=True),
+            params=params,
+            chunksize=chunk_size,
+        )
+        for chunk_df in chunks:
+            yield chunk_df
+
+
+def _stream_valid_transactions(
+    pumpkin_engine: Engine,
+    start_date: datetime,
+    end_date: datetime,
+    chunk_size: int,
+    end_date_is_included: bool = True,
+) -> Iterator[pd.DataFrame]:
+    """
+    :return: Chunks of flattened valid transactions (owner_id, user_id)
+    """
+
+    # Users ids are TEXT, like the ones of the populations and of the transactions
+    # cache, whatever their type in Pumpkin
+    query = """
+        SELECT
+            CAST(owner_id AS TEXT) AS owner_id,
+            CAST(credited_person_id AS TEXT) AS credited_person_id,
+            CAST(debited_person_id AS TEXT) AS debited_person_id
+        FROM abstract_transaction
+        WHERE created_at >= :start_date AND created_at {} :end_date
+        AND {}
+    """.format(
+        "<=" if end_date_is_included else "<", VALID_TRANSACTION_CONDITIONS
+    )
+    logger.info(
+        "Streaming transactions",
+        start_date=start_date,
+        end_date=end_date,
+        chunk_size=chunk_size,
+    )
+    for transactions_df in read_sql_by_chunks(
+        pumpkin_engine=pumpkin_engine,
+        query=query,
+        params={"start_date": start_date, "end_date": end_date},
+        chunk_size=chunk_size,
+    ):
+        yield _flatten_transactions(transactions_df)
+
+
+def _count_transactions_per_user(valid_transactions_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduces flattened transactions to one row per user holding both the number of
+    transactions and the number of owned transactions
+    """
+
+    valid_transactions_df = valid_transactions_df.assign(
+        owned=valid_transactions_df["user_id"] == valid_transactions_df["owner_id"]
+    )
+    grouped_transactions = valid_transactions_df.groupby(["user_id"])["owned"]
+
+    return pd.DataFrame(
+        data={
+            "transactions_number": grouped_transactions.size(),
+            "owned_transactions_number": grouped_transactions.sum().astype("int64"),
+        }
+    ).reset_index()
+
+
+class TransactionsCountsAccumulator:
+    """
+    Counts the transactions per user chunk after chunk: only the counts of the users
+    met so far are kept, never the transactions themselves.
+    """
+
+    def __init__(self):
+
+        self._counts = pd.DataFrame(
+            data={"transactions_number": [], "owned_transactions_number": []},
+            index=pd.Index([], name="user_id"),
+            dtype="int64",
+        )
+
+    def add(self, valid_transactions_df: pd.DataFrame) -> None:
+        """
+        :param valid_transactions_df: Flattened valid transactions
+        """
+
+        self.add_counts(_count_transactions_per_user(valid_transactions_df))
+
+    def add_counts(self, transactions_per_user_df: pd.DataFrame) -> None:
+        """
+        :param transactions_per_user_df: user_id, transactions_number and
+        owned_transactions_number of users
+        """
+
+        self._counts = self._counts.add(
+            transactions_per_user_df.set_index("user_id")[
+                ["transactions_number", "owned_transactions_number"]
+            ],
+            fill_value=0,
+        ).astype("int64")
+
+    def get_counts(self) -> pd.DataFrame:
+        """
+        :return: user_id, transactions_number and owned_transactions_number of every
+        user met
+        """
+        return self._counts.rename_axis("user_id").reset_index()
+
+
+def count_valid_transactions_per_user(
+    pumpkin_engine: Engine,
+    start_date: datetime,
+    end_date: datetime,
+    chunk_size: Optional[int] = None,
+    end_date_is_included: bool = True,
+) -> pd.DataFrame:
+    """
+    The valid transactions are streamed by chunks of chunk_size rows (defaults to
+    PUMPKIN_CHUNK_SIZE): the worker memory is bounded by the chunk size and the
+    number of users, whatever the window length.
+    :param end_date_is_included: False to only count transactions created strictly
+    before end_date
+    :return: user_id, transactions_number and owned_transactions_number of every
+    user having at least one valid transaction between start_date and end_date
+    """
+
+    accumulator = TransactionsCountsAccumulator()
+    for valid_transactions_df in _stream_valid_transactions(
+        pumpkin_engine=pumpkin_engine,
+        start_date=start_date,
+        end_date=end_date,
+        chunk_size=chunk_size or Config().pumpkin_chunk_size,
+        end_date_is_included=end_date_is_included,
+    ):
+        accumulator.add(valid_transactions_df)
+
+    return accumulator.get_counts()
+
+
+def _get_population_transactions_ctes(
+    start_date_is_included: bool = True, start_date_parameter: str = "start_date"
+) -> str:
+    """
+    :param start_date_parameter: The query parameter transactions are created from
+    :return: The population (its users_ids) and its flattened valid transactions
+    (owner_id, user_id, discr, amount, created_at) as common table expressions
+    """
+
+    return """
+        WITH population AS (
+            SELECT DISTINCT UNNEST(CAST(:users_ids AS TEXT[])) AS user_id
+        ),
+        valid_transaction AS (
+            SELECT
+                CAST(owner_id AS TEXT) AS owner_id,
+                CAST(credited_person_id AS TEXT) AS credited_person_id,
+                CAST(debited_person_id AS TEXT) AS debited_person_id,
+                discr,
+                CAST(amount AS DOUBLE PRECISION) AS amount,
+                created_at
+            FROM abstract_transaction
+            WHERE created_at {} :{} AND created_at <= :end_date
+            AND {}
+        ),
+        flattened_transaction AS (
+            SELECT owner_id, credited_person_id AS user_id, discr, amount, created_at
+            FROM valid_transaction
+            UNION ALL
+            SELECT owner_id, debited_person_id AS user_id, discr, amount, created_at
+            FROM valid_transaction
+        )
+    """.format(
+        ">=" if start_date_is_included else ">",
+        start_date_parameter,
+        VALID_TRANSACTION_CONDITIONS,
+    )
+
+
+def _get_counts_columns(prefix: str, period_condition: str) -> str:
+    """
+    :return: The columns counting the transactions of each member, and its owned
+    transactions, created during a period
+    """
+
+    return """
+            COUNT(flattened_transaction.user_id) FILTER (
+                WHERE {1}
+            ) AS {0}transactions_number,
+            COUNT(flattened_transaction.user_id) FILTER (
+                WHERE {1}
+                AND flattened_transaction.user_id = flattened_transaction.owner_id
+            ) AS owned_{0}transactions_number
+    """.format(
+        prefix, period_condition
+    )
+
+
+def get_population_aggregates_per_user(
+    pumpkin_engine: Engine,
+    users_ids,
+    start_date: datetime,
+    end_date: datetime,
+    aggregates: List[str],
+    params: Optional[dict] = None,
+    start_date_is_included: bool = True,
+    pre_start_date: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Aggregates the transactions of each population member inside Pumpkin: only one
+    row per member is sent back, whatever the platform's transactions volume.
+    :param aggregates: Aggregates (with their aliases) of the flattened_transaction
+    rows (owner_id, user_id, discr, amount, created_at) of a member
+    :param params: The query parameters used by the aggregates
+    :param start_date_is_included: False to only aggregate transactions created
+    strictly after start_date
+    :param pre_start_date: If given, the transactions are read from this date instead
+    of start_date, aggregates have to filter them
+    :return: user_id and the aggregates of every population member
+    """
+
+    if pre_start_date is None:
+        ctes = _get_population_transactions_ctes(start_date_is_included)
+    else:
+        ctes = _get_population_transactions_ctes(start_date_parameter="pre_start_date")
+
+    query = """
+        {}
+        SELECT
+            population.user_id,
+            {}
+        FROM population
+        LEFT JOIN flattened_transaction
+            ON flattened_transaction.user_id = population.user_id
+        GROUP BY population.user_id
+    """.format(
+        ctes, ",".join(aggregates)
+    )
+    return pd.read_sql_query(
+        text(query),
+        pumpkin_engine.engine,
+        params={
+            **(params or {}),
+            "users_ids": [str(user_id) for user_id in users_ids],
+            "start_date": start_date,
+            "end_date": end_date,
+            "pre_start_date": pre_start_date,
+        },
+    )
+
+
+def get_population_transactions_per_user(
+    pumpkin_engine: Engine,
+    users_ids,
+    start_date: datetime,
+    end_date: datetime,
+    start_date_is_included: bool = True,
+    pre_start_date: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Counts transactions per population member inside Pumpkin
+    :param start_date_is_included: False to only count transactions created strictly
+    after start_date
+    :param pre_start_date: If given, the transactions created between it and
+    start_date are also counted, by the same query
+    :return: user_id, transactions_number and owned_transactions_number of every
+    population member (members without transactions have zero counts), and
+    pre_transactions_number and owned_pre_transactions_number if pre_start_date is
+    given
+    """
+
+    if pre_start_date is None:
+        counts_columns = [_get_counts_columns("", "TRUE")]
+    else:
+        counts_columns = [
+            _get_counts_columns("", "flattened_transaction.created_at >= :start_date"),
+            _get_counts_columns(
+                "pre_", "flattened_transaction.created_at < :start_date"
+            ),
+        ]
+
+    logger.info(
+        "Counting population transactions in Pumpkin",
+        start_date=start_date,
+        end_date=end_date,
+        pre_start_date=pre_start_date,
+    )
+    return get_population_aggregates_per_user(
+        pumpkin_engine=pumpkin_engine,
+        users_ids=users_ids,
+        start_date=start_date,
+        end_date=end_date,
+        aggregates=counts_columns,
+        start_date_is_included=start_date_is_included,
+        pre_start_date=pre_start_date,
+    )
+
+
+def get_population_activation_counts_in_pumpkin(
+    pumpkin_engine: Engine, users_ids, start_date: datetime, end_date: datetime
 ) -> pd.DataFrame:
+    """
+    Counts the active population members inside Pumpkin: a single row is sent back
+    :return: users_number, active_users_number and owned_active_users_number
+    """
 
     query = """
-        SELECT owner_id, credited_person_id, debited_person_id FROM abstract_transaction
-        WHERE created_at BETWEEN '{}' AND '{}'
-        AND transaction_status = 'SUCCEEDED'
-        AND visibility <> 4
-        AND credited_person_id <>  debited_person_id
-        AND credited_person_id IS NOT NULL AND debited_person_id IS NOT NULL
-        AND discr IN ('transfer', 'guest_transfer', 'qr_code_transfer', 'charge', 'guest_charge')
+        {}
+        SELECT
+            (SELECT COUNT(*) FROM population) AS users_number,
+            COUNT(DISTINCT flattened_transaction.user_id) AS active_users_number,
+            COUNT(DISTINCT flattened_transaction.user_id) FILTER (
+                WHERE flattened_transaction.user_id = flattened_transaction.owner_id
+            ) AS owned_active_users_number
+        FROM flattened_transaction
+        JOIN population ON population.user_id = flattened_transaction.user_id
     """.format(
-        start_date, end_date
+        _get_population_transactions_ctes()
+    )
+    logger.info(
+        "Counting population active users in Pumpkin",
+        start_date=start_date,
+        end_date=end_date,
+    )
+    return pd.read_sql_query(
+        text(query),
+        pumpkin_engine.engine,
+        params={
+            "users_ids": [str(user_id) for user_id in users_ids],
+            "start_date": start_date,
+            "end_date": end_date,
+        },
     )
-    logger.info("Getting transactions", start_date=start_date, end_date=end_date)
-    transactions_df = pd.read_sql_query(query, pumpkin_engine.engine)
-    return _flatten_transactions(transactions_df)
 
 
-def get_valid_transactions_per_user(
+def stream_population_transactions(
     pumpkin_engine: Engine,
-    ownership_is_must: bool,
+    users_ids,
     start_date: datetime,
     end_date: datetime,
+    chunk_size: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the flattened valid transactions of the population members by chunks: only
+    chunk_size rows are held by the worker at once, whatever the number of
+    transactions.
+    :return: Chunks of user_id, owned, discr and amount of the members transactions
+    """
+
+    query = """
+        {}
+        SELECT
+            flattened_transaction.user_id,
+            COALESCE(
+                flattened_transaction.user_id = flattened_transaction.owner_id, FALSE
+            ) AS owned,
+            flattened_transaction.discr,
+            flattened_transaction.amount
+        FROM flattened_transaction
+        JOIN population ON population.user_id = flattened_transaction.user_id
+    """.format(
+        _get_population_transactions_ctes()
+    )
+    logger.info(
+        "Streaming population transactions from Pumpkin",
+        start_date=start_date,
+        end_date=end_date,
+        chunk_size=chunk_size,
+    )
+    return read_sql_by_chunks(
+        pumpkin_engine=pumpkin_engine,
+        query=query,
+        params={
+            "users_ids": [str(user_id) for user_id in users_ids],
+            "start_date": start_date,
+            "end_date": end_date,
+        },
+        chunk_size=chunk_size,
+    )
+
+
+class PerUserAccumulator:
+    """
+    Sums, for each population member, values read by chunks: its memory only
+    depends on the population size.
+    Members are located in chunks by a binary search of their sorted ids.
+    """
+
+    def __init__(self, users_ids):
+
+        self.users_ids = np.unique(pd.Series(users_ids).astype(str).values)
+        self._sums = OrderedDict()  # type: OrderedDict
+
+    def get_positions(self, chunk_users_ids: pd.Series) -> np.ndarray:
+        """
+        :param chunk_users_ids: Ids of population members
+        :return: The positions of the members in users_ids
+        """
+        return np.searchsorted(self.users_ids, chunk_users_ids.astype(str).values)
+
+    def add(self, name: str, positions: np.ndarray, weights: np.ndarray) -> None:
+        """
+        Adds weights to the sums of the members at these positions
+        """
+
+        chunk_sums = np.bincount(
+            positions, weights=weights, minlength=self.users_ids.shape[0]
+        )
+        if name in self._sums:
+            self._sums[name] += chunk_sums
+        else:
+            self._sums[name] = chunk_sums
+
+    def get_sums(self, name: str) -> np.ndarray:
+
+        return self._sums.get(name, np.zeros(self.users_ids.shape[0]))
+
+
+class UsersDictionary:
+    """
+    Interns users ids: each distinct id is given a dense integer code the first time
+    it is met. Users are then matched by binary searches of their sorted codes
+    instead of merges hashing their ids again for each population and KPI.
+    Codes are only valid for the dictionary that gave them.
+    Ids are kept in segments, each one hashed once: new ids form a new segment
+    instead of rehashing the known ones, and segments of similar sizes are merged
+    so that an id is searched in few segments.
+    """
+
+    def __init__(self):
+
+        self._segments = []  # type: List[pd.Index]
+        self._size = 0
+        self._memory_bytes = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def _add_segment(self, segment: pd.Index) -> None:
+
+        self._segments.append(segment)
+        self._size += len(segment)
+        self._memory_bytes += int(segment.memory_usage(deep=True))
+        while len(self._segments) > 1:
+            last_segment = self._segments[-1]
+            if 2 * len(last_segment) < len(self._segments[-2]):
+                break
+            self._segments.pop()
+            self._segments[-1] = self._segments[-1].append(last_segment)
+
+    def encode(self, users_ids) -> np.ndarray:
+        """
+        :return: The code of each user id, new ids being added to the dictionary
+        """
+
+        users_ids = pd.Index(pd.Series(users_ids).astype(str).values, dtype=object)
+        codes = np.full(len(users_ids), -1, dtype=np.int64)
+        with self._lock:
+            segment_offset = 0
+            for segment in self._segments:
+                is_unknown = codes == -1
+                if not is_unknown.any():
+                    break
+                positions = segment.get_indexer(users_ids[is_unknown])
+                codes[is_unknown] = np.where(
+                    positions == -1, -1, positions + segment_offset
+                )
+                segment_offset += len(segment)
+
+            is_new = codes == -1
+            if is_new.any():
+                new_ids = users_ids[is_new]
+                # The hash table of unique ids is kept by their segment
+                if new_ids.is_unique:
+                    new_codes, segment = np.arange(len(new_ids)), new_ids
+                else:
+                    new_codes, uniques = pd.factorize(new_ids)
+                    segment = pd.Index(uniques, dtype=object)
+                codes[is_new] = self._size + new_codes
+                self._add_segment(segment)
+
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+
+        return np.concatenate(
+            [segment.values for segment in self._segments] or [np.array([], object)]
+        )[codes]
+
+
+def encode_values_per_user(
+    values_per_user_df: pd.DataFrame, users_dictionary: UsersDictionary
 ) -> pd.DataFrame:
+    """
+    :param values_per_user_df: user_id and values of distinct users
+    :return: user_code and the values of the users, sorted by user_code
+    """
+
+    codes = users_dictionary.encode(values_per_user_df["user_id"])
+    order = np.argsort(codes, kind="mergesort")
+    encoded_df = values_per_user_df.drop("user_id", axis=1).iloc[order]
+    encoded_df.insert(0, "user_code", codes[order])
+
+    return encoded_df.reset_index(drop=True)
+
+
+def get_members_values(
+    encoded_values_df: pd.DataFrame, members_codes: np.ndarray, column: str
+) -> np.ndarray:
+    """
+    Members are located among the encoded users by a binary search of their codes
+    :param encoded_values_df: Values of users sorted by user_code
+    :return: The value of each member, 0 if it is not an encoded user
+    """
+
+    users_codes = encoded_values_df["user_code"].values
+    if users_codes.shape[0] == 0:
+        return np.zeros(len(members_codes), dtype=np.int64)
 
-    valid_transactions_df = _get_valid_transactions(
-        pumpkin_engine=pumpkin_engine, start_date=start_date, end_date=end_date
+    positions = np.minimum(
+        np.searchsorted(users_codes, members_codes), users_codes.shape[0] - 1
     )
-    if ownership_is_must:
-        valid_transactions_df = valid_transactions_df[
-            valid_transactions_df["user_id"] == valid_transactions_df["owner_id"]
+    return np.where(
+        users_codes[positions] == members_codes,
+        encoded_values_df[column].values[positions],
+        0,
+    )
+
+
+class PopulationsIndex:
+    """
+    Membership index of all the populations of a test: the codes of their members
+    are concatenated population after population and sorted once, so that the
+    members of all populations are located among encoded users by a single binary
+    search.
+    """
+
+    def __init__(
+        self, populations: Dict[str, np.ndarray], users_dictionary: UsersDictionary
+    ):
+
+        self.users_dictionary = users_dictionary
+        self.populations_names = list(populations.keys())
+        populations_codes = [
+            users_dictionary.encode(users_ids) for users_ids in populations.values()
         ]
+        # Position of the first member of each population but the first one
+        self._offsets = np.cumsum(
+            [population_codes.shape[0] for population_codes in populations_codes]
+        )[:-1]
+        members_codes = (
+            np.concatenate(populations_codes)
+            if populations_codes
+            else np.array([], dtype=np.int64)
+        )
+        self._order = np.argsort(members_codes, kind="mergesort")
+        self.sorted_codes = members_codes[self._order]
+
+    def get_populations_values(
+        self, encoded_values_df: pd.DataFrame, column: str
+    ) -> Dict[str, np.ndarray]:
+        """
+        :param encoded_values_df: Values of users sorted by user_code, encoded by the
+        dictionary of the index
+        :return: The value of each member of each population, 0 if it is not an
+        encoded user
+        """
+
+        sorted_values = get_members_values(encoded_values_df, self.sorted_codes, column)
+        values = np.empty_like(sorted_values)
+        values[self._order] = sorted_values
+
+        return dict(zip(self.populations_names, np.split(values, self._offsets)))
+
+    def get_populations_codes(self) -> Dict[str, np.ndarray]:
+        """
+        :return: The codes of the members of each population
+        """
+
+        members_codes = np.empty_like(self.sorted_codes)
+        members_codes[self._order] = self.sorted_codes
+
+        return dict(zip(self.populations_names, np.split(members_codes, self._offsets)))
+
+
+class ABTestPopulations(dict):
+    """
+    The users ids of each population of a test, with their membership index built
+    once for all the KPIs of the test
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self._index = None  # type: Optional[PopulationsIndex]
+
+    def get_index(self, users_dictionary: UsersDictionary) -> PopulationsIndex:
+
+        index = self._index
+        if index is None or index.users_dictionary is not users_dictionary:
+            index = PopulationsIndex(self, users_dictionary)
+            self._index = index
+        return index
+
+
+def get_populations_index(
+    populations: Dict[str, np.ndarray], users_dictionary: UsersDictionary
+) -> PopulationsIndex:
+    """
+    :return: The index kept by test populations, a new one for other populations
+    """
+
+    if isinstance(populations, ABTestPopulations):
+        return populations.get_index(users_dictionary)
+    return PopulationsIndex(populations, users_dictionary)
+
+
+def _get_population_key(users_ids) -> Tuple[int, int]:
+
+    users_ids = pd.Series(users_ids).astype(str)
+    return len(users_ids), int(pd.util.hash_pandas_object(users_ids, index=False).sum())
+
+
+class TransactionsSnapshot:
+    """
+    Caches, for one worker run, the valid transactions counted per user for each
+    (start_date, end_date) window, so that all tests, KPIs and populations sharing
+    a window scan Pumpkin only once.
+    In sql aggregation mode, the counts of each population are cached instead so
+    that owned and unowned KPIs share the same Pumpkin query.
+    If a transactions cache is given, the counts of a window are read from it
+    instead of Pumpkin (see transactions_cache).
+    In pandas aggregation mode, the counts of a window are kept encoded by the
+    users dictionary of the snapshot, which interns users ids for the whole run.
+    Cached entries are evicted, least recently used first, once their total memory
+    exceeds max_memory_bytes. The users dictionary is renewed, and the entries it
+    encoded are evicted, once its ids take more than max_memory_bytes.
+    The snapshot can be shared by threads: concurrent demands of the same entry wait
+    for a single Pumpkin query.
+    """
+
+    def __init__(
+        self, pumpkin_engine: Engine, max_memory_bytes: int, transactions_cache=None
+    ):
+        """
+        :param transactions_cache: The TransactionsCache of the valid transactions
+        numbers per user and day, if any
+        """
+
+        self.pumpkin_engine = pumpkin_engine
+        self.max_memory_bytes = max_memory_bytes
+        self.transactions_cache = transactions_cache
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._memory_bytes = 0
+        self._lock = Lock()
+        # The lock of each key being read or fetched, with its number of users
+        self._keys_locks = {}  # type: Dict[tuple, Tuple[Lock, int]]
+        self._users_dictionary = UsersDictionary()
+        self._users_dictionary_generation = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def _get(self, key: tuple) -> Optional[pd.DataFrame]:
+
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def _evict(self, key: tuple) -> None:
+
+        _, evicted_memory_bytes = self._entries.pop(key)
+        self._memory_bytes -= evicted_memory_bytes
+        logger.info(
+            "Transactions evicted from snapshot", start_date=key[0], end_date=key[1]
+        )
+
+    def _store(self, key: tuple, df: pd.DataFrame) -> None:
+
+        df_memory_bytes = int(df.memory_usage(deep=True).sum())
+        if df_memory_bytes > self.max_memory_bytes:
+            logger.info(
+                "Transactions are too large to be kept in snapshot",
+                start_date=key[0],
+                end_date=key[1],
+                memory_bytes=df_memory_bytes,
+            )
+            return
+
+        while (
+            self._entries
+            and self._memory_bytes + df_memory_bytes > self.max_memory_bytes
+        ):
+            self._evict(next(iter(self._entries)))
+
+        self._entries[key] = (df, df_memory_bytes)
+        self._memory_bytes += df_memory_bytes
+
+    def _get_or_fetch(
+        self, key: tuple, fetch: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+
+        with self._lock:
+            key_lock, users_number = self._keys_locks.get(key, (Lock(), 0))
+            self._keys_locks[key] = (key_lock, users_number + 1)
+
+        try:
+            with key_lock:
+                with self._lock:
+                    df = self._get(key)
+                if df is not None:
+                    return df
+
+                df = fetch()
+                with self._lock:
+                    self._store(key, df)
+        finally:
+            # Locks are only kept while the key is demanded
+            with self._lock:
+                key_lock, users_number = self._keys_locks.pop(key)
+                if users_number > 1:
+                    self._keys_locks[key] = (key_lock, users_number - 1)
+
+        return df
+
+    def _get_users_dictionary(self) -> Tuple[UsersDictionary, int]:
+        """
+        :return: The users dictionary and its generation, a new one once the ids of
+        the current one take more than max_memory_bytes
+        """
+
+        with self._lock:
+            if self._users_dictionary.memory_bytes > self.max_memory_bytes:
+                logger.info(
+                    "Users dictionary is renewed",
+                    users_number=len(self._users_dictionary),
+                    memory_bytes=self._users_dictionary.memory_bytes,
+                )
+                for key in list(self._entries):
+                    if key[2:3] == ("encoded",):
+                        self._evict(key)
+                self._users_dictionary = UsersDictionary()
+                self._users_dictionary_generation += 1
+
+            return self._users_dictionary, self._users_dictionary_generation
+
+    def _count_transactions_per_user(
+        self, start_date: datetime, end_date: datetime
+    ) -> pd.DataFrame:
+
+        if self.transactions_cache is not None:
+            return self.transactions_cache.count_valid_transactions_per_user(
+                start_date=start_date, end_date=end_date
+            )
+
+        return count_valid_transactions_per_user(
+            pumpkin_engine=self.pumpkin_engine,
+            start_date=start_date,
+            end_date=end_date,
+        )
+
+    def get_transactions_per_user(
+        self, start_date: datetime, end_date: datetime
+    ) -> pd.DataFrame:
+        """
+        :return: user_id, transactions_number and owned_transactions_number of every
+        user having at least one valid transaction between start_date and end_date
+        """
 
-    if valid_transactions_df.shape[0] == 0:
+        return self._get_or_fetch(
+            key=(start_date, end_date),
+            fetch=lambda: self._count_transactions_per_user(start_date, end_date),
+        )
+
+    def get_encoded_transactions_per_user(
+        self, start_date: datetime, end_date: datetime
+    ) -> Tuple[pd.DataFrame, UsersDictionary]:
+        """
+        :return: user_code, transactions_number and owned_transactions_number of
+        every user having at least one valid transaction between start_date and
+        end_date, sorted by user_code, and the dictionary of their codes
+        """
+
+        users_dictionary, generation = self._get_users_dictionary()
+        encoded_transactions_df = self._get_or_fetch(
+            key=(start_date, end_date, "encoded", generation),
+            fetch=lambda: encode_values_per_user(
+                self._count_transactions_per_user(start_date, end_date),
+                users_dictionary,
+            ),
+        )
+
+        return encoded_transactions_df, users_dictionary
+
+    def get_population_transactions_per_user(
+        self,
+        users_ids,
+        start_date: datetime,
+        end_date: datetime,
+        pre_start_date: Optional[datetime] = None,
+    ) -> pd.DataFrame:
+        """
+        :return: user_id, transactions_number and owned_transactions_number of every
+        population member, counted by Pumpkin (and their pre period counts if
+        pre_start_date is given)
+        """
+
+        return self._get_or_fetch(
+            key=(start_date, end_date)
+            + _get_population_key(users_ids)
+            + (pre_start_date,),
+            fetch=lambda: get_population_transactions_per_user(
+                pumpkin_engine=self.pumpkin_engine,
+                users_ids=users_ids,
+                start_date=start_date,
+                end_date=end_date,
+                pre_start_date=pre_start_date,
+            ),
+        )
+
+    def get_population_aggregates_per_user(
+        self,
+        users_ids,
+        start_date: datetime,
+        end_date: datetime,
+        aggregates: List[str],
+        params: Optional[dict] = None,
+    ) -> pd.DataFrame:
+        """
+        :return: user_id and the aggregates of every population member, computed by
+        Pumpkin
+        """
+
+        params = params or {}
+        return self._get_or_fetch(
+            key=(start_date, end_date)
+            + _get_population_key(users_ids)
+            + tuple(aggregates)
+            + tuple((name, str(params[name])) for name in sorted(params.keys())),
+            fetch=lambda: get_population_aggregates_per_user(
+                pumpkin_engine=self.pumpkin_engine,
+                users_ids=users_ids,
+                start_date=start_date,
+                end_date=end_date,
+                aggregates=aggregates,
+                params=params,
+            ),
+        )
+
+    def get_population_activation_counts(
+        self, users_ids, start_date: datetime, end_date: datetime
+    ) -> pd.DataFrame:
+        """
+        :return: users_number, active_users_number and owned_active_users_number of
+        the population, counted by Pumpkin
+        """
+
+        return self._get_or_fetch(
+            key=(start_date, end_date) + _get_population_key(users_ids) + ("active",),
+            fetch=lambda: get_population_activation_counts_in_pumpkin(
+                pumpkin_engine=self.pumpkin_engine,
+                users_ids=users_ids,
+                start_date=start_date,
+                end_date=end_date,
+            ),
+        )
+
+
+def _get_encoded_transactions_per_user(
+    pumpkin_engine: Engine,
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+) -> Tuple[pd.DataFrame, UsersDictionary]:
+    """
+    :return: The encoded transactions numbers of the users having valid transactions
+    and the dictionary of their codes
+    """
+
+    if transactions_snapshot is not None:
+        (
+            encoded_transactions_df,
+            users_dictionary,
+        ) = transactions_snapshot.get_encoded_transactions_per_user(
+            start_date=start_date, end_date=end_date
+        )
+    else:
+        users_dictionary = UsersDictionary()
+        encoded_transactions_df = encode_values_per_user(
+            count_valid_transactions_per_user(
+                pumpkin_engine=pumpkin_engine, start_date=start_date, end_date=end_date
+            ),
+            users_dictionary,
+        )
+
+    if encoded_transactions_df.shape[0] == 0:
         logger.info("No transactions have been found")
-        return pd.DataFrame(data=[], columns=["user_id", "transactions_number"])
 
-    logger.info("Computing transactions number per user")
-    return (
-        valid_transactions_df[["user_id"]]
-        .groupby(["user_id"])
-        .size()
-        .reset_index(name="transactions_number")
-    )
+    return encoded_transactions_df, users_dictionary
 
 
 def get_population_transactions(
@@ -81,22 +971,208 @@ def get_population_transactions(
     ownership_is_must: bool,
     start_date: datetime,
     end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    aggregation_mode: str = AggregationModes.pandas,
+    pre_start_date: Optional[datetime] = None,
 ):
+    """
+    :param pre_start_date: If given, the transactions numbers of the members between
+    pre_start_date and start_date are also returned (pre_transactions_number), they
+    are counted by Pumpkin whatever the aggregation mode
+    :return: user_id and transactions_number of every population member
+    """
 
-    valid_transactions_df = get_valid_transactions_per_user(
+    if aggregation_mode == AggregationModes.sql or pre_start_date is not None:
+        if transactions_snapshot is not None:
+            population_transactions_df = (
+                transactions_snapshot.get_population_transactions_per_user(
+                    users_ids=users_ids,
+                    start_date=start_date,
+                    end_date=end_date,
+                    pre_start_date=pre_start_date,
+                )
+            )
+        else:
+            population_transactions_df = get_population_transactions_per_user(
+                pumpkin_engine=pumpkin_engine,
+                users_ids=users_ids,
+                start_date=start_date,
+                end_date=end_date,
+                pre_start_date=pre_start_date,
+            )
+        prefix = "owned_" if ownership_is_must else ""
+        population_transactions = {
+            "user_id": population_transactions_df["user_id"],
+            "transactions_number": population_transactions_df[
+                prefix + "transactions_number"
+            ],
+        }
+        if pre_start_date is not None:
+            pre_count_column = prefix + "pre_transactions_number"
+            population_transactions["pre_transactions_number"] = (
+                population_transactions_df[pre_count_column]
+            )
+        return pd.DataFrame(data=population_transactions)
+
+    encoded_transactions_df, users_dictionary = _get_encoded_transactions_per_user(
         pumpkin_engine=pumpkin_engine,
-        ownership_is_must=ownership_is_must,
         start_date=start_date,
         end_date=end_date,
+        transactions_snapshot=transactions_snapshot,
     )
 
-    # We merge data with population users
-    users_df = pd.DataFrame(data=users_ids, columns=["user_id"])
-    logger.info("Merging transactions with population users")
-    population_result = pd.merge(
-        left=users_df, right=valid_transactions_df, on=["user_id"], how="left"
+    logger.info("Matching transactions with population users")
+    count_column = (
+        "owned_transactions_number" if ownership_is_must else "transactions_number"
+    )
+    return pd.DataFrame(
+        data={
+            "user_id": users_ids,
+            "transactions_number": get_members_values(
+                encoded_transactions_df,
+                users_dictionary.encode(users_ids),
+                count_column,
+            ),
+        }
     )
-    population_result.fillna(0, inplace=True)
-    logger.info("Transactions are got for users")
 
-    return population_result
+
+def get_population_activation_counts(
+    pumpkin_engine: Engine,
+    users_ids,
+    ownership_is_must: bool,
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    aggregation_mode: str = AggregationModes.pandas,
+) -> Tuple[int, int]:
+    """
+    :return: The number of active population members (having one transaction, owned
+    one if ownership_is_must) and the number of population members
+    """
+
+    if aggregation_mode == AggregationModes.sql:
+        if transactions_snapshot is not None:
+            counts_df = transactions_snapshot.get_population_activation_counts(
+                users_ids=users_ids, start_date=start_date, end_date=end_date
+            )
+        else:
+            counts_df = get_population_activation_counts_in_pumpkin(
+                pumpkin_engine=pumpkin_engine,
+                users_ids=users_ids,
+                start_date=start_date,
+                end_date=end_date,
+            )
+        count_column = (
+            "owned_active_users_number" if ownership_is_must else "active_users_number"
+        )
+        return int(counts_df[count_column].iloc[0]), int(
+            counts_df["users_number"].iloc[0]
+        )
+
+    encoded_transactions_df, users_dictionary = _get_encoded_transactions_per_user(
+        pumpkin_engine=pumpkin_engine,
+        start_date=start_date,
+        end_date=end_date,
+        transactions_snapshot=transactions_snapshot,
+    )
+    members_codes = np.unique(users_dictionary.encode(users_ids))
+    count_column = (
+        "owned_transactions_number" if ownership_is_must else "transactions_number"
+    )
+
+    return (
+        int(
+            np.count_nonzero(
+                get_members_values(encoded_transactions_df, members_codes, count_column)
+            )
+        ),
+        members_codes.shape[0],
+    )
+
+
+def get_populations_transactions(
+    pumpkin_engine: Engine,
+    populations: Dict[str, np.ndarray],
+    ownership_is_must: bool,
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    The members of all populations are assigned their transactions numbers at once,
+    by the membership index of the populations (pandas aggregation mode only)
+    :return: user_id and transactions_number of every member of each population
+    """
+
+    encoded_transactions_df, users_dictionary = _get_encoded_transactions_per_user(
+        pumpkin_engine=pumpkin_engine,
+        start_date=start_date,
+        end_date=end_date,
+        transactions_snapshot=transactions_snapshot,
+    )
+    count_column = (
+        "owned_transactions_number" if ownership_is_must else "transactions_number"
+    )
+    populations_transactions_numbers = get_populations_index(
+        populations, users_dictionary
+    ).get_populations_values(encoded_transactions_df, count_column)
+
+    return {
+        population_name: pd.DataFrame(
+            data={
+                "user_id": users_ids,
+                "transactions_number": populations_transactions_numbers[
+                    population_name
+                ],
+            }
+        )
+        for population_name, users_ids in populations.items()
+    }
+
+
+def get_populations_activation_counts(
+    pumpkin_engine: Engine,
+    populations: Dict[str, np.ndarray],
+    ownership_is_must: bool,
+    start_date: datetime,
+    end_date: datetime,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+) -> Dict[str, Tuple[int, int]]:
+    """
+    The members of all populations are counted at once, by the membership index of
+    the populations (pandas aggregation mode only)
+    :return: The number of active members (having one transaction, owned one if
+    ownership_is_must) and the number of members of each population
+    """
+
+    encoded_transactions_df, users_dictionary = _get_encoded_transactions_per_user(
+        pumpkin_engine=pumpkin_engine,
+        start_date=start_date,
+        end_date=end_date,
+        transactions_snapshot=transactions_snapshot,
+    )
+    count_column = (
+        "owned_transactions_number" if ownership_is_must else "transactions_number"
+    )
+    populations_index = get_populations_index(populations, users_dictionary)
+    populations_transactions_numbers = populations_index.get_populations_values(
+        encoded_transactions_df, count_column
+    )
+
+    populations_codes = populations_index.get_populations_codes()
+
+    populations_counts = {}
+    for population_name, members_codes in populations_codes.items():
+        # Members are counted once
+        distinct_codes, first_positions = np.unique(members_codes, return_index=True)
+        populations_counts[population_name] = (
+            int(
+                np.count_nonzero(
+                    populations_transactions_numbers[population_name][first_positions]
+                )
+            ),
+            distinct_codes.shape[0],
+        )
+
+    return populations_counts
@@ -0,0 +1,261 @@
+"""
+Cache, in the datalake, of the valid transactions numbers of each user per day.
+Past days of transactions do not change, so each of them is read from Pumpkin once
+and materialized in daily_transactions_count: a window of transactions is then
+counted from its cached full days, and only its partial days (today's one) are
+counted by Pumpkin.
+Late transactions (created in the past but written afterwards) are detected on the
+days younger than revalidation_days: Pumpkin's valid transactions number of each of
+them is compared to the materialized one, the days that differ are materialized
+again.
+"""
+
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, List
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from src.backend.db_models import DailyTransactionsCount, TransactionsPartition
+from src.backend.logger import getLogger
+from src.backend.utils.tests_utils import (
+    count_valid_transactions_per_user,
+    read_sql_by_chunks,
+    TransactionsCountsAccumulator,
+    VALID_TRANSACTION_CONDITIONS,
+)
+
+logger = getLogger().bind(context="Transactions cache")
+
+# Serializes the materializations of all worker processes
+MATERIALIZATION_LOCK_KEY = 20190101
+
+
+def _get_day(date: datetime) -> datetime:
+
+    return datetime(date.year, date.month, date.day)
+
+
+def _get_days(first_day: datetime, end_day: datetime) -> List[datetime]:
+
+    return [
+        first_day + timedelta(days=day_index)
+        for day_index in range((end_day - first_day).days)
+    ]
+
+
+class TransactionsCache:
+    def __init__(
+        self,
+        pumpkin_engine: Engine,
+        datalake_engine: Engine,
+        revalidation_days: int,
+        chunk_size: int,
+    ):
+        """
+        :param revalidation_days: Days younger than this number of days are checked
+        for late transactions
+        :param chunk_size: Rows of daily counts read at once from Pumpkin
+        """
+
+        self.pumpkin_engine = pumpkin_engine
+        self.datalake_engine = datalake_engine
+        self.revalidation_days = revalidation_days
+        self.chunk_size = chunk_size
+        self._lock = Lock()
+
+    def _get_pumpkin_transactions_numbers(
+        self, first_day: datetime, end_day: datetime
+    ) -> Dict[datetime, int]:
+        """
+        :return: The valid transactions number of each day, counted by Pumpkin
+        """
+
+        query = """
+            SELECT
+                DATE_TRUNC('day', created_at) AS day,
+                COUNT(*) AS transactions_number
+            FROM abstract_transaction
+            WHERE created_at >= :first_day AND created_at < :end_day
+            AND {}
+            GROUP BY DATE_TRUNC('day', created_at)
+        """.format(
+            VALID_TRANSACTION_CONDITIONS
+        )
+
+        return {
+            row["day"]: row["transactions_number"]
+            for row in self.pumpkin_engine.execute(
+                text(query), first_day=first_day, end_day=end_day
+            )
+        }
+
+    def _get_days_to_materialize(
+        self, datalake_connection: Connection, first_day: datetime, end_day: datetime
+    ) -> List[datetime]:
+        """
+        :return: The days not yet materialized, and the recent ones having late
+        transactions
+        """
+
+        partitions = TransactionsPartition.get_partitions(
+            datalake_connection, first_day, end_day
+        )
+        days_to_materialize = [
+            day for day in _get_days(first_day, end_day) if day not in partitions
+        ]
+
+        revalidation_day = max(
+            first_day,
+            _get_day(datetime.utcnow()) - timedelta(days=self.revalidation_days),
+        )
+        if revalidation_day < end_day:
+            pumpkin_transactions_numbers = self._get_pumpkin_transactions_numbers(
+                revalidation_day, end_day
+            )
+            late_days = [
+                day
+                for day in _get_days(revalidation_day, end_day)
+                if day in partitions
+                and partitions[day] != pumpkin_transactions_numbers.get(day, 0)
+            ]
+            if late_days:
+                logger.info("Late transactions found", days=late_days)
+            days_to_materialize += late_days
+
+        return sorted(days_to_materialize)
+
+    def _materialize(self, first_day: datetime, end_day: datetime) -> None:
+        """
+        Replaces the transactions numbers per user of the days to materialize by
+        Pumpkin's ones. The days are checked again once the materialization lock is
+        held: another worker process may have materialized them in the meantime.
+        """
+
+        query = """
+            WITH valid_transaction AS (
+                SELECT
+                    DATE_TRUNC('day', created_at) AS day,
+                    CAST(owner_id AS TEXT) AS owner_id,
+                    CAST(credited_person_id AS TEXT) AS credited_person_id,
+                    CAST(debited_person_id AS TEXT) AS debited_person_id
+                FROM abstract_transaction
+                WHERE created_at >= :first_day AND created_at < :end_day
+                AND DATE_TRUNC('day', created_at) = ANY(:days)
+                AND {}
+            ),
+            flattened_transaction AS (
+                SELECT day, owner_id, credited_person_id AS user_id
+                FROM valid_transaction
+                UNION ALL
+                SELECT day, owner_id, debited_person_id AS user_id
+                FROM valid_transaction
+            )
+            SELECT
+                day,
+                user_id,
+                COUNT(*) AS transactions_number,
+                COUNT(*) FILTER (WHERE user_id = owner_id) AS owned_transactions_number
+            FROM flattened_transaction
+            GROUP BY day, user_id
+        """.format(
+            VALID_TRANSACTION_CONDITIONS
+        )
+
+        with self.datalake_engine.begin() as datalake_connection:
+            datalake_connection.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                key=MATERIALIZATION_LOCK_KEY,
+            )
+            days = self._get_days_to_materialize(
+                datalake_connection, first_day, end_day
+            )
+            if not days:
+                return
+            logger.info("Materializing transactions days", days=days)
+
+            # Each transaction is counted for its two users
+            flattened_transactions_numbers = {day: 0 for day in days}
+            DailyTransactionsCount.delete_days(datalake_connection, days)
+            for counts_df in read_sql_by_chunks(
+                pumpkin_engine=self.pumpkin_engine,
+                query=query,
+                params={
+                    "first_day": days[0],
+                    "end_day": days[-1] + timedelta(days=1),
+                    "days": days,
+                },
+                chunk_size=self.chunk_size,
+            ):
+                counts_df["day"] = pd.to_datetime(counts_df["day"])
+                DailyTransactionsCount.insert_counts(datalake_connection, counts_df)
+                for day, transactions_number in (
+                    counts_df.groupby("day")["transactions_number"].sum().items()
+                ):
+                    flattened_transactions_numbers[day.to_pydatetime()] += int(
+                        transactions_number
+                    )
+
+            TransactionsPartition.upsert_partitions(
+                datalake_connection,
+                [
+                    dict(day=day, transactions_number=flattened_number // 2)
+                    for day, flattened_number in flattened_transactions_numbers.items()
+                ],
+                materialized_at=datetime.utcnow(),
+            )
+
+    def count_valid_transactions_per_user(
+        self, start_date: datetime, end_date: datetime
+    ) -> pd.DataFrame:
+        """
+        :return: user_id, transactions_number and owned_transactions_number of every
+        user having at least one valid transaction between start_date and end_date
+        """
+
+        # The full past days of the window are cached
+        first_day = _get_day(start_date)
+        if first_day < start_date:
+            first_day += timedelta(days=1)
+        end_day = min(_get_day(end_date), _get_day(datetime.utcnow()))
+        if first_day >= end_day:
+            return count_valid_transactions_per_user(
+                pumpkin_engine=self.pumpkin_engine,
+                start_date=start_date,
+                end_date=end_date,
+            )
+
+        with self._lock:
+            with self.datalake_engine.connect() as datalake_connection:
+                days_to_materialize = self._get_days_to_materialize(
+                    datalake_connection, first_day, end_day
+                )
+            if days_to_materialize:
+                self._materialize(first_day, end_day)
+
+        accumulator = TransactionsCountsAccumulator()
+        accumulator.add_counts(
+            DailyTransactionsCount.get_counts_per_user(
+                self.datalake_engine, first_day, end_day
+            )
+        )
+        if start_date < first_day:
+            accumulator.add_counts(
+                count_valid_transactions_per_user(
+                    pumpkin_engine=self.pumpkin_engine,
+                    start_date=start_date,
+                    end_date=first_day,
+                    end_date_is_included=False,
+                )
+            )
+        accumulator.add_counts(
+            count_valid_transactions_per_user(
+                pumpkin_engine=self.pumpkin_engine,
+                start_date=end_day,
+                end_date=end_date,
+            )
+        )
+
+        return accumulator.get_counts()
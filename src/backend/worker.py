@@ -1,85 +1,821 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import (
+    Executor,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    as_completed,
+)
 from datetime import datetime, timedelta
+from functools import partial
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import engine
 
 from src.backend.config import Config
-from src.backend.database_service import DatabaseConnection
-from src.backend.db_models import ABTest, TestStatuses
-from src.backend.utils.db_utils import get_test_populations, get_tests_to_compute, get_kpis_by_test
+from src.backend.database_service import (
+    DatabaseConnection,
+    get_datalake_connection,
+    get_pumpkin_connection,
+    limit_concurrency,
+)
+from src.backend.db_models import (
+    ABTest,
+    ABTestResult,
+    KPI,
+    KPIStatistics,
+    SequentialTestResult,
+    TestStatuses,
+)
+from src.backend.utils.db_utils import (
+    get_test_populations,
+    get_tests_to_compute,
+    get_kpis_by_test,
+    get_test_by_id,
+    get_test_statistics,
+)
+from src.backend.incremental_kpi import (
+    update_kpis_counts,
+    get_kpi_counts_for_populations,
+    get_kpi_values_for_populations,
+)
 from src.backend.khi_two_test import KhiTwoTest
-from src.backend.kpi import get_kpi_by_name
+from src.backend.kpi import (
+    compute_amount_kpis_for_populations,
+    compute_kpis_for_populations,
+    get_kpi_by_name,
+    ActivationKPI,
+    AmountKPI,
+    TransactionsKPI,
+)
 from src.backend.logger import getLogger
+from src.backend.resampling_test import ResamplingTest
+from src.backend.sequential_test import SequentialTest
+from src.backend.statistics_engine import (
+    get_sufficient_statistics,
+    ProportionCounts,
+    SufficientStatistics,
+)
+from src.backend.test_leases import TestsClaimer
+from src.backend.tests_scheduler import TestsScheduler
+from src.backend.utils.tests_utils import ABTestPopulations, TransactionsSnapshot
+from src.backend.utils.transactions_cache import TransactionsCache
 
 logger = getLogger().bind(context="worker")
 
 
+class WorkerPools:
+
+    thread = "thread"
+    process = "process"
+    asyncio = "asyncio"
+
+
+class StatisticalTests:
+
+    khi2 = "khi2"
+    resampling = "resampling"
+
+
+class TestRunReport(NamedTuple):
+
+    test_id: int
+    test_name: str
+    error: Optional[str] = None
+    duration_seconds: Optional[float] = None
+
+
+class KPIsResults(NamedTuple):
+
+    # For each KPI, the values of each population members
+    values: Dict[str, Dict[str, pd.DataFrame]]
+    # For each binary KPI, the counts of each population
+    counts: Dict[str, Dict[str, ProportionCounts]]
+
+
 def compute_kpis_for_test(
     pumpkin_connection: DatabaseConnection,
     datalake_connection: DatabaseConnection,
     test: ABTest,
-):
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    kpis_executor: Optional[Executor] = None,
+    test_populations: Optional[ABTestPopulations] = None,
+    kpis_in_db: Optional[List[KPI]] = None,
+) -> KPIsResults:
+    """
+    Binary KPIs (activation) are only counted per population, the values of each
+    member are computed for the other ones
+    :param kpis_executor: If given, the KPIs of the test are computed at once by it
+    :param test_populations: The populations of the test, loaded if not given
+    :param kpis_in_db: The KPIs of the test, loaded if not given
+    """
 
     results_per_kpis = {}
-    test_populations = get_test_populations(
-        datalake_connection=datalake_connection, test_id=test.id
-    )
-    for kpi_in_db in get_kpis_by_test(datalake_connection, test.id):
+    counts_per_kpis = {}
+    if test_populations is None:
+        test_populations = get_test_populations(
+            datalake_connection=datalake_connection, test_id=test.id
+        )
+    if kpis_in_db is None:
+        kpis_in_db = get_kpis_by_test(datalake_connection, test.id)
+    kpis = []
+    for kpi_in_db in kpis_in_db:
         kpi = get_kpi_by_name(kpi_in_db.name)
         if kpi is None:
             logger.error("KPI not found", name=kpi_in_db.name)
             break
-        results_per_kpis[kpi.name] = kpi.compute_values_for_populations(
+        kpis.append(kpi)
+
+    # Transactions KPIs only count the transactions created since the previous run
+    incremental_kpis = []
+    if Config().incremental_kpis:
+        incremental_kpis = [
+            kpi
+            for kpi in kpis
+            if isinstance(kpi, TransactionsKPI) and kpi.can_be_incremental
+        ]
+        update_kpis_counts(
             pumpkin_connection=pumpkin_connection,
             datalake_connection=datalake_connection,
+            test=test,
+            kpis=incremental_kpis,
+            populations=test_populations,
+        )
+
+    binary_kpis_names = {kpi.name for kpi in kpis if isinstance(kpi, ActivationKPI)}
+    # Compiled KPIs are all computed by a single Pumpkin query per population
+    compiled_kpis = [
+        kpi
+        for kpi in kpis
+        if kpi not in incremental_kpis
+        and isinstance(kpi, TransactionsKPI)
+        and kpi.is_compiled
+    ]
+    # Amount KPIs all share a single read of the transactions of each population
+    amount_kpis = [kpi for kpi in kpis if isinstance(kpi, AmountKPI)]
+    kpis_futures = {}
+    for kpi in kpis:
+        if kpi in compiled_kpis or kpi in amount_kpis:
+            continue
+        is_binary = kpi.name in binary_kpis_names
+        if kpi in incremental_kpis:
+            if is_binary:
+                counts_per_kpis[kpi.name] = get_kpi_counts_for_populations(
+                    datalake_connection=datalake_connection, test=test, kpi=kpi
+                )
+                continue
+            results_per_kpis[kpi.name] = get_kpi_values_for_populations(
+                datalake_connection=datalake_connection,
+                test=test,
+                kpi=kpi,
+                populations=test_populations,
+            )
+            continue
+        kpi_parameters = dict(
+            pumpkin_connection=pumpkin_connection,
+            populations=test_populations,
+            start_date=test.start_date,
+            end_date=test.end_date,
+            transactions_snapshot=transactions_snapshot,
+        )
+        if isinstance(kpi, ActivationKPI):
+            compute_kpi = (
+                kpi.compute_counts_for_populations
+            )  # type: Callable[..., dict]
+        else:
+            compute_kpi = kpi.compute_values_for_populations
+            kpi_parameters["datalake_connection"] = datalake_connection
+        if kpis_executor is not None:
+            kpis_futures[kpi.name] = kpis_executor.submit(compute_kpi, **kpi_parameters)
+            continue
+        if is_binary:
+            counts_per_kpis[kpi.name] = compute_kpi(**kpi_parameters)
+        else:
+            results_per_kpis[kpi.name] = compute_kpi(**kpi_parameters)
+
+    if compiled_kpis:
+        compiled_results = compute_kpis_for_populations(
+            pumpkin_connection=pumpkin_connection,
+            kpis=compiled_kpis,
             populations=test_populations,
             start_date=test.start_date,
             end_date=test.end_date,
+            transactions_snapshot=transactions_snapshot,
         )
+        for kpi in compiled_kpis:
+            kpi_results = compiled_results[kpi.name]
+            if not isinstance(kpi, ActivationKPI):
+                results_per_kpis[kpi.name] = kpi_results
+                continue
+            counts_per_kpis[kpi.name] = {
+                population_name: kpi.get_counts(population_values_df)
+                for population_name, population_values_df in kpi_results.items()
+            }
 
-    return results_per_kpis
+    if amount_kpis:
+        results_per_kpis.update(
+            compute_amount_kpis_for_populations(
+                pumpkin_connection=pumpkin_connection,
+                kpis=amount_kpis,
+                populations=test_populations,
+                start_date=test.start_date,
+                end_date=test.end_date,
+            )
+        )
+
+    for kpi_name, kpi_future in kpis_futures.items():
+        if kpi_name in binary_kpis_names:
+            counts_per_kpis[kpi_name] = kpi_future.result()
+        else:
+            results_per_kpis[kpi_name] = kpi_future.result()
+
+    return KPIsResults(
+        values={
+            kpi.name: results_per_kpis[kpi.name]
+            for kpi in kpis
+            if kpi.name in results_per_kpis
+        },
+        counts={
+            kpi.name: counts_per_kpis[kpi.name]
+            for kpi in kpis
+            if kpi.name in counts_per_kpis
+        },
+    )
 
 
 def _run_test(
     datalake_connection: DatabaseConnection,
     pumpkin_connection: DatabaseConnection,
     test: ABTest,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    kpis_executor: Optional[Executor] = None,
+    check_lease: Optional[Callable[[engine.Connection], None]] = None,
 ) -> None:
+    """
+    :param check_lease: If given, called first in the transaction writing the test
+    results, raises if the worker no longer holds the lease of the test
+    """
 
-    # try:
     kpis_results = compute_kpis_for_test(
         pumpkin_connection=pumpkin_connection,
         datalake_connection=datalake_connection,
         test=test,
+        transactions_snapshot=transactions_snapshot,
+        kpis_executor=kpis_executor,
+    )
+    statistics, test_results = compute_test_results(test, kpis_results)
+    write_test_results(
+        datalake_connection=datalake_connection,
+        test=test,
+        statistics=statistics,
+        test_results=test_results,
+        check_lease=check_lease,
     )
 
-    for kpi_name, kpi_result_per_population in kpis_results.items():
-        KhiTwoTest.compute_test(
-            datalake_engine=datalake_connection.engine,
-            test=test,
-            kpi_name=kpi_name,
-            kpi_res_per_population=kpi_result_per_population,
+
+def compute_test_results(
+    test: ABTest, kpis_results: KPIsResults
+) -> Tuple[SufficientStatistics, List[dict]]:
+    """
+    :return: The sufficient statistics of the KPIs of the test and the results of its
+    statistical tests, no database is queried
+    """
+
+    statistics = get_sufficient_statistics(kpis_results.values, kpis_results.counts)
+    if Config().statistical_test == StatisticalTests.resampling:
+        # Binary KPIs are only counted, they are compared by the khi2 test
+        test_results = ResamplingTest.compute_tests(
+            test=test, kpis_results=kpis_results.values
+        ) + KhiTwoTest.compute_tests(
+            test=test, statistics=statistics.select_kpis(list(kpis_results.counts))
+        )
+    else:
+        test_results = KhiTwoTest.compute_tests(test=test, statistics=statistics)
+    logger.info("Kpis results are computed", test_name=test.name)
+
+    return statistics, test_results
+
+
+def write_test_results(
+    datalake_connection: DatabaseConnection,
+    test: ABTest,
+    statistics: SufficientStatistics,
+    test_results: List[dict],
+    check_lease: Optional[Callable[[engine.Connection], None]] = None,
+) -> None:
+
+    # The statistics, results and status of the test are written at once
+    updated_at = datetime.utcnow()
+    with datalake_connection.engine.begin() as db_connection:
+        if check_lease is not None:
+            check_lease(db_connection)
+        KPIStatistics.replace_statistics(
+            db_connection=db_connection,
+            test_id=test.id,
+            window_start=test.start_date,
+            window_end=min(updated_at, test.end_date),
+            statistics=statistics.to_records(),
+            updated_at=updated_at,
         )
-        logger.info(
-            "Kpi results is computed", test_name=test.name, kpi_name=kpi_name
+        ABTestResult.upsert_test_results(db_connection, test_results)
+        is_stopped = Config().sequential_testing and SequentialTest.is_stopped(
+            test,
+            SequentialTestResult.upsert_sequential_results(
+                db_connection,
+                SequentialTest.compute_tests(
+                    test=test,
+                    statistics=statistics,
+                    fixed_mixture_variances=SequentialTestResult.get_mixture_variances(
+                        db_connection, test_id=test.id, start_date=test.start_date
+                    ),
+                ),
+            ),
         )
+        ABTest.update_status(
+            db_connection,
+            test_id=test.id,
+            status=TestStatuses.completed if is_stopped else get_test_status(test),
+            updated_at=updated_at,
+        )
+    logger.info(
+        "Test results and status are updated",
+        test_name=test.name,
+        results_number=len(test_results),
+    )
+
+
+def reevaluate_test(
+    datalake_connection: DatabaseConnection,
+    test: ABTest,
+    control_population_name: Optional[str] = None,
+) -> None:
+    """
+    Computes the test results again from its stored statistics, Pumpkin is not
+    queried
+    """
+
+    statistics = get_test_statistics(datalake_connection, test.id)
+    if statistics is None:
+        logger.info("No statistics stored for the test", test_name=test.name)
+        return
 
-    update_test_status(datalake_connection, test.id)
-    logger.info("Test status is updated", test_name=test.name)
+    test_results = KhiTwoTest.compute_tests(
+        test=test,
+        statistics=statistics,
+        control_population_name=control_population_name,
+    )
+    with datalake_connection.engine.begin() as db_connection:
+        ABTestResult.upsert_test_results(db_connection, test_results)
+    logger.info("Kpis results are computed again", test_name=test.name)
+
+
+def _run_test_safely(
+    datalake_connection: DatabaseConnection,
+    pumpkin_connection: DatabaseConnection,
+    test: ABTest,
+    transactions_snapshot: Optional[TransactionsSnapshot] = None,
+    kpis_executor: Optional[Executor] = None,
+    check_lease: Optional[Callable[[engine.Connection], None]] = None,
+) -> TestRunReport:
+    """
+    Runs the test and reports its failure instead of raising it, so that the other
+    tests of the run are still computed
+    """
+
+    start = perf_counter()
+    try:
+        _run_test(
+            datalake_connection=datalake_connection,
+            pumpkin_connection=pumpkin_connection,
+            test=test,
+            transactions_snapshot=transactions_snapshot,
+            kpis_executor=kpis_executor,
+            check_lease=check_lease,
+        )
     # pylint: disable=W0703
-    # except Exception as e:
-        # logger.error("Error while computing a test", test=test.name, exc=str(e))
+    except Exception as e:
+        logger.error("Error while computing a test", test=test.name, exc=repr(e))
+        return TestRunReport(test_id=test.id, test_name=test.name, error=repr(e))
+
+    return TestRunReport(
+        test_id=test.id,
+        test_name=test.name,
+        duration_seconds=perf_counter() - start,
+    )
+
+
+def get_transactions_snapshot(
+    pumpkin_connection: DatabaseConnection,
+    datalake_connection: DatabaseConnection,
+    max_memory_bytes: int,
+) -> TransactionsSnapshot:
+    """
+    :return: A snapshot for one worker run, reading the transactions cache if it is
+    enabled
+    """
+
+    config = Config()
+    transactions_cache = None
+    if config.transactions_cache:
+        transactions_cache = TransactionsCache(
+            pumpkin_engine=pumpkin_connection.engine,
+            datalake_engine=datalake_connection.engine,
+            revalidation_days=config.transactions_cache_revalidation_days,
+            chunk_size=config.pumpkin_chunk_size,
+        )
+
+    return TransactionsSnapshot(
+        pumpkin_engine=pumpkin_connection.engine,
+        max_memory_bytes=max_memory_bytes,
+        transactions_cache=transactions_cache,
+    )
+
+
+def _get_kpis_executor() -> Optional[Executor]:
+
+    kpi_concurrency = Config().kpi_concurrency
+    if kpi_concurrency <= 1:
+        return None
+    return ThreadPoolExecutor(max_workers=kpi_concurrency)
+
+
+class _WorkerProcessContext(NamedTuple):
+    """
+    The connections, snapshot and KPIs executor owned by one worker process
+    """
+
+    datalake_connection: DatabaseConnection
+    pumpkin_connection: DatabaseConnection
+    transactions_snapshot: TransactionsSnapshot
+    kpis_executor: Optional[Executor]
+
+
+_WORKER_PROCESS_CONTEXT = None  # type: Optional[_WorkerProcessContext]
+
 
+def _init_worker_process(pumpkin_semaphore, snapshot_max_memory_bytes: int) -> None:
 
-def update_test_status(datalake_connection: DatabaseConnection, test_id: int):
+    # pylint: disable=W0603
+    global _WORKER_PROCESS_CONTEXT
+    pumpkin_connection = get_pumpkin_connection()
+    limit_concurrency(pumpkin_connection.engine, pumpkin_semaphore)
+    datalake_connection = get_datalake_connection()
+    _WORKER_PROCESS_CONTEXT = _WorkerProcessContext(
+        datalake_connection=datalake_connection,
+        pumpkin_connection=pumpkin_connection,
+        transactions_snapshot=get_transactions_snapshot(
+            pumpkin_connection=pumpkin_connection,
+            datalake_connection=datalake_connection,
+            max_memory_bytes=snapshot_max_memory_bytes,
+        ),
+        kpis_executor=_get_kpis_executor(),
+    )
+
+
+def _run_test_in_worker_process(test_id: int) -> TestRunReport:
+
+    context = _WORKER_PROCESS_CONTEXT
+    assert context is not None, "The worker process was not initialized"
+    test = get_test_by_id(context.datalake_connection, test_id)
+
+    return _run_test_safely(
+        datalake_connection=context.datalake_connection,
+        pumpkin_connection=context.pumpkin_connection,
+        test=test,
+        transactions_snapshot=context.transactions_snapshot,
+        kpis_executor=context.kpis_executor,
+    )
+
+
+def _run_tests_in_processes(tests: List[ABTest]) -> List[TestRunReport]:
+    """
+    Each worker process builds its own connections and snapshot, the snapshots share
+    the configured memory bound.
+    """
+
+    config = Config()
+    # Processes are spawned so that they never share the parent's sockets
+    mp_context = multiprocessing.get_context("spawn")
+    pumpkin_semaphore = mp_context.BoundedSemaphore(config.pumpkin_max_concurrency)
+
+    with ProcessPoolExecutor(
+        max_workers=config.worker_concurrency,
+        mp_context=mp_context,
+        initializer=_init_worker_process,
+        initargs=(
+            pumpkin_semaphore,
+            config.snapshot_max_memory_mb * 1024 * 1024 // config.worker_concurrency,
+        ),
+    ) as executor:
+        tests_futures = {
+            executor.submit(_run_test_in_worker_process, test.id): test
+            for test in tests
+        }
+        return _get_tests_reports(tests_futures)
+
+
+def _run_tests_in_threads(tests: List[ABTest]) -> List[TestRunReport]:
+    """
+    Threads share the process' pooled connections and the run's snapshot.
+    """
+
+    config = Config()
+    datalake_connection = get_datalake_connection()
+    pumpkin_connection = get_pumpkin_connection()
+    transactions_snapshot = get_transactions_snapshot(
+        pumpkin_connection=pumpkin_connection,
+        datalake_connection=datalake_connection,
+        max_memory_bytes=config.snapshot_max_memory_mb * 1024 * 1024,
+    )
+    kpis_executor = _get_kpis_executor()
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.worker_concurrency) as executor:
+            tests_futures = {
+                executor.submit(
+                    _run_test_safely,
+                    datalake_connection=datalake_connection,
+                    pumpkin_connection=pumpkin_connection,
+                    test=test,
+                    transactions_snapshot=transactions_snapshot,
+                    kpis_executor=kpis_executor,
+                ): test
+                for test in tests
+            }
+            return _get_tests_reports(tests_futures)
+    finally:
+        if kpis_executor is not None:
+            kpis_executor.shutdown()
+
+
+class _AsyncioContext(NamedTuple):
+    """
+    What the tasks of an asyncio run share
+    """
+
+    datalake_connection: DatabaseConnection
+    pumpkin_connection: DatabaseConnection
+    transactions_snapshot: TransactionsSnapshot
+    # Runs the blocking database queries
+    io_executor: Executor
+    # Runs the statistical tests, so that they never hold an I/O thread
+    statistics_executor: Executor
+    kpis_executor: Optional[Executor]
+    # Bounds the tests in progress, and so the memory of their KPIs values
+    tests_semaphore: asyncio.Semaphore
+
+
+async def _run_test_in_task(context: _AsyncioContext, test: ABTest) -> TestRunReport:
+    """
+    The populations and KPIs of the test are loaded at once, and each step of the
+    test runs in its executor: the loop interleaves the steps of all the tests.
+    """
+
+    loop = asyncio.get_event_loop()
+    async with context.tests_semaphore:
+        start = perf_counter()
+        try:
+            test_populations, kpis_in_db = await asyncio.gather(
+                loop.run_in_executor(
+                    context.io_executor,
+                    get_test_populations,
+                    context.datalake_connection,
+                    test.id,
+                ),
+                loop.run_in_executor(
+                    context.io_executor,
+                    get_kpis_by_test,
+                    context.datalake_connection,
+                    test.id,
+                ),
+            )
+            kpis_results = await loop.run_in_executor(
+                context.io_executor,
+                partial(
+                    compute_kpis_for_test,
+                    pumpkin_connection=context.pumpkin_connection,
+                    datalake_connection=context.datalake_connection,
+                    test=test,
+                    transactions_snapshot=context.transactions_snapshot,
+                    kpis_executor=context.kpis_executor,
+                    test_populations=test_populations,
+                    kpis_in_db=kpis_in_db,
+                ),
+            )
+            statistics, test_results = await loop.run_in_executor(
+                context.statistics_executor, compute_test_results, test, kpis_results
+            )
+            await loop.run_in_executor(
+                context.io_executor,
+                partial(
+                    write_test_results,
+                    datalake_connection=context.datalake_connection,
+                    test=test,
+                    statistics=statistics,
+                    test_results=test_results,
+                ),
+            )
+        # pylint: disable=W0703
+        except Exception as e:
+            logger.error("Error while computing a test", test=test.name, exc=repr(e))
+            return TestRunReport(test_id=test.id, test_name=test.name, error=repr(e))
+
+    return TestRunReport(
+        test_id=test.id,
+        test_name=test.name,
+        duration_seconds=perf_counter() - start,
+    )
+
+
+async def _run_tests_in_tasks(
+    context_factory: Callable[[], _AsyncioContext], tests: List[ABTest]
+) -> List[TestRunReport]:
+
+    # The semaphore is bound to the running loop
+    context = context_factory()
+
+    return await asyncio.gather(*[_run_test_in_task(context, test) for test in tests])
+
+
+def _run_tests_asynchronously(tests: List[ABTest]) -> List[TestRunReport]:
+    """
+    One asyncio task per test, WORKER_CONCURRENCY tests being in progress at once.
+    The database drivers are blocking: each query runs in a thread of the I/O
+    executor, sized for the two loading queries of every test in progress.
+    """
+
+    config = Config()
+    datalake_connection = get_datalake_connection()
+    pumpkin_connection = get_pumpkin_connection()
+    transactions_snapshot = get_transactions_snapshot(
+        pumpkin_connection=pumpkin_connection,
+        datalake_connection=datalake_connection,
+        max_memory_bytes=config.snapshot_max_memory_mb * 1024 * 1024,
+    )
+    io_executor = ThreadPoolExecutor(max_workers=2 * config.worker_concurrency)
+    statistics_executor = ThreadPoolExecutor(max_workers=1)
+    kpis_executor = _get_kpis_executor()
+
+    try:
+        return asyncio.run(
+            _run_tests_in_tasks(
+                context_factory=lambda: _AsyncioContext(
+                    datalake_connection=datalake_connection,
+                    pumpkin_connection=pumpkin_connection,
+                    transactions_snapshot=transactions_snapshot,
+                    io_executor=io_executor,
+                    statistics_executor=statistics_executor,
+                    kpis_executor=kpis_executor,
+                    tests_semaphore=asyncio.Semaphore(config.worker_concurrency),
+                ),
+                tests=tests,
+            )
+        )
+    finally:
+        io_executor.shutdown()
+        statistics_executor.shutdown()
+        if kpis_executor is not None:
+            kpis_executor.shutdown()
+
+
+def _get_tests_reports(tests_futures: dict) -> List[TestRunReport]:
 
-    session = datalake_connection.session_maker()
-    test = session.query(ABTest).filter_by(id=test_id).first()
+    tests_reports = []
+    for test_future in as_completed(tests_futures):
+        test = tests_futures[test_future]
+        try:
+            tests_reports.append(test_future.result())
+        # pylint: disable=W0703
+        except Exception as e:
+            # The worker itself has failed (e.g. a killed process)
+            logger.error("Error while computing a test", test=test.name, exc=repr(e))
+            tests_reports.append(
+                TestRunReport(test_id=test.id, test_name=test.name, error=repr(e))
+            )
+
+    return tests_reports
+
+
+def run_tests_in_parallel(tests: List[ABTest]) -> List[TestRunReport]:
+    """
+    Computes the tests at once in a pool of WORKER_CONCURRENCY threads, processes or
+    asyncio tasks (WORKER_POOL), at most PUMPKIN_MAX_CONCURRENCY Pumpkin connections
+    being used at the same time. A failing test does not stop the others.
+    :return: One report per test
+    """
+
+    if Config().worker_pool == WorkerPools.process:
+        tests_reports = _run_tests_in_processes(tests)
+    elif Config().worker_pool == WorkerPools.asyncio:
+        tests_reports = _run_tests_asynchronously(tests)
+    else:
+        tests_reports = _run_tests_in_threads(tests)
+
+    logger.info(
+        "Tests are computed",
+        tests_number=len(tests_reports),
+        failed_tests=[report.test_name for report in tests_reports if report.error],
+    )
+
+    return tests_reports
+
+
+def _run_claimed_tests(
+    tests_claimer: TestsClaimer,
+    datalake_connection: DatabaseConnection,
+    pumpkin_connection: DatabaseConnection,
+    tests: List[ABTest],
+    transactions_snapshot: TransactionsSnapshot,
+    kpis_executor: Optional[Executor],
+) -> List[TestRunReport]:
+    """
+    Claims the tests one by one and computes them, until no test can be claimed
+    """
+
+    tests_per_id = {test.id: test for test in tests}
+    tests_ids = [test.id for test in tests]
+    tests_reports = []  # type: List[TestRunReport]
+    while True:
+        test_id = tests_claimer.claim(tests_ids)
+        if test_id is None:
+            return tests_reports
+
+        test_report = _run_test_safely(
+            datalake_connection=datalake_connection,
+            pumpkin_connection=pumpkin_connection,
+            test=tests_per_id[test_id],
+            transactions_snapshot=transactions_snapshot,
+            kpis_executor=kpis_executor,
+            check_lease=partial(tests_claimer.check_lease, test_id=test_id),
+        )
+        tests_claimer.release(test_id, is_computed=test_report.error is None)
+        tests_reports.append(test_report)
+
+
+def run_tests_distributed(
+    datalake_connection: DatabaseConnection,
+    pumpkin_connection: DatabaseConnection,
+    tests: List[ABTest],
+) -> List[TestRunReport]:
+    """
+    Computes the tests claimed by this worker replica (see test_leases), the other
+    replicas computing the others: WORKER_CONCURRENCY threads claim tests until none
+    is left.
+    :return: One report per test computed by this replica
+    """
+
+    config = Config()
+    transactions_snapshot = get_transactions_snapshot(
+        pumpkin_connection=pumpkin_connection,
+        datalake_connection=datalake_connection,
+        max_memory_bytes=config.snapshot_max_memory_mb * 1024 * 1024,
+    )
+    kpis_executor = _get_kpis_executor()
+
+    try:
+        with TestsClaimer(datalake_connection) as tests_claimer:
+            tests_claimer.add_tests([test.id for test in tests])
+            with ThreadPoolExecutor(max_workers=config.worker_concurrency) as executor:
+                claiming_futures = [
+                    executor.submit(
+                        _run_claimed_tests,
+                        tests_claimer=tests_claimer,
+                        datalake_connection=datalake_connection,
+                        pumpkin_connection=pumpkin_connection,
+                        tests=tests,
+                        transactions_snapshot=transactions_snapshot,
+                        kpis_executor=kpis_executor,
+                    )
+                    for _ in range(config.worker_concurrency)
+                ]
+                tests_reports = [
+                    test_report
+                    for claiming_future in claiming_futures
+                    for test_report in claiming_future.result()
+                ]
+    finally:
+        if kpis_executor is not None:
+            kpis_executor.shutdown()
+
+    logger.info(
+        "Claimed tests are computed",
+        worker_id=tests_claimer.worker_id,
+        tests_number=len(tests_reports),
+        failed_tests=[report.test_name for report in tests_reports if report.error],
+    )
+
+    return tests_reports
+
+
+def get_test_status(test: ABTest) -> str:
 
     if datetime.utcnow() >= test.end_date + timedelta(
         minutes=Config().worker_frequency
     ):
-        test.status = TestStatuses.completed
-    else:
-        test.status = TestStatuses.in_progress
-    session.commit()
+        return TestStatuses.completed
+    return TestStatuses.in_progress
 
 
 def run_tests(
@@ -89,10 +825,44 @@ def run_tests(
     # Find tests that not yet started
     tests = get_tests_to_compute(datalake_connection)
 
-    # We filter
-    for test in tests:
-        _run_test(
+    tests_scheduler = None
+    if Config().tests_scheduling:
+        tests_scheduler = TestsScheduler(datalake_connection, pumpkin_connection)
+        tests = tests_scheduler.schedule(tests, status_getter=get_test_status)
+
+    if Config().distributed_worker:
+        tests_reports = run_tests_distributed(
+            datalake_connection=datalake_connection,
+            pumpkin_connection=pumpkin_connection,
+            tests=tests,
+        )
+        if tests_scheduler is not None:
+            tests_scheduler.record_runs(tests_reports)
+        return
+
+    if Config().worker_concurrency > 1:
+        tests_reports = run_tests_in_parallel(tests)
+        if tests_scheduler is not None:
+            tests_scheduler.record_runs(tests_reports)
+        return
+
+    # Transactions are fetched once per date window and shared by all the tests
+    transactions_snapshot = get_transactions_snapshot(
+        pumpkin_connection=pumpkin_connection,
+        datalake_connection=datalake_connection,
+        max_memory_bytes=Config().snapshot_max_memory_mb * 1024 * 1024,
+    )
+
+    # A failing test does not stop the others
+    tests_reports = [
+        _run_test_safely(
             datalake_connection=datalake_connection,
             pumpkin_connection=pumpkin_connection,
             test=test,
+            transactions_snapshot=transactions_snapshot,
         )
+        for test in tests
+    ]
+
+    if tests_scheduler is not None:
+        tests_scheduler.record_runs(tests_reports)
@@ -1,8 +1,11 @@
 from os import environ
 from typing import NamedTuple
 
-from flask import Flask
+from flask import Flask, g
 from flask_login import LoginManager
+from sqlalchemy.orm import Session
+
+from src.backend.database_service import DatabaseConnection
 
 
 class App(NamedTuple):
@@ -14,6 +17,25 @@ class App(NamedTuple):
 FLASK_APP = None
 
 
+def get_request_session(datalake_connection: DatabaseConnection) -> Session:
+    """
+    :return: The datalake session of the current request, it is closed at the
+    request teardown
+    """
+
+    if "datalake_session" not in g:
+        g.datalake_session = datalake_connection.session_maker()
+    return g.datalake_session
+
+
+# pylint: disable=W0613
+def _close_request_session(exception) -> None:
+
+    session = g.pop("datalake_session", None)
+    if session is not None:
+        session.close()
+
+
 def build_app() -> App:
 
     # pylint: disable=W0603
@@ -28,6 +50,7 @@ def build_app() -> App:
         app.config["SECRET_KEY"] = environ.get(
             "SECRET_KEY", "023af5a0253f5ff468b25fa40fd5d85f"
         )
+        app.teardown_appcontext(_close_request_session)
 
         FLASK_APP = App(flask_app=app, login_manager=login_manager)
 
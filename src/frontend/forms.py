@@ -1,6 +1,5 @@
 from datetime import date, timedelta
 
-import pandas as pd
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import (
@@ -20,7 +19,12 @@ from wtforms.validators import (
     ValidationError,
 )
 
-from src.backend.kpi import get_kpis
+from src.backend.kpi import get_kpis_names
+from src.backend.utils.populations_file import (
+    POPULATIONS_FILE_EXTENSIONS,
+    PopulationsFileError,
+    check_populations_file_columns,
+)
 
 
 class RegistrationForm(FlaskForm):
@@ -75,7 +79,7 @@ class TestForm(FlaskForm):
 
     kpis = SelectMultipleField(
         "kpis",
-        choices=[(kpi.name, kpi.name) for kpi in get_kpis()],
+        choices=[(kpi_name, kpi_name) for kpi_name in get_kpis_names()],
         validators=[DataRequired()],
     )
 
@@ -83,7 +87,8 @@ class TestForm(FlaskForm):
 class TestCreationForm(TestForm):
 
     populations_file = FileField(
-        "Populations file (.xlsx)", validators=[DataRequired(), FileAllowed(["xlsx"])]
+        "Populations file (.xlsx, .csv, .csv.gz or .parquet)",
+        validators=[DataRequired(), FileAllowed(POPULATIONS_FILE_EXTENSIONS)],
     )
 
     submit = SubmitField("Add test")
@@ -91,25 +96,14 @@ class TestCreationForm(TestForm):
     # pylint: disable=R0201
     def validate_populations_file(self, populations_file):
 
-        populations_df = pd.read_excel(io=populations_file.data.stream)
-        columns = list(populations_df.columns)
-        expected_columns = ["user_id", "population_name"]
-        for expected_column in expected_columns:
-            if expected_column not in columns:
-                raise ValidationError(
-                    "Expected column named {}".format(expected_column)
-                )
-        populations_df = populations_df[expected_columns]
-
-        populations_number = populations_df["population_name"].nunique()
-
-        expected_populations_number = 2
-        if populations_number != expected_populations_number:
-            raise ValidationError(
-                "You have given {} populations, we accept {} populations".format(
-                    populations_number, expected_populations_number
-                )
+        # Only the columns are checked here, rows are checked while they are inserted
+        try:
+            check_populations_file_columns(
+                stream=populations_file.data.stream,
+                filename=populations_file.data.filename,
             )
+        except PopulationsFileError as e:
+            raise ValidationError(str(e))
 
 
 class TestUpdateForm(TestForm):
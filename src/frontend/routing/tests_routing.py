@@ -1,18 +1,59 @@
-import pandas as pd
+from typing import List, Optional
+
 from flask import Flask, render_template, url_for, flash, redirect, abort
 from flask_login import login_required
 
 from src.backend.database_service import DatabaseConnection
-from src.backend.db_models import ABTest, KPI, ABTestResult, TestStatuses
+from src.backend.db_models import (
+    ABTest,
+    KPI,
+    ABTestResult,
+    TestStatuses,
+    KPIUserCount,
+    KPIWatermark,
+    KPIStatistics,
+    SequentialTestResult,
+)
 from src.backend.utils.db_utils import (
-    read_populations_file,
     insert_new_test,
     get_all_tests,
     delete_test_by_id,
+    get_test_statistics,
 )
+from src.backend.statistics_engine import SufficientStatistics
+from src.backend.utils.populations_file import read_populations_file
+from src.frontend.flask_app import get_request_session
 from src.frontend.forms import TestCreationForm, TestUpdateForm
 
 
+def _get_populations_statistics(
+    statistics: Optional[SufficientStatistics],
+) -> List[dict]:
+    """
+    :return: The number of members, mean, std, min and max of each KPI and
+    population, computed from the stored statistics
+    """
+    if statistics is None:
+        return []
+
+    mean, std = statistics.mean, statistics.std
+    return [
+        dict(
+            kpi_name=kpi_name,
+            population_name=population_name,
+            users_number=int(statistics.users_number[kpi_index, population_index]),
+            mean=mean[kpi_index, population_index],
+            std=std[kpi_index, population_index],
+            min_value=statistics.minimum[kpi_index, population_index],
+            max_value=statistics.maximum[kpi_index, population_index],
+        )
+        for kpi_index, kpi_name in enumerate(statistics.kpis_names)
+        for population_index, population_name in enumerate(
+            statistics.populations_names
+        )
+    ]
+
+
 def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     @app.route("/tests/all")
     @login_required
@@ -31,8 +72,6 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
         if form.validate_on_submit():
 
             try:
-                populations_df = pd.read_excel(io=form.populations_file.data.stream)
-
                 ab_test = ABTest(
                     name=form.name.data,
                     description=form.description.data,
@@ -40,14 +79,14 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
                     end_date=form.end_date.data,
                     status=TestStatuses.new,
                 )
-                populations = read_populations_file(
-                    test_id=ab_test.id, populations_df=populations_df
-                )
-
+                # The file is streamed to the database chunk by chunk
                 insert_new_test(
                     datalake_connection=datalake_connection,
                     ab_test=ab_test,
-                    populations=populations,
+                    populations_chunks=read_populations_file(
+                        stream=form.populations_file.data.stream,
+                        filename=form.populations_file.data.filename,
+                    ),
                     kpis=form.kpis.data,
                 )
             # pylint: disable=W0703
@@ -65,7 +104,7 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     # pylint: disable=W0612
     def edit_test(test_id):
 
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
 
         test = session.query(ABTest).filter_by(id=test_id).first()
         if test is None:
@@ -99,6 +138,18 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
                     session.query(ABTestResult).filter_by(
                         kpi_name=kpi_to_delete, test_id=test_id
                     ).delete()
+                    session.query(KPIUserCount).filter_by(
+                        kpi_name=kpi_to_delete, test_id=test_id
+                    ).delete()
+                    session.query(KPIWatermark).filter_by(
+                        kpi_name=kpi_to_delete, test_id=test_id
+                    ).delete()
+                    session.query(KPIStatistics).filter_by(
+                        kpi_name=kpi_to_delete, test_id=test_id
+                    ).delete()
+                    session.query(SequentialTestResult).filter_by(
+                        kpi_name=kpi_to_delete, test_id=test_id
+                    ).delete()
                 for kpi_to_add in kpis_to_add:
                     kpi = KPI(test_id=test.id, name=kpi_to_add)
                     session.add(kpi)
@@ -119,7 +170,7 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     # pylint: disable=W0612
     def delete_test(test_id):
 
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
         test = session.query(ABTest).filter_by(id=test_id).first()
 
         if test is None:
@@ -133,6 +184,16 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     @login_required
     # pylint: disable=W0612
     def get_test_results(test_id):
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
         results = session.query(ABTestResult).filter_by(test_id=test_id).all()
-        return render_template("results.html", title="Test results", results=results)
+        sequential_results = (
+            session.query(SequentialTestResult).filter_by(test_id=test_id).all()
+        )
+        statistics = get_test_statistics(datalake_connection, int(test_id))
+        return render_template(
+            "results.html",
+            title="Test results",
+            results=results,
+            sequential_results=sequential_results,
+            populations_statistics=_get_populations_statistics(statistics),
+        )
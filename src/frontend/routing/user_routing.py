@@ -1,9 +1,10 @@
 from flask import Flask, render_template, url_for, redirect, abort, flash
 from flask_login import current_user, login_required
 
-from src.backend.auth_lib import login_user, update_user_password
+from src.backend.auth_lib import login_user, update_user_password, USERS_CACHE
 from src.backend.database_service import DatabaseConnection
 from src.backend.db_models import PattUser, UserStatuses, Roles
+from src.frontend.flask_app import get_request_session
 from src.frontend.forms import ResetPasswordForm
 
 
@@ -13,7 +14,7 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     # pylint: disable=W0612
     def get_users():
 
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
         users = session.query(PattUser).all()
 
         return render_template("users.html", title="Users management", users=users)
@@ -26,10 +27,11 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
         if current_user.role != Roles.admin:
             abort(403)
 
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
         user = session.query(PattUser).filter_by(id=user_id).first()
         user.status = UserStatuses.confirmed
         session.commit()
+        USERS_CACHE.invalidate(user.id)
         return redirect(url_for("get_users"))
 
     @app.route("/users/delete/<user_id>", methods=["GET", "POST"])
@@ -38,9 +40,10 @@ def add_routes(app: Flask, datalake_connection: DatabaseConnection):
     def delete_user(user_id):
         if current_user.role != Roles.admin:
             abort(403)
-        session = datalake_connection.session_maker()
+        session = get_request_session(datalake_connection)
         session.query(PattUser).filter_by(id=user_id).delete()
         session.commit()
+        USERS_CACHE.invalidate(int(user_id))
         return redirect(url_for("get_users"))
 
     @app.route("/users/reset_password", methods=["GET", "POST"])
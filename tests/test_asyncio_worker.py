@@ -0,0 +1,49 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from src.backend import worker
+from src.backend.db_models import ABTest
+
+
+def test_failed_tests_do_not_stop_the_other_tasks(mocker):
+
+    tests = [ABTest(id=test_id, name="test_{}".format(test_id)) for test_id in [1, 2]]
+    mocker.patch.object(worker, "get_test_populations", return_value={})
+    mocker.patch.object(worker, "get_kpis_by_test", return_value=[])
+    mocker.patch.object(
+        worker,
+        "compute_kpis_for_test",
+        side_effect=lambda test, **kwargs: worker.KPIsResults(values={}, counts={}),
+    )
+
+    def compute_test_results(test, kpis_results):
+        if test.id == 2:
+            raise ValueError("failure")
+        return None, []
+
+    mocker.patch.object(
+        worker, "compute_test_results", side_effect=compute_test_results
+    )
+    write_test_results = mocker.patch.object(worker, "write_test_results")
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    tests_reports = asyncio.run(
+        worker._run_tests_in_tasks(
+            context_factory=lambda: worker._AsyncioContext(
+                datalake_connection=None,
+                pumpkin_connection=None,
+                transactions_snapshot=None,
+                io_executor=executor,
+                statistics_executor=executor,
+                kpis_executor=None,
+                tests_semaphore=asyncio.Semaphore(1),
+            ),
+            tests=tests,
+        )
+    )
+    executor.shutdown()
+
+    assert [test_report.test_id for test_report in tests_reports] == [1, 2]
+    assert tests_reports[0].error is None
+    assert tests_reports[1].error == repr(ValueError("failure"))
+    write_test_results.assert_called_once()
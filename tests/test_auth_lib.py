@@ -0,0 +1,49 @@
+from src.backend import auth_lib
+from src.backend.auth_lib import UsersCache
+from src.backend.db_models import PattUser
+
+
+def _mock_clock(mocker, now: float):
+
+    return mocker.patch.object(auth_lib, "monotonic", return_value=now)
+
+
+def test_users_are_kept_until_their_ttl(mocker):
+
+    users_cache = UsersCache(ttl_seconds=30, max_size=10)
+    user = PattUser(id=1, email="user@pumpkin.com")
+    clock = _mock_clock(mocker, 100.0)
+    users_cache.set(1, user)
+
+    clock.return_value = 130.0
+    assert users_cache.get(1) is user
+    clock.return_value = 130.5
+    assert users_cache.get(1) is None
+    assert users_cache.get(2) is None
+
+
+def test_the_oldest_user_is_evicted_when_the_cache_is_full(mocker):
+
+    users_cache = UsersCache(ttl_seconds=30, max_size=2)
+    clock = _mock_clock(mocker, 100.0)
+    for user_id in [1, 2, 3]:
+        clock.return_value += 1
+        users_cache.set(user_id, PattUser(id=user_id))
+
+    assert users_cache.get(1) is None
+    assert [users_cache.get(user_id).id for user_id in [2, 3]] == [2, 3]
+
+
+def test_invalidated_users_are_loaded_again():
+
+    users_cache = UsersCache(ttl_seconds=30, max_size=10)
+    for user_id in [1, 2, 3]:
+        users_cache.set(user_id, PattUser(id=user_id))
+
+    users_cache.invalidate(1)
+    assert users_cache.get(1) is None
+    assert users_cache.get(2) is not None
+
+    users_cache.invalidate()
+    assert users_cache.get(2) is None
+    assert users_cache.get(3) is None
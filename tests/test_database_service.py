@@ -0,0 +1,73 @@
+from threading import BoundedSemaphore, Event, Thread
+
+from src.backend import database_service
+from src.backend.config import Config
+from src.backend.database_service import (
+    _create_connection,
+    get_datalake_connection,
+    get_pool_status,
+    limit_concurrency,
+)
+
+
+def test_pools_are_configured_by_the_config(mocker):
+
+    mocker.patch.object(
+        database_service,
+        "Config",
+        return_value=Config()._replace(
+            db_pool_size=3,
+            db_max_overflow=2,
+            db_pool_timeout=7,
+            db_pool_recycle=600,
+            db_pool_pre_ping=False,
+        ),
+    )
+
+    pool = _create_connection(Config().datalake_url).engine.pool
+
+    assert pool.size() == 3
+    assert pool._max_overflow == 2
+    assert pool._timeout == 7
+    assert pool._recycle == 600
+    assert not pool._pre_ping
+
+
+def test_connections_are_built_once_per_process():
+
+    assert get_datalake_connection() is get_datalake_connection()
+
+
+def test_pool_events_are_counted():
+
+    connection = _create_connection(Config().datalake_url)
+    for _ in range(2):
+        with connection.engine.connect() as db_connection:
+            db_connection.execute("SELECT 1")
+
+    pool_status = get_pool_status("datalake", connection)
+    assert pool_status.connections_opened == 1
+    assert pool_status.checkouts == 2
+    assert pool_status.checked_out == 0
+    connection.engine.dispose()
+
+
+def test_concurrency_is_limited_until_the_connection_is_given_back():
+
+    engine = _create_connection(Config().datalake_url).engine
+    limit_concurrency(engine, BoundedSemaphore(1))
+    connected = Event()
+
+    def connect():
+        with engine.connect():
+            connected.set()
+
+    first_connection = engine.connect()
+    thread = Thread(target=connect)
+    thread.start()
+    assert not connected.wait(0.2)
+
+    first_connection.close()
+    assert connected.wait(5)
+    thread.join()
+    engine.dispose()
@@ -0,0 +1,241 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from src.backend import db_models
+from src.backend.db_models import PATT_SCHEMA_NAME, ABTest, TestStatuses
+
+POPULATIONS_DF = pd.DataFrame(
+    data={
+        "user_id": ["user_1", "007", "NA", "user_4", "user,5"],
+        "population_name": ["A", "A", "B", "B", "B"],
+    }
+)
+
+
+class CursorWithoutCopy:
+    """
+    Cursor of a driver other than psycopg2: it cannot COPY
+    """
+
+    def __init__(self, cursor):
+
+        self._cursor = cursor
+
+    def __getattr__(self, name: str):
+
+        if name == "copy_expert":
+            raise AttributeError(name)
+        return getattr(self._cursor, name)
+
+
+class RawConnectionWithoutCopy:
+    """
+    DBAPI connection of which cursors cannot COPY
+    """
+
+    def __init__(self, raw_connection):
+
+        self._raw_connection = raw_connection
+
+    def cursor(self, *args, **kwargs):
+
+        return CursorWithoutCopy(self._raw_connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name: str):
+
+        return getattr(self._raw_connection, name)
+
+
+def insert_test(datalake_connection, name: str = "test") -> int:
+
+    session = datalake_connection.session_maker()
+    test = ABTest(
+        name=name,
+        description="description",
+        start_date=datetime(2019, 1, 1),
+        end_date=datetime(2019, 2, 1),
+        status=TestStatuses.in_progress,
+    )
+    session.add(test)
+    session.commit()
+    test_id = test.id
+    session.close()
+
+    return test_id
+
+
+def _get_tested_users(datalake_connection, test_id: int) -> list:
+
+    return [
+        tuple(row)
+        for row in datalake_connection.engine.execute(
+            "SELECT user_id, population_name FROM {}.tested_user "
+            "WHERE test_id = {:d} ORDER BY id".format(PATT_SCHEMA_NAME, test_id)
+        )
+    ]
+
+
+@pytest.mark.parametrize("with_copy", [True, False])
+def test_populations_are_inserted_by_chunks(database, mocker, with_copy):
+
+    test_id = insert_test(database)
+
+    with database.engine.begin() as db_connection:
+        if not with_copy:
+            db_connection = mocker.Mock(
+                wraps=db_connection,
+                connection=RawConnectionWithoutCopy(db_connection.connection),
+            )
+        db_models.TestedUser.insert_populations(
+            db_connection, test_id=test_id, populations_df=POPULATIONS_DF, chunk_size=2
+        )
+        if not with_copy:
+            # One multi-rows insert per chunk
+            assert db_connection.execute.call_count == 3
+
+    assert _get_tested_users(database, test_id) == list(
+        zip(POPULATIONS_DF["user_id"], POPULATIONS_DF["population_name"])
+    )
+
+
+def _get_test_result(test_id: int, kpi_name: str, pvalue: float, **bounds) -> dict:
+
+    return dict(
+        test_id=test_id,
+        test_type="khi_two",
+        kpi_name=kpi_name,
+        first_population_name="A",
+        second_population_name="B",
+        first_population_avg=0.1,
+        second_population_avg=0.2,
+        pvalue=pvalue,
+        updated_at=datetime(2019, 1, 2),
+        **bounds
+    )
+
+
+def test_results_are_upserted_with_one_statement(database, mocker):
+
+    test_id = insert_test(database)
+
+    with database.engine.begin() as db_connection:
+        db_models.ABTestResult.upsert_test_results(db_connection, [])
+        db_models.ABTestResult.upsert_test_results(
+            db_connection,
+            [
+                _get_test_result(test_id, "kpi_1", 0.5),
+                _get_test_result(test_id, "kpi_2", 0.5),
+            ],
+        )
+    with database.engine.begin() as db_connection:
+        execute = mocker.spy(db_connection, "execute")
+        db_models.ABTestResult.upsert_test_results(
+            db_connection,
+            [
+                _get_test_result(
+                    test_id,
+                    "kpi_1",
+                    0.01,
+                    difference_lower_bound=0.05,
+                    difference_upper_bound=0.15,
+                ),
+                _get_test_result(test_id, "kpi_3", 0.3),
+            ],
+        )
+        assert execute.call_count == 1
+
+    rows = database.engine.execute(
+        "SELECT kpi_name, pvalue, difference_lower_bound, difference_upper_bound "
+        "FROM {}.test_result WHERE test_id = {:d} "
+        "ORDER BY kpi_name".format(PATT_SCHEMA_NAME, test_id)
+    )
+    assert [tuple(row) for row in rows] == [
+        ("kpi_1", 0.01, 0.05, 0.15),
+        ("kpi_2", 0.5, None, None),
+        ("kpi_3", 0.3, None, None),
+    ]
+
+
+@pytest.mark.parametrize("with_copy", [True, False])
+def test_daily_counts_are_inserted_in_bulk(database, mocker, with_copy):
+
+    counts_df = pd.DataFrame(
+        data={
+            "day": pd.to_datetime(["2019-01-01", "2019-01-01", "2019-01-02"]),
+            "user_id": ["a", "b,c", "a"],
+            "transactions_number": [2, 1, 3],
+            "owned_transactions_number": [1, 0, 3],
+        }
+    )
+
+    with database.engine.begin() as db_connection:
+        if not with_copy:
+            db_connection = mocker.Mock(
+                wraps=db_connection,
+                connection=RawConnectionWithoutCopy(db_connection.connection),
+            )
+        db_models.DailyTransactionsCount.insert_counts(db_connection, counts_df)
+
+    counts_per_user_df = db_models.DailyTransactionsCount.get_counts_per_user(
+        database.engine, datetime(2019, 1, 1), datetime(2019, 1, 3)
+    ).sort_values("user_id")
+    assert counts_per_user_df["user_id"].tolist() == ["a", "b,c"]
+    assert counts_per_user_df["transactions_number"].tolist() == [5, 1]
+    assert counts_per_user_df["owned_transactions_number"].tolist() == [4, 0]
+
+
+def _upsert_sequential_result(
+    datalake_connection, test_id: int, start_date: datetime, pvalue: float, **kwargs
+) -> None:
+
+    with datalake_connection.engine.begin() as db_connection:
+        db_models.SequentialTestResult.upsert_sequential_results(
+            db_connection,
+            [
+                dict(
+                    test_id=test_id,
+                    kpi_name="kpi",
+                    first_population_name="A",
+                    second_population_name="B",
+                    start_date=start_date,
+                    pvalue=pvalue,
+                    updated_at=datetime.utcnow(),
+                    **kwargs
+                )
+            ],
+        )
+
+
+def _get_mixture_variances(datalake_connection, test_id: int, start_date: datetime):
+
+    with datalake_connection.engine.connect() as db_connection:
+        return db_models.SequentialTestResult.get_mixture_variances(
+            db_connection, test_id=test_id, start_date=start_date
+        )
+
+
+def test_mixture_variance_is_kept_until_the_start_date_changes(database):
+
+    test_id = insert_test(database)
+    start_date, new_start_date = datetime(2019, 1, 1), datetime(2019, 1, 5)
+
+    # No variance to fix yet
+    _upsert_sequential_result(database, test_id, start_date, 0.8, mixture_variance=None)
+    assert _get_mixture_variances(database, test_id, start_date) == {}
+    for mixture_variance in [2.0, 3.0]:
+        _upsert_sequential_result(
+            database, test_id, start_date, 0.5, mixture_variance=mixture_variance
+        )
+    assert _get_mixture_variances(database, test_id, start_date) == {
+        ("kpi", "A", "B"): 2.0
+    }
+
+    _upsert_sequential_result(
+        database, test_id, new_start_date, 0.9, mixture_variance=4.0
+    )
+    assert _get_mixture_variances(database, test_id, start_date) == {}
+    assert _get_mixture_variances(database, test_id, new_start_date) == {
+        ("kpi", "A", "B"): 4.0
+    }
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from src.backend import db_models
+from src.backend.utils.db_utils import get_test_populations
+from src.backend.utils.tests_utils import ABTestPopulations
+from tests.test_db_models import POPULATIONS_DF, RawConnectionWithoutCopy, insert_test
+
+
+@pytest.mark.parametrize("with_copy", [True, False])
+def test_populations_are_loaded_as_inserted(database, mocker, with_copy):
+
+    test_id = insert_test(database)
+    other_test_id = insert_test(database, name="other_test")
+    with database.engine.begin() as db_connection:
+        for inserted_test_id in [test_id, other_test_id]:
+            db_models.TestedUser.insert_populations(
+                db_connection, test_id=inserted_test_id, populations_df=POPULATIONS_DF
+            )
+    if not with_copy:
+        raw_connection = database.engine.raw_connection()
+        mocker.patch.object(
+            database.engine,
+            "raw_connection",
+            return_value=RawConnectionWithoutCopy(raw_connection),
+        )
+
+    populations = get_test_populations(database, test_id)
+
+    assert isinstance(populations, ABTestPopulations)
+    assert sorted(populations) == ["A", "B"]
+    # Users ids are kept as they are, "NA" or "007" included
+    np.testing.assert_array_equal(np.sort(populations["A"]), ["007", "user_1"])
+    np.testing.assert_array_equal(np.sort(populations["B"]), ["NA", "user,5", "user_4"])
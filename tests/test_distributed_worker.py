@@ -0,0 +1,50 @@
+from src.backend import worker
+from src.backend.db_models import ABTest
+
+
+class _FakeClaimer:
+    def __init__(self, claimable_tests_ids):
+
+        self.claimable_tests_ids = list(claimable_tests_ids)
+        self.released = []
+
+    def claim(self, tests_ids):
+
+        if not self.claimable_tests_ids:
+            return None
+        return self.claimable_tests_ids.pop(0)
+
+    def check_lease(self, db_connection, test_id):
+        pass
+
+    def release(self, test_id, is_computed):
+
+        self.released.append((test_id, is_computed))
+
+
+def test_claimed_tests_are_computed_and_released(mocker):
+
+    tests = [ABTest(id=test_id, name="test_{}".format(test_id)) for test_id in [1, 2]]
+    mocker.patch.object(
+        worker,
+        "_run_test_safely",
+        side_effect=lambda test, **kwargs: worker.TestRunReport(
+            test_id=test.id,
+            test_name=test.name,
+            error="failure" if test.id == 2 else None,
+        ),
+    )
+    tests_claimer = _FakeClaimer([2, 1])
+
+    tests_reports = worker._run_claimed_tests(
+        tests_claimer=tests_claimer,
+        datalake_connection=None,
+        pumpkin_connection=None,
+        tests=tests,
+        transactions_snapshot=None,
+        kpis_executor=None,
+    )
+
+    assert [test_report.test_id for test_report in tests_reports] == [2, 1]
+    # A failed test is released without being computed, to be claimed again
+    assert tests_claimer.released == [(2, False), (1, True)]
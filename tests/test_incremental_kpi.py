@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.backend import incremental_kpi
+from src.backend.database_service import DatabaseConnection
+from src.backend.db_models import ABTest, KPIWatermark, TestStatuses
+from src.backend.kpi import get_kpi_by_name
+
+POPULATIONS = {"A": np.array(["user_1", "user_2"]), "B": np.array(["user_3"])}
+# Pumpkin is never queried, its counts are mocked
+PUMPKIN_CONNECTION = DatabaseConnection(
+    engine=None, session_maker=None, pool_counters=None
+)
+
+
+def _insert_test(datalake_connection, end_date=datetime(2019, 2, 1)) -> ABTest:
+
+    session = datalake_connection.session_maker()
+    test = ABTest(
+        name="test",
+        description="description",
+        start_date=datetime(2019, 1, 1),
+        end_date=end_date,
+        status=TestStatuses.in_progress,
+    )
+    session.add(test)
+    session.commit()
+    session.refresh(test)
+    session.expunge(test)
+    session.close()
+
+    return test
+
+
+def _advance_watermark(datalake_connection, test, previous_created_at, created_at):
+
+    with datalake_connection.engine.begin() as db_connection:
+        return KPIWatermark.advance_watermark(
+            db_connection,
+            test_id=test.id,
+            kpi_name="kpi",
+            start_date=test.start_date,
+            previous_created_at=previous_created_at,
+            created_at=created_at,
+            updated_at=datetime.utcnow(),
+        )
+
+
+def test_watermark_is_only_advanced_from_the_one_counted_from(database):
+
+    test = _insert_test(database)
+
+    assert _advance_watermark(database, test, None, datetime(2019, 1, 10))
+    # A concurrent run having counted from scratch too
+    assert not _advance_watermark(database, test, None, datetime(2019, 1, 11))
+    assert _advance_watermark(
+        database, test, datetime(2019, 1, 10), datetime(2019, 1, 12)
+    )
+    # A concurrent run having counted from the former watermark
+    assert not _advance_watermark(
+        database, test, datetime(2019, 1, 10), datetime(2019, 1, 13)
+    )
+
+
+def _mock_pumpkin_counts(mocker, transactions_numbers):
+    """
+    :param transactions_numbers: The new transactions number of each user, for each
+    Pumpkin query
+    """
+
+    return mocker.patch.object(
+        incremental_kpi,
+        "get_population_transactions_per_user",
+        side_effect=[
+            pd.DataFrame(
+                data={
+                    "user_id": list(numbers),
+                    "transactions_number": list(numbers.values()),
+                    "owned_transactions_number": list(numbers.values()),
+                }
+            )
+            for numbers in transactions_numbers
+        ],
+    )
+
+
+def _update_counts(datalake_connection, test):
+
+    incremental_kpi.update_kpis_counts(
+        pumpkin_connection=PUMPKIN_CONNECTION,
+        datalake_connection=datalake_connection,
+        test=test,
+        kpis=[get_kpi_by_name("Transactions number")],
+        populations=POPULATIONS,
+    )
+
+
+def _get_counts(datalake_connection, test):
+
+    return dict(
+        datalake_connection.engine.execute(
+            text(
+                "SELECT user_id, transactions_number FROM backend.kpi_user_count "
+                "WHERE test_id = :test_id"
+            ),
+            test_id=test.id,
+        ).fetchall()
+    )
+
+
+def test_new_transactions_are_added_after_the_watermark(database, mocker):
+
+    test = _insert_test(database, end_date=datetime(2100, 1, 1))
+    pumpkin_counts = _mock_pumpkin_counts(
+        mocker, [{"user_1": 2, "user_2": 1}, {"user_1": 1, "user_3": 4}]
+    )
+
+    _update_counts(database, test)
+    _update_counts(database, test)
+
+    first_query, second_query = [
+        call_kwargs for _, call_kwargs in pumpkin_counts.call_args_list
+    ]
+    assert first_query["start_date"] == test.start_date
+    assert first_query["start_date_is_included"]
+    # Transactions younger than the lag are left to the next run
+    assert first_query["end_date"] < datetime.utcnow() - timedelta(seconds=59)
+    assert second_query["start_date"] == first_query["end_date"]
+    assert not second_query["start_date_is_included"]
+    assert _get_counts(database, test) == {"user_1": 3, "user_2": 1, "user_3": 4}
+
+
+def test_transactions_are_counted_up_to_the_test_end(database, mocker):
+
+    test = _insert_test(database)
+    pumpkin_counts = _mock_pumpkin_counts(mocker, [{"user_1": 2}])
+
+    _update_counts(database, test)
+    # Every transaction of the test is already counted
+    _update_counts(database, test)
+
+    assert pumpkin_counts.call_count == 1
+    assert pumpkin_counts.call_args[1]["end_date"] == test.end_date
+    assert _get_counts(database, test) == {"user_1": 2}
+
+
+def test_counts_are_counted_again_to_reconcile_late_transactions(database, mocker):
+
+    test = _insert_test(database, end_date=datetime(2100, 1, 1))
+    pumpkin_counts = _mock_pumpkin_counts(
+        mocker, [{"user_1": 2}, {"user_1": 3, "user_2": 1}]
+    )
+
+    _update_counts(database, test)
+    database.engine.execute(
+        "UPDATE backend.kpi_watermark "
+        "SET recounted_at = recounted_at - INTERVAL '2 days'"
+    )
+    _update_counts(database, test)
+
+    assert pumpkin_counts.call_args[1]["start_date"] == test.start_date
+    assert pumpkin_counts.call_args[1]["start_date_is_included"]
+    assert _get_counts(database, test) == {"user_1": 3, "user_2": 1}
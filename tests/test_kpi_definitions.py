@@ -0,0 +1,35 @@
+from src.backend.kpi import get_kpi_by_name, ActivationKPI, KPIS_DEFINITIONS
+from src.backend.kpi_definitions import compile_kpis, KPIAggregations, KPIDefinition
+
+
+def test_kpis_are_compiled_into_one_column_each():
+
+    aggregates, params = compile_kpis(
+        [
+            KPIDefinition(
+                name="Owned", aggregation=KPIAggregations.count, ownership_is_must=True
+            ),
+            KPIDefinition(
+                name="Transfers",
+                aggregation=KPIAggregations.any,
+                discrs=("transfer", "guest_transfer"),
+            ),
+        ]
+    )
+
+    assert len(aggregates) == 2
+    assert aggregates[0].endswith("AS kpi_0")
+    assert "user_id = flattened_transaction.owner_id" in aggregates[0]
+    assert aggregates[1].endswith("> 0 AS kpi_1")
+    assert ":kpi_1_discrs" in aggregates[1]
+    assert params == {"kpi_1_discrs": ["transfer", "guest_transfer"]}
+
+
+def test_kpi_is_built_from_its_definition():
+
+    kpi = get_kpi_by_name("Owned activation")
+
+    assert isinstance(kpi, ActivationKPI)
+    assert kpi.ownership_is_must
+    assert kpi.definition in KPIS_DEFINITIONS
+    assert get_kpi_by_name("Unknown KPI") is None
@@ -0,0 +1,109 @@
+import gzip
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+from src.backend.utils.populations_file import (
+    PopulationsFileError,
+    read_populations_file,
+)
+
+POPULATIONS_DF = pd.DataFrame(
+    data={
+        "user_id": [1, 2, 3, 4, 5],
+        "population_name": ["A", "B", "A", "B", "A"],
+        "comment": ["x", "y", "z", "t", "u"],
+    }
+)
+
+
+def _write_file(extension: str, populations_df: pd.DataFrame) -> BytesIO:
+
+    populations_file = BytesIO()
+    if extension == "csv":
+        populations_df.to_csv(populations_file, index=False)
+    elif extension == "csv.gz":
+        populations_file.write(
+            gzip.compress(populations_df.to_csv(index=False).encode("utf-8"))
+        )
+    elif extension == "parquet":
+        populations_df.to_parquet(populations_file, index=False)
+    else:
+        populations_df.to_excel(populations_file, index=False)
+    populations_file.seek(0)
+
+    return populations_file
+
+
+@pytest.mark.parametrize("extension", ["csv", "csv.gz", "parquet", "xlsx"])
+def test_populations_file_is_read_by_chunks(extension):
+
+    chunks = list(
+        read_populations_file(
+            stream=_write_file(extension, POPULATIONS_DF),
+            filename="populations.{}".format(extension),
+            chunk_size=2,
+        )
+    )
+
+    assert [chunk.shape[0] for chunk in chunks] == [2, 2, 1]
+    populations_df = pd.concat(chunks)
+    assert list(populations_df.columns) == ["user_id", "population_name"]
+    assert populations_df["user_id"].tolist() == ["1", "2", "3", "4", "5"]
+
+
+def test_populations_number_is_checked():
+
+    with pytest.raises(PopulationsFileError):
+        list(
+            read_populations_file(
+                stream=_write_file("csv", POPULATIONS_DF.assign(population_name="A")),
+                filename="populations.csv",
+            )
+        )
+
+
+def test_populations_columns_are_checked():
+
+    with pytest.raises(PopulationsFileError):
+        list(
+            read_populations_file(
+                stream=_write_file("csv", POPULATIONS_DF[["user_id"]]),
+                filename="populations.csv",
+            )
+        )
+
+
+def test_users_ids_are_not_parsed_as_missing_values():
+
+    chunks = read_populations_file(
+        stream=_write_file(
+            "csv", POPULATIONS_DF.assign(user_id=["NA", "null", "N/A", "nan", "0"])
+        ),
+        filename="populations.csv",
+    )
+
+    assert pd.concat(chunks)["user_id"].tolist() == ["NA", "null", "N/A", "nan", "0"]
+
+
+def test_empty_users_ids_are_rejected():
+
+    with pytest.raises(PopulationsFileError):
+        list(
+            read_populations_file(
+                stream=BytesIO(b"user_id,population_name\n1,A\n,B\n"),
+                filename="populations.csv",
+            )
+        )
+
+
+@pytest.mark.parametrize("filename", ["populations.gz", "populations.json.gz"])
+def test_only_gzipped_csv_files_are_accepted(filename):
+
+    with pytest.raises(PopulationsFileError):
+        list(
+            read_populations_file(
+                stream=_write_file("csv.gz", POPULATIONS_DF), filename=filename
+            )
+        )
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.backend.resampling_engine import get_values_histogram, resample
+
+RANDOM_STATE = np.random.RandomState(0)
+FIRST_VALUES = RANDOM_STATE.poisson(2.0, 300)
+SECOND_VALUES = RANDOM_STATE.poisson(2.5, 280)
+
+
+def _resample(**kwargs):
+
+    parameters = dict(
+        first_histogram=get_values_histogram(FIRST_VALUES, 1000),
+        second_histogram=get_values_histogram(SECOND_VALUES, 1000),
+        iterations=2000,
+        max_chunk_values=5000,
+        seed=[0],
+        confidence_level=0.95,
+    )
+    parameters.update(kwargs)
+    return resample(**parameters)
+
+
+def test_results_only_depend_on_the_seed():
+
+    with ThreadPoolExecutor(2) as executor:
+        assert _resample() == _resample(executor=executor)
+    assert _resample() != _resample(seed=[1])
+
+
+def test_permutation_pvalue_and_bootstrap_interval():
+
+    result = _resample()
+    difference = SECOND_VALUES.mean() - FIRST_VALUES.mean()
+
+    assert result.pvalue < 0.01
+    assert result.difference_lower_bound < difference < result.difference_upper_bound
+    assert result.difference_lower_bound > 0
+
+    same_populations_result = _resample(
+        second_histogram=get_values_histogram(FIRST_VALUES, 1000)
+    )
+    assert same_populations_result.pvalue > 0.4
+
+
+def test_values_are_grouped_in_quantile_bins():
+
+    values = RANDOM_STATE.exponential(10.0, 10000)
+    histogram = get_values_histogram(values, 100)
+
+    assert histogram.values.shape[0] == 100
+    assert histogram.size == values.shape[0]
+    assert np.isclose(histogram.mean, values.mean())
@@ -0,0 +1,332 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from src.backend.db_models import ABTest, KPIStatistics, TestStatuses
+from src.backend.statistics_engine import (
+    adjust_with_covariate,
+    compute_pairwise_chi_square_pvalues,
+    compute_pairwise_msprt_pvalues,
+    get_msprt_mixture_variances,
+    compute_pairwise_pvalues,
+    get_sufficient_statistics,
+    linearize_ratio,
+    ProportionCounts,
+    SufficientStatistics,
+)
+
+VALUES = {
+    "A": np.array([0, 1, 3, 2, 5, 1]),
+    "B": np.array([2, 4, 1, 6, 3]),
+    "C": np.array([1, 1, 0, 2, 0, 1, 4]),
+}
+
+
+def _get_kpis_results():
+
+    return {
+        "transactions_number": {
+            name: pd.DataFrame(data={"value": values})
+            for name, values in VALUES.items()
+        },
+        "activation": {
+            name: pd.DataFrame(data={"value": values > 0})
+            for name, values in VALUES.items()
+        },
+    }
+
+
+def _get_expected_pvalue(values_1, values_2):
+
+    statistic = stats.ttest_ind(values_1, values_2, equal_var=True).statistic
+    return stats.norm.cdf(statistic)
+
+
+def test_pvalues_of_every_kpi_and_pair_are_computed_at_once():
+
+    statistics = get_sufficient_statistics(_get_kpis_results())
+    results = compute_pairwise_pvalues(statistics)
+
+    assert results.first_populations_names == ["A", "A", "B"]
+    assert results.second_populations_names == ["B", "C", "C"]
+    assert results.pvalues.shape == (2, 3)
+    for pair_index, (first_name, second_name) in enumerate(
+        zip(results.first_populations_names, results.second_populations_names)
+    ):
+        assert np.isclose(
+            results.pvalues[0, pair_index],
+            _get_expected_pvalue(VALUES[first_name], VALUES[second_name]),
+        )
+        assert np.isclose(
+            results.pvalues[1, pair_index],
+            _get_expected_pvalue(VALUES[first_name] > 0, VALUES[second_name] > 0),
+        )
+        assert np.isclose(
+            results.second_populations_avg[0, pair_index], VALUES[second_name].mean()
+        )
+
+
+def test_populations_are_compared_to_the_control_one():
+
+    statistics = get_sufficient_statistics(_get_kpis_results())
+    results = compute_pairwise_pvalues(statistics, control_population_name="B")
+
+    assert results.first_populations_names == ["B", "B"]
+    assert results.second_populations_names == ["A", "C"]
+
+
+def test_pvalue_is_one_when_it_can_not_be_computed():
+
+    statistics = get_sufficient_statistics(
+        {
+            "activation": {
+                "A": pd.DataFrame(data={"value": [True, True]}),
+                "B": pd.DataFrame(data={"value": [True]}),
+            }
+        }
+    )
+
+    assert compute_pairwise_pvalues(statistics).pvalues.tolist() == [[1.0]]
+
+
+def test_stored_statistics_give_the_same_pvalues():
+
+    statistics = get_sufficient_statistics(_get_kpis_results())
+
+    stored_statistics = SufficientStatistics.from_records(
+        pd.DataFrame(statistics.to_records()), binary_kpis_names=[]
+    )
+
+    assert np.allclose(
+        compute_pairwise_pvalues(stored_statistics).pvalues,
+        compute_pairwise_pvalues(statistics).pvalues,
+    )
+
+
+def test_only_the_last_window_statistics_are_stored(database):
+
+    session = database.session_maker()
+    test = ABTest(
+        name="test",
+        description="description",
+        start_date=datetime(2019, 1, 1),
+        end_date=datetime(2019, 2, 1),
+        status=TestStatuses.in_progress,
+    )
+    session.add(test)
+    session.commit()
+    test_id = test.id
+    session.close()
+
+    # The same members over two cumulative windows
+    for window_end, values in [
+        (datetime(2019, 1, 10), VALUES["A"]),
+        (datetime(2019, 1, 20), VALUES["A"] + 1),
+    ]:
+        statistics = get_sufficient_statistics(
+            {"transactions_number": {"A": pd.DataFrame(data={"value": values})}}
+        )
+        with database.engine.begin() as db_connection:
+            KPIStatistics.replace_statistics(
+                db_connection,
+                test_id=test_id,
+                window_start=datetime(2019, 1, 1),
+                window_end=window_end,
+                statistics=statistics.to_records(),
+                updated_at=window_end,
+            )
+
+    with database.engine.connect() as db_connection:
+        records_df = KPIStatistics.get_statistics(db_connection, test_id)
+    assert records_df["window_end"].tolist() == [pd.Timestamp(2019, 1, 20)]
+    assert records_df["users_number"].tolist() == [VALUES["A"].shape[0]]
+    assert records_df["values_sum"].tolist() == [(VALUES["A"] + 1).sum()]
+
+
+def test_msprt_pvalue_of_one_pair():
+
+    statistics = get_sufficient_statistics(_get_kpis_results())
+    results = compute_pairwise_msprt_pvalues(
+        statistics, get_msprt_mixture_variances(statistics, 0.5, {})
+    )
+
+    values_1, values_2 = VALUES["A"], VALUES["B"]
+    difference_variance = (
+        values_1.var(ddof=1) / values_1.shape[0]
+        + values_2.var(ddof=1) / values_2.shape[0]
+    )
+    pooled_variance = (
+        (values_1.shape[0] - 1) * values_1.var(ddof=1)
+        + (values_2.shape[0] - 1) * values_2.var(ddof=1)
+    ) / (values_1.shape[0] + values_2.shape[0] - 2)
+    mixture_variance = 0.25 * pooled_variance
+    likelihood_ratio = np.sqrt(
+        difference_variance / (difference_variance + mixture_variance)
+    ) * np.exp(
+        (values_2.mean() - values_1.mean()) ** 2
+        * mixture_variance
+        / (2 * difference_variance * (difference_variance + mixture_variance))
+    )
+
+    assert np.isclose(results.pvalues[0, 0], min(1.0, 1 / likelihood_ratio))
+
+
+def test_msprt_pvalue_decreases_with_the_evidence():
+
+    random_state = np.random.RandomState(0)
+    # The mixture is fixed for the whole test: 0.1 std of a Poisson(2) KPI
+    mixture_variance = np.full((1, 1), 0.1**2 * 2.0)
+    pvalues = []
+    for users_number in [100, 1000, 10000]:
+        statistics = get_sufficient_statistics(
+            {
+                "transactions_number": {
+                    "A": pd.DataFrame(
+                        data={"value": random_state.poisson(2.0, users_number)}
+                    ),
+                    "B": pd.DataFrame(
+                        data={"value": random_state.poisson(2.2, users_number)}
+                    ),
+                }
+            }
+        )
+        pvalues.append(
+            compute_pairwise_msprt_pvalues(statistics, mixture_variance).pvalues[0, 0]
+        )
+
+    assert pvalues[-1] < 0.001
+    assert pvalues[-1] < pvalues[0]
+
+
+def test_msprt_mixture_variances_are_only_computed_when_not_fixed():
+
+    statistics = get_sufficient_statistics(_get_kpis_results())
+    mixture_variance = get_msprt_mixture_variances(statistics, 0.5, {})
+
+    fixed_mixture_variance = get_msprt_mixture_variances(
+        statistics,
+        0.5,
+        {(statistics.kpis_names[0], "A", "B"): 3.0, ("other_kpi", "A", "B"): 4.0},
+    )
+
+    assert fixed_mixture_variance[0, 0] == 3.0
+    np.testing.assert_array_equal(fixed_mixture_variance[1:], mixture_variance[1:])
+
+
+def test_binary_kpis_statistics_are_built_from_counts():
+
+    kpis_results = _get_kpis_results()
+    statistics = get_sufficient_statistics(
+        {"transactions_number": kpis_results["transactions_number"]},
+        {
+            "activation": {
+                name: ProportionCounts(
+                    successes=int((values > 0).sum()), trials=values.shape[0]
+                )
+                for name, values in VALUES.items()
+            }
+        },
+    )
+    expected_statistics = get_sufficient_statistics(kpis_results)
+
+    for field in ["users_number", "sum", "sum_of_squares", "minimum", "maximum"]:
+        assert np.allclose(
+            getattr(statistics, field), getattr(expected_statistics, field)
+        )
+    assert statistics.is_binary.tolist() == [False, True]
+
+
+def test_kpis_are_binary_by_type_not_by_values():
+
+    # Transactions numbers that happen to all be 0 or 1
+    kpis_results = {
+        "transactions_number": {
+            name: pd.DataFrame(data={"value": (values > 0).astype(int)})
+            for name, values in VALUES.items()
+        }
+    }
+    statistics = get_sufficient_statistics(kpis_results)
+    stored_statistics = SufficientStatistics.from_records(
+        pd.DataFrame(statistics.to_records()),
+        binary_kpis_names=["transactions_number"],
+    )
+
+    assert statistics.is_binary.tolist() == [False]
+    assert stored_statistics.is_binary.tolist() == [True]
+
+
+def test_chi_square_pvalues_of_contingency_tables():
+
+    counts = {"A": (30, 200), "B": (45, 210), "C": (20, 190)}
+    statistics = get_sufficient_statistics(
+        {},
+        {
+            "activation": {
+                name: ProportionCounts(successes=successes, trials=trials)
+                for name, (successes, trials) in counts.items()
+            }
+        },
+    )
+    results = compute_pairwise_chi_square_pvalues(statistics)
+
+    for pair_index, (first_name, second_name) in enumerate(
+        zip(results.first_populations_names, results.second_populations_names)
+    ):
+        contingency_table = [
+            [counts[name][0], counts[name][1] - counts[name][0]]
+            for name in [first_name, second_name]
+        ]
+        expected_pvalue = stats.chi2_contingency(contingency_table, correction=False)[1]
+        assert np.isclose(results.pvalues[0, pair_index], expected_pvalue)
+
+
+def test_covariate_adjustment_keeps_means_differences_and_reduces_variances():
+
+    random_state = np.random.RandomState(0)
+    populations_values = {}
+    for name, effect in [("A", 0.0), ("B", 0.5)]:
+        covariates = random_state.poisson(5, size=1000)
+        populations_values[name] = pd.DataFrame(
+            data={
+                "user_id": np.arange(1000),
+                "value": covariates + effect + random_state.normal(size=1000),
+                "covariate": covariates,
+            }
+        )
+
+    adjusted_values = adjust_with_covariate(populations_values)
+
+    assert list(adjusted_values["A"].columns) == ["user_id", "value"]
+    adjusted_difference = (
+        adjusted_values["B"]["value"].mean() - adjusted_values["A"]["value"].mean()
+    )
+    difference = (
+        populations_values["B"]["value"].mean()
+        - populations_values["A"]["value"].mean()
+    )
+    assert abs(adjusted_difference - difference) < 0.1
+    for name in populations_values:
+        assert (
+            adjusted_values[name]["value"].var()
+            < populations_values[name]["value"].var() / 3
+        )
+
+
+def test_linearized_ratio_has_delta_method_variance():
+
+    random_state = np.random.RandomState(0)
+    denominators = random_state.poisson(3, size=500)
+    numerators = denominators * random_state.gamma(2, 10, size=500)
+
+    values = linearize_ratio(numerators, denominators)
+
+    ratio = numerators.sum() / denominators.sum()
+    covariance = np.cov(numerators, denominators)
+    delta_method_variance = (
+        covariance[0, 0] - 2 * ratio * covariance[0, 1] + ratio**2 * covariance[1, 1]
+    ) / (denominators.mean() ** 2 * 500)
+    assert np.isclose(values.mean(), ratio)
+    assert np.isclose(values.var(ddof=1) / 500, delta_method_variance)
+    assert linearize_ratio(np.zeros(3), np.zeros(3)).tolist() == [0.0, 0.0, 0.0]
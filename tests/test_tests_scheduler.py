@@ -0,0 +1,147 @@
+from datetime import datetime
+
+from src.backend import tests_scheduler
+from src.backend.db_models import ABTest, TestStatuses
+
+COMPUTED_AT = datetime(2019, 1, 6)
+
+
+def _get_test(test_id: int, end_day: int) -> ABTest:
+
+    return ABTest(
+        id=test_id,
+        name="test_{}".format(test_id),
+        start_date=datetime(2019, 1, 1),
+        end_date=datetime(2019, 2, end_day),
+        status=TestStatuses.in_progress,
+    )
+
+
+def _get_run(test: ABTest, inputs, duration_seconds: float, deferred_runs: int = 0):
+
+    return dict(
+        test_id=test.id,
+        inputs_signature=inputs.get_signature(test),
+        duration_seconds=duration_seconds,
+        transactions_number=inputs.transactions_number,
+        last_transaction_at=inputs.last_transaction_at,
+        deferred_runs=deferred_runs,
+        computed_at=COMPUTED_AT,
+    )
+
+
+def test_unchanged_tests_are_skipped():
+
+    tests = [_get_test(1, 10), _get_test(2, 10)]
+    inputs = tests_scheduler.TestInputs(
+        transactions_number=10,
+        last_transaction_at=datetime(2019, 1, 5),
+        kpis_names=["activation"],
+    )
+    new_inputs = inputs._replace(transactions_number=11)
+    schedule = tests_scheduler.schedule_tests(
+        tests=tests,
+        runs={test.id: _get_run(test, inputs, 1.0) for test in tests},
+        inputs={1: inputs, 2: new_inputs},
+        budget_seconds=60.0,
+        status_getter=lambda test: TestStatuses.in_progress,
+        reconciliation_date=COMPUTED_AT,
+    )
+
+    assert [test.id for test in schedule.tests] == [2]
+    assert [test.id for test in schedule.skipped_tests] == [1]
+
+    # A test to complete is computed, even without new transactions
+    schedule = tests_scheduler.schedule_tests(
+        tests=tests,
+        runs={test.id: _get_run(test, inputs, 1.0) for test in tests},
+        inputs={1: inputs, 2: inputs},
+        budget_seconds=60.0,
+        status_getter=lambda test: TestStatuses.completed,
+        reconciliation_date=COMPUTED_AT,
+    )
+    assert [test.id for test in schedule.tests] == [1, 2]
+
+
+def test_tests_with_new_kpis_or_to_reconcile_are_computed():
+
+    tests = [_get_test(1, 10), _get_test(2, 10), _get_test(3, 10)]
+    inputs = tests_scheduler.TestInputs(
+        transactions_number=10,
+        last_transaction_at=datetime(2019, 1, 5),
+        kpis_names=["activation"],
+    )
+    runs = {test.id: _get_run(test, inputs, 1.0) for test in tests}
+
+    schedule = tests_scheduler.schedule_tests(
+        tests=tests,
+        runs=runs,
+        inputs={
+            1: inputs,
+            2: inputs._replace(kpis_names=["activation", "transactions_number"]),
+            3: inputs,
+        },
+        budget_seconds=60.0,
+        status_getter=lambda test: TestStatuses.in_progress,
+        reconciliation_date=COMPUTED_AT,
+    )
+    assert [test.id for test in schedule.tests] == [2]
+
+    # Unchanged tests computed too long ago are computed again
+    runs[3]["computed_at"] = datetime(2019, 1, 1)
+    schedule = tests_scheduler.schedule_tests(
+        tests=tests,
+        runs=runs,
+        inputs={test.id: inputs for test in tests},
+        budget_seconds=60.0,
+        status_getter=lambda test: TestStatuses.in_progress,
+        reconciliation_date=COMPUTED_AT,
+    )
+    assert [test.id for test in schedule.tests] == [3]
+
+
+def test_transactions_are_scanned_after_the_last_counted_one():
+
+    test = _get_test(1, 10)
+    inputs = tests_scheduler.TestInputs(
+        transactions_number=10,
+        last_transaction_at=datetime(2019, 1, 5),
+        kpis_names=["activation"],
+    )
+    run = _get_run(test, inputs, 1.0)
+
+    assert tests_scheduler.get_scan_start(test, run, COMPUTED_AT) > datetime(2019, 1, 5)
+    assert tests_scheduler.get_scan_start(test, None, COMPUTED_AT) is None
+    # Every transaction is counted again for a reconciliation or a new window
+    assert tests_scheduler.get_scan_start(test, run, datetime(2019, 1, 7)) is None
+    assert tests_scheduler.get_scan_start(_get_test(1, 12), run, COMPUTED_AT) is None
+
+
+def test_heavy_tests_are_deferred():
+
+    tests = [_get_test(1, 20), _get_test(2, 10), _get_test(3, 15), _get_test(4, 5)]
+    former_inputs = tests_scheduler.TestInputs(
+        transactions_number=100,
+        last_transaction_at=datetime(2019, 1, 5),
+        kpis_names=["activation"],
+    )
+    inputs = former_inputs._replace(transactions_number=200)
+    runs = {
+        1: _get_run(tests[0], former_inputs, 10.0, deferred_runs=1),
+        2: _get_run(tests[1], former_inputs, 20.0),
+        3: _get_run(tests[2], former_inputs, 5.0),
+    }
+
+    schedule = tests_scheduler.schedule_tests(
+        tests=tests,
+        runs=runs,
+        inputs={test.id: inputs for test in tests},
+        budget_seconds=40.0,
+        status_getter=lambda test: TestStatuses.in_progress,
+        reconciliation_date=COMPUTED_AT,
+    )
+
+    # Durations double with the transactions numbers, test 4 has never run: the
+    # deferred test first, then by end date while the budget is not exceeded
+    assert [test.id for test in schedule.tests] == [1, 4, 3]
+    assert [test.id for test in schedule.deferred_tests] == [2]
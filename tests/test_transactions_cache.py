@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.backend.db_models import TransactionsPartition
+from src.backend.utils import transactions_cache
+from src.backend.utils.tests_utils import count_valid_transactions_per_user
+from src.backend.utils.transactions_cache import TransactionsCache
+
+TODAY = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+
+def _create_pumpkin_transactions(database, users_ids_type: str) -> None:
+    """
+    Pumpkin's transactions, in a table of the datalake
+    """
+
+    database.engine.execute(
+        """
+        DROP TABLE IF EXISTS public.abstract_transaction;
+        CREATE TABLE public.abstract_transaction (
+            id SERIAL PRIMARY KEY,
+            owner_id {0},
+            credited_person_id {0},
+            debited_person_id {0},
+            created_at TIMESTAMP,
+            transaction_status TEXT,
+            visibility INTEGER,
+            discr TEXT,
+            amount NUMERIC
+        )
+        """.format(
+            users_ids_type
+        )
+    )
+
+
+@pytest.fixture
+def pumpkin(database):
+
+    _create_pumpkin_transactions(database, "TEXT")
+    yield database.engine
+    database.engine.execute("DROP TABLE public.abstract_transaction")
+
+
+def _insert_transactions(pumpkin_engine, created_ats, users_ids=("a", "b")):
+
+    for created_at in created_ats:
+        pumpkin_engine.execute(
+            """
+            INSERT INTO public.abstract_transaction (owner_id, credited_person_id,
+                debited_person_id, created_at, transaction_status, visibility, discr,
+                amount)
+            VALUES (%s, %s, %s, %s, 'SUCCEEDED', 0, 'transfer', 10)
+            """,
+            (users_ids[0], users_ids[0], users_ids[1], created_at),
+        )
+
+
+def _get_cache(pumpkin_engine) -> TransactionsCache:
+
+    return TransactionsCache(
+        pumpkin_engine=pumpkin_engine,
+        datalake_engine=pumpkin_engine,
+        revalidation_days=3,
+        chunk_size=2,
+    )
+
+
+def _get_counts(counts_df) -> dict:
+
+    return {
+        row.user_id: (row.transactions_number, row.owned_transactions_number)
+        for row in counts_df.itertuples()
+    }
+
+
+def test_only_the_full_days_of_windows_are_cached(pumpkin):
+
+    _insert_transactions(
+        pumpkin,
+        [
+            datetime(2019, 1, 1, 10),
+            datetime(2019, 1, 1, 13),
+            datetime(2019, 1, 2, 8),
+            datetime(2019, 1, 3, 18),
+            datetime(2019, 1, 4, 5),
+            datetime(2019, 1, 4, 7),
+        ],
+    )
+    _insert_transactions(pumpkin, [datetime(2019, 1, 2, 9)], users_ids=("c", "a"))
+    start_date, end_date = datetime(2019, 1, 1, 12), datetime(2019, 1, 4, 6)
+
+    counts_df = _get_cache(pumpkin).count_valid_transactions_per_user(
+        start_date, end_date
+    )
+
+    assert TransactionsPartition.get_partitions(
+        pumpkin, datetime(2019, 1, 1), datetime(2019, 1, 5)
+    ) == {datetime(2019, 1, 2): 2, datetime(2019, 1, 3): 1}
+    assert _get_counts(counts_df) == {"a": (5, 4), "b": (4, 0), "c": (1, 1)}
+    assert _get_counts(counts_df) == _get_counts(
+        count_valid_transactions_per_user(pumpkin, start_date, end_date)
+    )
+
+
+def test_recent_days_are_revalidated(pumpkin):
+
+    cache = _get_cache(pumpkin)
+    old_day, recent_day = TODAY - timedelta(days=5), TODAY - timedelta(days=2)
+    _insert_transactions(pumpkin, [old_day, recent_day])
+    assert _get_counts(cache.count_valid_transactions_per_user(old_day, TODAY)) == {
+        "a": (2, 2),
+        "b": (2, 0),
+    }
+
+    # Late transactions
+    _insert_transactions(
+        pumpkin, [old_day + timedelta(hours=1), recent_day + timedelta(hours=1)]
+    )
+
+    # Only the recent day is materialized again
+    assert _get_counts(cache.count_valid_transactions_per_user(old_day, TODAY)) == {
+        "a": (3, 3),
+        "b": (3, 0),
+    }
+
+
+def test_days_are_checked_again_under_the_materialization_lock(pumpkin, mocker):
+
+    _insert_transactions(pumpkin, [datetime(2019, 1, 2)])
+    cache = _get_cache(pumpkin)
+    read_sql_by_chunks = mocker.spy(transactions_cache, "read_sql_by_chunks")
+
+    # A concurrent worker process materializing the same days right before
+    for _ in range(2):
+        cache._materialize(datetime(2019, 1, 1), datetime(2019, 1, 4))
+
+    assert read_sql_by_chunks.call_count == 1
+    assert TransactionsPartition.get_partitions(
+        pumpkin, datetime(2019, 1, 1), datetime(2019, 1, 4)
+    ) == {datetime(2019, 1, 1): 0, datetime(2019, 1, 2): 1, datetime(2019, 1, 3): 0}
+
+
+def test_users_ids_of_cached_and_partial_days_are_matched(database):
+
+    # Pumpkin's users ids are integers
+    _create_pumpkin_transactions(database, "INTEGER")
+    _insert_transactions(
+        database.engine,
+        [datetime(2019, 1, 1, 13), datetime(2019, 1, 2, 8), datetime(2019, 1, 3, 5)],
+        users_ids=(123, 456),
+    )
+
+    try:
+        counts_df = _get_cache(database.engine).count_valid_transactions_per_user(
+            datetime(2019, 1, 1, 12), datetime(2019, 1, 3, 6)
+        )
+    finally:
+        database.engine.execute("DROP TABLE public.abstract_transaction")
+
+    assert _get_counts(counts_df) == {"123": (3, 3), "456": (3, 0)}
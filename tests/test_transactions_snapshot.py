@@ -0,0 +1,250 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.backend.database_service import get_datalake_connection
+from src.backend.utils import tests_utils
+from src.backend.utils.tests_utils import (
+    ABTestPopulations,
+    TransactionsSnapshot,
+    UsersDictionary,
+    count_valid_transactions_per_user,
+    encode_values_per_user,
+    get_members_values,
+    get_population_transactions,
+    read_sql_by_chunks,
+)
+
+
+def _fake_valid_transactions(
+    pumpkin_engine, start_date, end_date, chunk_size, end_date_is_included=True
+):
+
+    transactions_df = pd.DataFrame(
+        data={
+            "owner_id": ["a", "b", "a"],
+            "credited_person_id": ["a", "b", "c"],
+            "debited_person_id": ["b", "c", "a"],
+        }
+    )
+    for chunk_start in range(0, transactions_df.shape[0], 2):
+        yield tests_utils._flatten_transactions(
+            transactions_df.iloc[chunk_start : chunk_start + 2]
+        )
+
+
+def test_rows_are_read_by_chunks():
+
+    chunks = list(
+        read_sql_by_chunks(
+            pumpkin_engine=get_datalake_connection().engine,
+            query="SELECT generate_series(1, :rows_number) AS value",
+            params={"rows_number": 5},
+            chunk_size=2,
+        )
+    )
+
+    assert [chunk_df["value"].tolist() for chunk_df in chunks] == [[1, 2], [3, 4], [5]]
+
+
+def test_transactions_are_counted_chunk_after_chunk(mocker):
+
+    mocker.patch.object(
+        tests_utils, "_stream_valid_transactions", side_effect=_fake_valid_transactions
+    )
+
+    counts_df = count_valid_transactions_per_user(
+        pumpkin_engine=None,
+        start_date=datetime(2019, 1, 1),
+        end_date=datetime(2019, 2, 1),
+        chunk_size=2,
+    ).sort_values("user_id")
+
+    # "a" and "c" are met in both chunks
+    assert counts_df["user_id"].tolist() == ["a", "b", "c"]
+    assert counts_df["transactions_number"].tolist() == [2, 2, 2]
+    assert counts_df["owned_transactions_number"].tolist() == [2, 1, 0]
+    assert counts_df["transactions_number"].dtype == np.int64
+
+
+def test_snapshot_fetches_each_window_once(mocker):
+
+    get_valid_transactions = mocker.patch.object(
+        tests_utils, "_stream_valid_transactions", side_effect=_fake_valid_transactions
+    )
+    snapshot = TransactionsSnapshot(pumpkin_engine=None, max_memory_bytes=10 ** 6)
+    start_date, end_date = datetime(2019, 1, 1), datetime(2019, 2, 1)
+
+    for ownership_is_must in [True, False]:
+        for users_ids in [["a", "d"], ["b", "c"]]:
+            get_population_transactions(
+                pumpkin_engine=None,
+                users_ids=users_ids,
+                ownership_is_must=ownership_is_must,
+                start_date=start_date,
+                end_date=end_date,
+                transactions_snapshot=snapshot,
+            )
+
+    assert get_valid_transactions.call_count == 1
+
+    owned_df = get_population_transactions(
+        pumpkin_engine=None,
+        users_ids=["a", "b", "c", "d"],
+        ownership_is_must=True,
+        start_date=start_date,
+        end_date=end_date,
+        transactions_snapshot=snapshot,
+    )
+    assert owned_df["transactions_number"].tolist() == [2, 1, 0, 0]
+
+    all_df = get_population_transactions(
+        pumpkin_engine=None,
+        users_ids=["a", "b", "c", "d"],
+        ownership_is_must=False,
+        start_date=start_date,
+        end_date=end_date,
+        transactions_snapshot=snapshot,
+    )
+    assert all_df["transactions_number"].tolist() == [2, 2, 2, 0]
+
+
+def test_snapshot_memory_is_bounded(mocker):
+
+    mocker.patch.object(
+        tests_utils, "_stream_valid_transactions", side_effect=_fake_valid_transactions
+    )
+    snapshot = TransactionsSnapshot(pumpkin_engine=None, max_memory_bytes=1000)
+
+    for day in range(1, 10):
+        snapshot.get_transactions_per_user(
+            start_date=datetime(2019, 1, day), end_date=datetime(2019, 2, 1)
+        )
+        assert snapshot.memory_bytes <= 1000
+    # The locks of evicted entries are not kept
+    assert snapshot._keys_locks == {}
+
+
+def test_users_dictionary_is_renewed_once_too_large(mocker):
+
+    mocker.patch.object(
+        tests_utils, "_stream_valid_transactions", side_effect=_fake_valid_transactions
+    )
+    snapshot = TransactionsSnapshot(pumpkin_engine=None, max_memory_bytes=2000)
+    users_dictionaries = []
+    for day in range(1, 4):
+        (
+            encoded_transactions_df,
+            users_dictionary,
+        ) = snapshot.get_encoded_transactions_per_user(
+            start_date=datetime(2019, 1, day), end_date=datetime(2019, 2, 1)
+        )
+        assert users_dictionary.decode(
+            encoded_transactions_df["user_code"].values
+        ).tolist() == ["a", "b", "c"]
+        users_dictionaries.append(users_dictionary)
+        # Users ids made up to fill the dictionary
+        users_dictionary.encode(["user_{}".format(index) for index in range(20)])
+
+    assert users_dictionaries[0] is not users_dictionaries[1]
+    assert users_dictionaries[1] is not users_dictionaries[2]
+    assert all(key[3] == 2 for key in snapshot._entries)
+
+
+def test_snapshot_shares_sql_aggregates_between_kpis(mocker):
+
+    get_population_transactions_per_user = mocker.patch.object(
+        tests_utils,
+        "get_population_transactions_per_user",
+        return_value=pd.DataFrame(
+            data={
+                "user_id": ["a", "b"],
+                "transactions_number": [3, 0],
+                "owned_transactions_number": [1, 0],
+            }
+        ),
+    )
+    snapshot = TransactionsSnapshot(pumpkin_engine=None, max_memory_bytes=10 ** 6)
+
+    values = {}
+    for ownership_is_must in [True, False]:
+        values[ownership_is_must] = get_population_transactions(
+            pumpkin_engine=None,
+            users_ids=["a", "b"],
+            ownership_is_must=ownership_is_must,
+            start_date=datetime(2019, 1, 1),
+            end_date=datetime(2019, 2, 1),
+            transactions_snapshot=snapshot,
+            aggregation_mode=tests_utils.AggregationModes.sql,
+        )["transactions_number"].tolist()
+
+    assert get_population_transactions_per_user.call_count == 1
+    assert values == {True: [1, 0], False: [3, 0]}
+
+
+def test_members_are_matched_by_their_codes():
+
+    users_dictionary = UsersDictionary()
+    encoded_df = encode_values_per_user(
+        pd.DataFrame(
+            data={"user_id": ["c", "a", "b"], "transactions_number": [3, 1, 2]}
+        ),
+        users_dictionary,
+    )
+
+    assert encoded_df["user_code"].tolist() == [0, 1, 2]
+    assert users_dictionary.decode(encoded_df["user_code"].values).tolist() == [
+        "c",
+        "a",
+        "b",
+    ]
+
+    members_codes = users_dictionary.encode(["b", "d", "c", "b"])
+    assert members_codes.tolist() == [2, 3, 0, 2]
+    assert len(users_dictionary) == 4
+    assert get_members_values(
+        encoded_df, members_codes, "transactions_number"
+    ).tolist() == [2, 0, 3, 2]
+    assert np.array_equal(users_dictionary.encode(["d"]), [3])
+
+
+def test_populations_are_matched_at_once():
+
+    users_dictionary = UsersDictionary()
+    encoded_df = encode_values_per_user(
+        pd.DataFrame(
+            data={"user_id": ["a", "b", "c"], "transactions_number": [1, 2, 3]}
+        ),
+        users_dictionary,
+    )
+    populations = ABTestPopulations({"A": ["c", "d", "a"], "B": ["e", "a"]})
+
+    populations_index = populations.get_index(users_dictionary)
+    assert populations.get_index(users_dictionary) is populations_index
+
+    values = populations_index.get_populations_values(encoded_df, "transactions_number")
+    assert {name: value.tolist() for name, value in values.items()} == {
+        "A": [3, 0, 1],
+        "B": [0, 1],
+    }
+    assert users_dictionary.decode(
+        populations_index.get_populations_codes()["B"]
+    ).tolist() == ["e", "a"]
+
+
+def test_users_dictionary_merges_its_segments():
+
+    users_dictionary = UsersDictionary()
+    first_codes = users_dictionary.encode([str(user) for user in range(100)])
+    for user in range(100, 110):
+        users_dictionary.encode(["x", str(user), str(user)])
+
+    assert len(users_dictionary) == 111
+    assert np.array_equal(
+        users_dictionary.encode([str(user) for user in range(100)]), first_codes
+    )
+    assert users_dictionary.decode(users_dictionary.encode(["105", "x"])).tolist() == [
+        "105",
+        "x",
+    ]
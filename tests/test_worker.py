@@ -0,0 +1,29 @@
+from src.backend import worker
+from src.backend.config import Config
+from src.backend.db_models import ABTest
+
+
+def test_a_failing_test_does_not_stop_the_sequential_run(mocker):
+
+    tests = [ABTest(id=test_id, name="test_{}".format(test_id)) for test_id in [1, 2]]
+    mocker.patch.object(
+        worker,
+        "Config",
+        return_value=Config()._replace(
+            worker_concurrency=1, tests_scheduling=False, distributed_worker=False
+        ),
+    )
+    mocker.patch.object(worker, "get_tests_to_compute", return_value=tests)
+    mocker.patch.object(worker, "get_transactions_snapshot")
+
+    def run_test(test, **kwargs):
+        if test.id == 1:
+            raise ValueError("failure")
+
+    run_test_mock = mocker.patch.object(worker, "_run_test", side_effect=run_test)
+
+    worker.run_tests(datalake_connection=None, pumpkin_connection=None)
+
+    assert [
+        call_kwargs["test"].id for _, call_kwargs in run_test_mock.call_args_list
+    ] == [1, 2]
@@ -1,16 +1,24 @@
 from time import sleep
 
 from src.backend.config import Config
-from src.backend.database_service import get_datalake_connection, get_pumpkin_connection
+from src.backend.database_service import (
+    get_datalake_connection,
+    get_pumpkin_connection,
+    get_pool_status,
+)
 from src.backend.db_models import initialize_db
+from src.backend.logger import getLogger
 from src.backend.worker import run_tests
 
+logger = getLogger().bind(context="worker")
+
 if __name__ == "__main__":
 
     initialize_db(db_engine=get_datalake_connection().engine)
 
     while True:
 
+        # Connections are long-lived: their pools are reused by every run
         datalake_connection = get_datalake_connection()
         pumpkin_connection = get_pumpkin_connection()
         run_tests(
@@ -18,4 +26,13 @@ if __name__ == "__main__":
             pumpkin_connection=pumpkin_connection,
         )
 
+        for database, connection in [
+            ("datalake", datalake_connection),
+            ("pumpkin", pumpkin_connection),
+        ]:
+            logger.info(
+                "Connections pool status",
+                **get_pool_status(database, connection)._asdict()
+            )
+
         sleep(60 * Config().worker_frequency)